@@ -1,22 +1,119 @@
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlparse, urlunparse
+import posixpath
 import os
 import re
 from pathlib import Path
+import codecs
+from email.message import Message
 import hashlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from stockage_blobs import dossier_reprises, dossier_temporaire, fichier_temporaire, stocker_fichier
+from cache_http import AdaptateurCache
+from manifeste import ecrire_manifeste, type_mime
+from mesures import MesuresTache
+from profilage import Profilage
+from politesse import ESSAIS, Ordonnanceur, RepartitionHotes, a_reessayer
+from feuilles_css import chemin_relatif, reecrire_feuille, references_feuille, type_reference
+from flux_html import Balise, lire_page, reecrire_page, remplacer_attribut
+from reprises import Reprise
+from transports import TRANSPORT_DEFAUT, creer_adaptateur
 
-def extraire_site_web(url, dossier_sortie="site_telecharge"):
+# Limites de concurrence par défaut pour le téléchargement des ressources
+MAX_TELECHARGEMENTS = 8
+MAX_PAR_HOTE = 4
+
+# Taille maximale d'un fichier téléchargé (50MB)
+TAILLE_MAX_FICHIER = 50 * 1024 * 1024
+
+# Tailles maximales par type de ressource, modifiables via le paramètre tailles_max
+TAILLES_MAX = {
+    'css': TAILLE_MAX_FICHIER,
+    'js': TAILLE_MAX_FICHIER,
+    'images': TAILLE_MAX_FICHIER,
+    'polices': TAILLE_MAX_FICHIER,
+}
+
+# Taille des blocs lus sur le réseau et écrits sur le disque
+TAILLE_BLOC = 64 * 1024
+
+# Délai d'une requête (secondes), réduit au temps restant quand la tâche a une échéance
+TIMEOUT_REQUETE = 30
+
+# Images en tête de document, sans loading="lazy", téléchargées avant les autres :
+# celles qui ont le plus de chances d'être visibles sans défiler
+IMAGES_PRIORITAIRES = 6
+
+# Balise -> (attribut de l'URL, type de fichier) pour les ressources et les liens de pages
+BALISES_LIENS = {
+    'link': ('href', 'css'),
+    'script': ('src', 'js'),
+    'img': ('src', 'images'),
+    'a': ('href', 'page'),
+}
+
+# Analyseurs HTML utilisables ('lxml' nécessite le paquet lxml)
+PARSEUR_DEFAUT = 'html.parser'
+
+# En-têtes HTTP envoyés avec chaque requête
+EN_TETES = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+def extraire_site_web(url, dossier_sortie="site_telecharge", max_telechargements=MAX_TELECHARGEMENTS,
+                      max_par_hote=MAX_PAR_HOTE, tailles_max=None, dossier_blobs=None,
+                      dossier_cache=None, progression=None, parseur=PARSEUR_DEFAUT, dossier_profils=None,
+                      ordonnanceur=None, delai_max=None, memoire_reduite=False,
+                      transport=TRANSPORT_DEFAUT, dossier_capture=None):
     """
     Télécharge une page web et tous ses fichiers CSS/JS
 
     Args:
         url (str): L'URL du site à télécharger
         dossier_sortie (str): Le dossier où sauvegarder les fichiers
+        max_telechargements (int): Nombre maximum de téléchargements simultanés
+        max_par_hote (int): Nombre maximum de téléchargements simultanés vers un même hôte
+        tailles_max (dict): Taille maximale en octets par type ('css', 'js', 'images', 'polices')
+        dossier_blobs (str): Stockage adressé par contenu partagé entre tâches (optionnel)
+        dossier_cache (str): Dossier du cache HTTP persistant (optionnel)
+        progression (dict): Dictionnaire mis à jour au fil de la tâche avec 'etape',
+            'ressources_total' et 'ressources_terminees' (optionnel)
+        parseur (str): Analyseur HTML de BeautifulSoup ('html.parser' ou 'lxml', plus rapide)
+        dossier_profils (str): Si fourni, la tâche est profilée (cProfile et tracemalloc)
+            et son profil écrit dans ce dossier (voir profilage.py)
+        ordonnanceur (Ordonnanceur): Limites par hôte partagées avec d'autres tâches
+            (débit, robots.txt, Retry-After) ; par défaut, seul max_par_hote s'applique
+        delai_max (float): Temps total accordé à la tâche, en secondes (optionnel).
+            Les ressources sont demandées par priorité (CSS, JS, images du haut
+            de la page, autres images) ; à l'échéance, celles qui restent sont
+            ignorées et gardent leur URL d'origine dans index_local.html
+        memoire_reduite (bool): Pour les très grandes pages : la page est écrite
+            sur le disque au fil de sa réception, analysée et réécrite en flux
+            (voir flux_html.py) sans BeautifulSoup. 'html_original' reste alors
+            vide : la page est dans le fichier 'html_fichier' ('html_taille' octets)
+        transport (str): Transport HTTP de la tâche : 'requests', 'http2',
+            'enregistrement' ou 'rejeu' (voir transports.py)
+        dossier_capture (str): Dossier où les réponses sont enregistrées, ou
+            d'où elles sont rejouées sans réseau (transports 'enregistrement' et 'rejeu')
 
     Returns:
-        dict: Informations sur les fichiers téléchargés
+        dict: Informations sur les fichiers téléchargés, avec les durées des
+        phases et les compteurs de la tâche dans 'mesures' (voir mesures.py),
+        les ressources ignorées faute de temps dans 'ignorees' et le résumé du
+        profil dans 'profil' si la tâche a été profilée
     """
+    if dossier_profils:
+        with Profilage(dossier_profils, os.path.basename(os.path.normpath(dossier_sortie))) as profil:
+            resultats = extraire_site_web(url, dossier_sortie, max_telechargements, max_par_hote, tailles_max,
+                                          dossier_blobs, dossier_cache, progression, parseur,
+                                          ordonnanceur=ordonnanceur, delai_max=delai_max,
+                                          memoire_reduite=memoire_reduite, transport=transport,
+                                          dossier_capture=dossier_capture)
+        resultats['profil'] = profil.resume
+        return resultats
 
     # Valider l'URL
     if not url or not isinstance(url, str) or not url.startswith(('http://', 'https://')):
@@ -24,142 +121,825 @@ def extraire_site_web(url, dossier_sortie="site_telecharge"):
 
     # Créer le dossier de sortie
     Path(dossier_sortie).mkdir(exist_ok=True)
+    echeance = time.monotonic() + delai_max if delai_max else None
     
     # Session pour maintenir les cookies/headers
-    session = requests.Session()
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    })
+    if ordonnanceur is None:
+        ordonnanceur = Ordonnanceur(max_par_hote)
+    session, adaptateur = creer_session(max_telechargements, dossier_cache, ordonnanceur, transport,
+                                        dossier_capture)
     
-    resultats = {
-        'html_original': '',
-        'fichiers_css': [],
-        'fichiers_js': [],
-        'images': [],
-        'erreurs': [],
-        'url_vers_fichier': {}  # Mapping URL -> fichier local pour une correspondance exacte
-    }
+    resultats = creer_resultats()
+    mesures = MesuresTache()
+    if progression is None:
+        progression = {}
+    progression.update({'etape': 'page', 'ressources_total': 0, 'ressources_terminees': 0})
     
     try:
         # Télécharger la page principale
         print(f"Téléchargement de {url}...")
-        response = session.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Parser le HTML
-        soup = BeautifulSoup(response.content, 'html.parser')
-        resultats['html_original'] = response.text
-        
-        # Sauvegarder le HTML original
-        with open(f"{dossier_sortie}/index.html", 'w', encoding='utf-8') as f:
-            f.write(response.text)
-        
-        # Extraire et télécharger les fichiers CSS
-        for link in soup.find_all('link', rel='stylesheet'):
-            href = link.get('href')
-            if href:
-                css_url = urljoin(url, href)
-                nom_fichier = telecharger_fichier(session, css_url, dossier_sortie, 'css')
-                if nom_fichier:
-                    resultats['fichiers_css'].append({
-                        'url_original': css_url,
-                        'fichier_local': nom_fichier
-                    })
-                    resultats['url_vers_fichier'][css_url] = nom_fichier
-        
-        # Extraire et télécharger les fichiers JavaScript
-        for script in soup.find_all('script', src=True):
-            src = script.get('src')
-            if src:
-                js_url = urljoin(url, src)
-                nom_fichier = telecharger_fichier(session, js_url, dossier_sortie, 'js')
-                if nom_fichier:
-                    resultats['fichiers_js'].append({
-                        'url_original': js_url,
-                        'fichier_local': nom_fichier
-                    })
-                    resultats['url_vers_fichier'][js_url] = nom_fichier
-        
-        # Extraire et télécharger les images
-        for img in soup.find_all('img', src=True):
-            src = img.get('src')
-            if src:
-                img_url = urljoin(url, src)
-                nom_fichier = telecharger_fichier(session, img_url, dossier_sortie, 'images')
-                if nom_fichier:
-                    resultats['images'].append({
-                        'url_original': img_url,
-                        'fichier_local': nom_fichier
-                    })
-                    resultats['url_vers_fichier'][img_url] = nom_fichier
-        
+        chemin_page = f"{dossier_sortie}/index.html"
+        if memoire_reduite:
+            # La page va directement sur le disque, puis est analysée en flux
+            with mesures.phase('page'):
+                encodage = telecharger_page(session, ordonnanceur, url, chemin_page, resultats, echeance)
+                mesures.transfert(resultats['html_taille'])
+            with mesures.phase('analyse'):
+                ressources = analyser_page_en_flux(chemin_page, url, encodage)
+        else:
+            with mesures.phase('page'):
+                response = obtenir_page(session, ordonnanceur, url, echeance)
+                response.raise_for_status()
+                mesures.transfert(len(response.content))
+
+            # Parser le HTML
+            with mesures.phase('analyse'):
+                soup = BeautifulSoup(response.content, parseur)
+            resultats['html_original'] = response.text
+
+            # Sauvegarder le HTML original
+            with mesures.phase('ecriture'):
+                with open(chemin_page, 'w', encoding='utf-8') as f:
+                    f.write(response.text)
+
+            # Collecter en un seul parcours les ressources et les liens à réécrire
+            with mesures.phase('analyse'):
+                ressources, noeuds = analyser_page(soup, url)
+
+        # Télécharger les ressources en parallèle
+        progression['etape'] = 'ressources'
+        table = TableUrls(max_par_hote, ordonnanceur, echeance)
+        with mesures.phase('ressources'):
+            telecharger_ressources(session, ressources, dossier_sortie, resultats,
+                                   max_telechargements, max_par_hote, tailles_max, dossier_blobs,
+                                   progression, table, mesures)
+
+        # Suivre les @import et url() des feuilles de style, puis les réécrire
+        with mesures.phase('css'):
+            traiter_feuilles_css(session, dossier_sortie, resultats, max_telechargements, max_par_hote,
+                                 tailles_max, dossier_blobs, progression, table, mesures)
+
         # Ajouter l'URL de base pour la correspondance des liens
         resultats['base_url'] = url
+        if resultats['ignorees']:
+            print(f"⏱️ Échéance atteinte : {len(resultats['ignorees'])} ressource(s) ignorée(s)")
 
-        # Créer un HTML modifié avec les liens locaux
-        html_modifie = modifier_liens_locaux(soup, resultats)
-        with open(f"{dossier_sortie}/index_local.html", 'w', encoding='utf-8') as f:
-            f.write(str(html_modifie))
+        # Créer un HTML modifié avec les liens locaux, sans analyser la page une seconde fois
+        progression['etape'] = 'liens'
+        if memoire_reduite:
+            with mesures.phase('liens'):
+                reecrire_page_en_flux(chemin_page, f"{dossier_sortie}/index_local.html", url, encodage, resultats)
+        else:
+            with mesures.phase('liens'):
+                reecrire_liens(noeuds, resultats)
+                html_local = str(soup)
+            with mesures.phase('ecriture'):
+                with open(f"{dossier_sortie}/index_local.html", 'w', encoding='utf-8') as f:
+                    f.write(html_local)
+
+        # Décrire une fois pour toutes les fichiers produits
+        with mesures.phase('manifeste'):
+            ecrire_manifeste(resultats, dossier_sortie)
+        progression['etape'] = 'termine'
         
         print(f"✅ Téléchargement terminé dans le dossier '{dossier_sortie}'")
         
     except Exception as e:
         resultats['erreurs'].append(f"Erreur principale: {str(e)}")
+        mesures.erreur('page')
         print(f"❌ Erreur: {e}")
+
+    resultats['mesures'] = mesures.en_dict()
+    if isinstance(adaptateur, AdaptateurCache):
+        resultats['cache'] = dict(adaptateur.statistiques)
+        adaptateur.cache.evincer()
+    session.close()
     
     return resultats
 
-def telecharger_fichier(session, url, dossier_base, type_fichier):
+CLES_RESULTATS = {'css': 'fichiers_css', 'js': 'fichiers_js', 'images': 'images', 'polices': 'polices'}
+
+def creer_session(max_telechargements=MAX_TELECHARGEMENTS, dossier_cache=None, ordonnanceur=None,
+                  transport=TRANSPORT_DEFAUT, dossier_capture=None):
     """
-    Télécharge un fichier spécifique
+    Crée la session HTTP d'une tâche
+
+    Toutes les requêtes de la tâche passent par l'adaptateur du transport
+    choisi (voir transports.py). Avec un ordonnanceur, chaque réponse lui
+    est transmise pour qu'il applique les Retry-After des réponses 429 et 503.
+
+    Returns:
+        tuple: (requests.Session, adaptateur monté sur http:// et https://)
+    """
+    session = requests.Session()
+    session.headers.update(EN_TETES)
+    # Agrandir le pool de connexions pour les téléchargements parallèles
+    adaptateur = creer_adaptateur(transport, max(max_telechargements, 10), dossier_cache, dossier_capture)
+    session.mount('http://', adaptateur)
+    session.mount('https://', adaptateur)
+    if ordonnanceur is not None:
+        session.hooks['response'].append(ordonnanceur.crochet_reponse)
+    return session, adaptateur
+
+def obtenir_page(session, ordonnanceur, url, echeance=None, stream=False):
+    """
+    Télécharge une page dans un créneau de son hôte
+
+    Une réponse 429 ou 503 avec Retry-After est redemandée (ESSAIS fois au
+    plus) une fois la pause de l'hôte écoulée. Avec stream, seuls les en-têtes
+    sont lus : le corps reste à lire (et la réponse à fermer) par l'appelant.
     """
+    ordonnanceur.preparer(session, url, echeance)
+    for essai in range(ESSAIS):
+        with ordonnanceur.creneau(url):
+            response = session.get(url, timeout=timeout_requete(echeance), stream=stream)
+        if not a_reessayer(response.status_code, response.headers) or essai == ESSAIS - 1:
+            return response
+        response.close()
+
+def telecharger_page(session, ordonnanceur, url, chemin, resultats, echeance=None):
+    """
+    Écrit une page dans chemin au fil de sa réception, sans la garder en mémoire
+
+    Renseigne 'html_fichier' et 'html_taille' (octets) dans resultats.
+
+    Returns:
+        str: Encodage de la page (celui annoncé par le serveur, UTF-8 par défaut)
+    """
+    with obtenir_page(session, ordonnanceur, url, echeance, stream=True) as response:
+        response.raise_for_status()
+        morceaux = response.iter_content(TAILLE_BLOC)
+        if echeance is not None:
+            morceaux = avant_echeance(morceaux, echeance)
+        # Pas de limite de taille : ce mode est fait pour les pages démesurées
+        resultats['html_taille'] = ecrire_flux(morceaux, chemin, float('inf'))[0]
+        resultats['html_fichier'] = chemin
+        # Sans charset annoncé, UTF-8 (requests supposerait ISO-8859-1 pour text/html)
+        en_tete = Message()
+        en_tete['Content-Type'] = response.headers.get('Content-Type', '')
+        encodage = en_tete.get_content_charset() or 'utf-8'
     try:
-        # Vérifier que l'URL est valide
-        if not url or not url.startswith(('http://', 'https://')):
-            print(f"  ❌ URL invalide: {url}")
+        codecs.lookup(encodage)
+    except LookupError:
+        encodage = 'utf-8'
+    return encodage
+
+def normaliser_url(url):
+    """
+    Normalise une URL pour comparer des pages entre elles
+
+    Schéma et hôte en minuscules, port par défaut retiré, chemin résolu
+    ('.' et '..'), fragment supprimé. La requête est conservée telle quelle.
+    """
+    parsed = urlparse(url)
+    schema = parsed.scheme.lower()
+    hote = (parsed.hostname or '').lower()
+    if parsed.port and (schema, parsed.port) not in (('http', 80), ('https', 443)):
+        hote = f"{hote}:{parsed.port}"
+    chemin = parsed.path or '/'
+    chemin_normalise = posixpath.normpath(chemin)
+    if chemin.endswith('/') and chemin_normalise != '/':
+        chemin_normalise += '/'
+    return urlunparse((schema, hote, chemin_normalise, parsed.params, parsed.query, ''))
+
+def creer_resultats():
+    """
+    Crée un dictionnaire de résultats vide
+    """
+    return {
+        'html_original': '',
+        'fichiers_css': [],
+        'fichiers_js': [],
+        'images': [],
+        'polices': [],
+        'ignorees': [],  # Ressources non téléchargées faute de temps (url, type)
+        'erreurs': [],
+        'url_vers_fichier': {}  # Mapping URL -> fichier local pour une correspondance exacte
+    }
+
+class RessourcesPage:
+    """
+    Ressources d'une page rangées par ordre de priorité (CSS, JS, images du
+    haut de la page, autres images), relevées balise par balise
+
+    Une même URL relative n'est résolue qu'une fois par page.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._par_type = {'css': [], 'js': [], 'images': [], 'differees': []}
+        self._urls_absolues = {}
+
+    def ajouter(self, nom, attributs):
+        """
+        Relève le lien porté par une balise
+
+        Args:
+            nom (str): Nom de la balise
+            attributs: Balise BeautifulSoup ou dictionnaire des attributs
+
+        Returns:
+            tuple: (attribut, url absolue, type_fichier), ou None si la balise
+            ne porte pas de lien à suivre
+        """
+        if nom not in BALISES_LIENS:
             return None
+        attribut, type_fichier = BALISES_LIENS[nom]
+        valeur = attributs.get(attribut)
+        if not valeur:
+            return None
+        if type_fichier == 'css':
+            rel = attributs.get('rel') or []
+            if 'stylesheet' not in (rel.split() if isinstance(rel, str) else rel):
+                return None
 
-        response = session.get(url, timeout=30)
-        response.raise_for_status()
+        url_absolue = self._urls_absolues.get(valeur)
+        if url_absolue is None:
+            url_absolue = self._urls_absolues[valeur] = urljoin(self.base_url, valeur)
+
+        if type_fichier == 'images' and (attributs.get('loading') == 'lazy'
+                                         or len(self._par_type['images']) >= IMAGES_PRIORITAIRES):
+            self._par_type['differees'].append((url_absolue, type_fichier))
+        elif type_fichier != 'page':
+            self._par_type[type_fichier].append((url_absolue, type_fichier))
+        return attribut, url_absolue, type_fichier
+
+    def liste(self):
+        """Tuples (url absolue, type_fichier) par ordre de priorité"""
+        par_type = self._par_type
+        return par_type['css'] + par_type['js'] + par_type['images'] + par_type['differees']
+
+def analyser_page(soup, base_url):
+    """
+    Parcourt la page une seule fois pour trouver les ressources et les liens à réécrire
+
+    Returns:
+        tuple: (ressources, noeuds) où ressources est la liste des tuples
+        (url absolue, type_fichier) par ordre de priorité (CSS, JS, images du
+        haut de la page, autres images), et noeuds la liste des tuples
+        (balise, attribut, url absolue, type) à réécrire
+    """
+    ressources = RessourcesPage(base_url)
+    noeuds = []
+    for balise in soup.find_all(list(BALISES_LIENS)):
+        lien = ressources.ajouter(balise.name, balise)
+        if lien is not None:
+            attribut, url_absolue, type_fichier = lien
+            noeuds.append((balise, attribut, url_absolue, type_fichier))
+    return ressources.liste(), noeuds
+
+def extraire_ressources(soup, base_url):
+    """
+    Liste les ressources (CSS, JS, images) référencées par la page
+
+    Returns:
+        list: Tuples (url absolue, type_fichier) par ordre de priorité (CSS, JS, images)
+    """
+    return analyser_page(soup, base_url)[0]
+
+class CiblesLiens:
+    """
+    Nouvelle valeur des liens d'une page, d'après les fichiers téléchargés
+
+    Les ressources ignorées faute de temps pointent vers leur URL absolue d'origine.
+
+    Args:
+        resultats (dict): Résultats contenant 'url_vers_fichier' et, en mode
+            exploration, 'pages_locales' (URL normalisée -> fichier de la page)
+        dossier_page (str): Si fourni, les chemins sont écrits relativement à ce dossier
+    """
+
+    def __init__(self, resultats, dossier_page=None):
+        self.url_vers_fichier = resultats['url_vers_fichier']
+        self.pages_locales = resultats.get('pages_locales')
+        self.ignorees = {ressource['url'] for ressource in resultats.get('ignorees', [])}
+        self.dossier_page = dossier_page
+
+    def chemin_local(self, chemin):
+        return os.path.relpath(chemin, self.dossier_page) if self.dossier_page else chemin
+
+    def cible(self, url_absolue, type_fichier):
+        """Nouvelle valeur du lien, ou None pour le laisser tel quel"""
+        if type_fichier != 'page':
+            if url_absolue in self.url_vers_fichier:
+                return self.chemin_local(self.url_vers_fichier[url_absolue])
+            if url_absolue in self.ignorees:
+                return url_absolue
+        elif self.pages_locales:
+            page_url, diese, fragment = url_absolue.partition('#')
+            fichier_page = self.pages_locales.get(normaliser_url(page_url))
+            if fichier_page:
+                return self.chemin_local(fichier_page) + diese + fragment
+            if normaliser_url(page_url) in self.ignorees:
+                return url_absolue
+        return None
+
+def reecrire_liens(noeuds, resultats, dossier_page=None):
+    """
+    Réécrit sur place les liens relevés par analyser_page vers les fichiers locaux
+
+    Args:
+        noeuds (list): Noeuds renvoyés par analyser_page
+        (resultats, dossier_page : voir CiblesLiens)
+    """
+    cibles = CiblesLiens(resultats, dossier_page)
+    for balise, attribut, url_absolue, type_fichier in noeuds:
+        cible = cibles.cible(url_absolue, type_fichier)
+        if cible is not None:
+            balise[attribut] = cible
 
-        # Vérifier la taille du fichier (limite à 50MB)
-        content_length = response.headers.get('content-length')
-        if content_length and int(content_length) > 50 * 1024 * 1024:
-            print(f"  ❌ Fichier trop volumineux ({content_length} bytes): {url}")
+def analyser_page_en_flux(chemin, base_url, encodage):
+    """
+    Équivalent d'analyser_page pour une page enregistrée, lue en flux (voir flux_html.py)
+
+    Returns:
+        list: Tuples (url absolue, type_fichier) par ordre de priorité
+    """
+    ressources = RessourcesPage(base_url)
+    for segment in lire_page(chemin, encodage):
+        if isinstance(segment, Balise):
+            ressources.ajouter(segment.nom, {nom: attribut.valeur for nom, attribut in segment.attributs.items()})
+    return ressources.liste()
+
+def reecrire_page_en_flux(chemin, chemin_local, base_url, encodage, resultats, dossier_page=None):
+    """
+    Écrit dans chemin_local la page chemin avec ses liens réécrits vers les
+    fichiers locaux, en flux : seules les valeurs réécrites changent, le reste
+    de la page est recopié octet pour octet
+
+    Returns:
+        int: Taille de la page écrite
+    """
+    ressources = RessourcesPage(base_url)
+    cibles = CiblesLiens(resultats, dossier_page)
+
+    def remplacer(balise):
+        lien = ressources.ajouter(balise.nom, {nom: attribut.valeur for nom, attribut in balise.attributs.items()})
+        if lien is None:
             return None
+        attribut, url_absolue, type_fichier = lien
+        cible = cibles.cible(url_absolue, type_fichier)
+        return None if cible is None else remplacer_attribut(balise, attribut, cible)
 
-        # Créer le sous-dossier si nécessaire
-        sous_dossier = f"{dossier_base}/{type_fichier}"
-        Path(sous_dossier).mkdir(exist_ok=True)
+    return ecrire_flux(reecrire_page(chemin, encodage, remplacer), chemin_local, float('inf'))[0]
 
-        # Générer un nom de fichier valide
-        nom_fichier = generer_nom_fichier(url, type_fichier)
-        chemin_complet = f"{sous_dossier}/{nom_fichier}"
+def ajouter_resultat(resultats, url, type_fichier, nom_fichier, details=None):
+    """
+    Enregistre un fichier téléchargé dans le dictionnaire de résultats
+
+    details contient la taille, l'empreinte SHA-256 et le type MIME relevés
+    pendant le téléchargement (voir telecharger_fichier).
+    """
+    resultats[CLES_RESULTATS[type_fichier]].append({
+        'url_original': url,
+        'fichier_local': nom_fichier,
+        **(details or {})
+    })
+    resultats['url_vers_fichier'][url] = nom_fichier
 
-        # Éviter d'écraser des fichiers existants
+class AllocateurNoms:
+    """
+    Attribue des noms de fichiers uniques en mémoire
+
+    Chaque sous-dossier n'est listé qu'une fois (pour ne pas écraser des
+    fichiers déjà présents), au lieu d'un os.path.exists par fichier.
+    """
+
+    def __init__(self):
+        self._pris = set()
+        self._dossiers_lus = set()
+
+    def reserver(self, chemin_original):
+        """
+        Réserve chemin_original, ou la première variante libre nom_1.ext, nom_2.ext...
+        """
+        dossier = os.path.dirname(chemin_original)
+        if dossier not in self._dossiers_lus:
+            self._dossiers_lus.add(dossier)
+            if os.path.isdir(dossier):
+                self._pris.update(os.path.join(dossier, nom) for nom in os.listdir(dossier))
+
+        chemin_complet = chemin_original
         compteur = 1
-        chemin_original = chemin_complet
-        while os.path.exists(chemin_complet):
+        while chemin_complet in self._pris:
             nom_base, extension = os.path.splitext(chemin_original)
             chemin_complet = f"{nom_base}_{compteur}{extension}"
             compteur += 1
 
-        # Sauvegarder le fichier
-        with open(chemin_complet, 'wb') as f:
-            f.write(response.content)
+        self._pris.add(chemin_complet)
+        return chemin_complet
+
+class TableUrls:
+    """
+    Table des URLs d'une tâche : chaque URL absolue n'est téléchargée qu'une fois
+
+    Un appel qui demande une URL déjà en cours de téléchargement attend le
+    résultat du premier au lieu de relancer la requête. La table porte aussi
+    l'allocateur de noms, l'ordonnanceur qui limite les requêtes par hôte
+    (par défaut, un ordonnanceur propre à la tâche limité à max_par_hote) et
+    l'échéance de la tâche (date time.monotonic, ou None si elle n'en a pas).
+    """
+
+    def __init__(self, max_par_hote=MAX_PAR_HOTE, ordonnanceur=None, echeance=None):
+        self.allocateur = AllocateurNoms()
+        self.ordonnanceur = ordonnanceur or Ordonnanceur(max_par_hote)
+        self.echeance = echeance
+        self._futurs = {}
+        self._verrou = threading.Lock()
+
+    def reserver(self, url):
+        """
+        Returns:
+            bool: True si l'appelant doit télécharger l'URL (première demande)
+        """
+        with self._verrou:
+            if url in self._futurs:
+                return False
+            self._futurs[url] = Future()
+            return True
+
+    def terminer(self, url, nom_fichier):
+        """Publie le résultat du téléchargement (chemin local ou None), une seule fois"""
+        futur = self._futurs[url]
+        if not futur.done():
+            futur.set_result(nom_fichier)
+
+    def attendre(self, url):
+        """Attend et renvoie le résultat d'une URL réservée"""
+        return self._futurs[url].result()
+
+def telecharger_ressources(session, ressources, dossier_base, resultats,
+                           max_telechargements=MAX_TELECHARGEMENTS, max_par_hote=MAX_PAR_HOTE,
+                           tailles_max=None, dossier_blobs=None, progression=None, table=None,
+                           mesures=None):
+    """
+    Télécharge une liste de ressources avec un pool de threads borné
+
+    Chaque URL n'est téléchargée qu'une fois, même si elle apparaît plusieurs
+    fois dans la liste ou dans des appels précédents partageant la même table.
+    Les noms de fichiers sont réservés dans l'ordre du document avant le
+    téléchargement, ce qui rend le résultat identique à une exécution
+    séquentielle. Les résultats sont ajoutés dans ce même ordre.
+
+    Les workers prennent en priorité une ressource d'un hôte prêt (voir
+    politesse.RepartitionHotes) : un hôte en pause ou limité en débit ne
+    bloque pas les autres. Une ressource refusée par un 429 ou un 503 avec
+    Retry-After est redemandée après la pause. Entre hôtes prêts, les
+    ressources sont servies dans l'ordre de la liste (ordre de priorité).
+
+    Si la table a une échéance, aucune ressource n'est commencée après elle
+    et celles en cours sont interrompues : les unes comme les autres sont
+    ajoutées à resultats['ignorees'] au lieu d'être téléchargées.
+
+    Args:
+        session (requests.Session): Session HTTP partagée
+        ressources (list): Liste de tuples (url, type_fichier)
+        dossier_base (str): Le dossier de sortie
+        resultats (dict): Le dictionnaire de résultats à compléter
+        max_telechargements (int): Nombre maximum de téléchargements simultanés
+        max_par_hote (int): Nombre maximum de téléchargements simultanés par hôte
+        tailles_max (dict): Taille maximale en octets par type de ressource
+        dossier_blobs (str): Stockage adressé par contenu (optionnel)
+        progression (dict): Compteurs 'ressources_total' et 'ressources_terminees' (optionnel)
+        table (TableUrls): Table des URLs partagée par la tâche (optionnelle)
+        mesures (MesuresTache): Reçoit la durée, la taille ou l'erreur de chaque
+            téléchargement (optionnel)
+    """
+    if table is None:
+        table = TableUrls(max_par_hote)
+
+    # Réserver les URLs nouvelles et leurs chemins dans l'ordre du document
+    taches = []
+    for ressource_url, type_fichier in dict.fromkeys(ressources):
+        if table.reserver(ressource_url):
+            chemin = reserver_chemin(ressource_url, dossier_base, type_fichier, table.allocateur)
+            taches.append((len(taches), ressource_url, type_fichier, chemin))
+
+    verrou = threading.Lock()
+    if progression is not None:
+        progression['ressources_total'] = progression.get('ressources_total', 0) + len(taches)
+
+    repartition = RepartitionHotes(table.ordonnanceur, taches, url_de=lambda tache: tache[1],
+                                   echeance=table.echeance)
+    telecharges = [None] * len(taches)
+    essais = [0] * len(taches)
+
+    def telecharger(tache):
+        indice, ressource_url, type_fichier, chemin = tache
+        details = {}
+        debut = time.perf_counter()
+        # Robots.txt (Crawl-delay) lu à la première requête vers l'hôte, en parallèle des autres hôtes
+        table.ordonnanceur.preparer(session, ressource_url, table.echeance)
+        nom_fichier = telecharger_fichier(session, ressource_url, dossier_base, type_fichier, chemin,
+                                          taille_max_pour(type_fichier, tailles_max), dossier_blobs, details,
+                                          table.echeance, table.ordonnanceur)
+        if mesures is not None:
+            mesures.telechargement(type_fichier, time.perf_counter() - debut, details)
+        essais[indice] += 1
+        if nom_fichier is None and a_reessayer(details.get('statut'), details) and essais[indice] < ESSAIS:
+            repartition.remettre(tache)
+            return
+        if details.get('erreur') == 'echeance':
+            # Laissée parmi les ressources non téléchargées, ignorées plus bas
+            return
+        telecharges[indice] = (nom_fichier, details)
+        table.terminer(ressource_url, nom_fichier)
+        if progression is not None:
+            with verrou:
+                progression['ressources_terminees'] = progression.get('ressources_terminees', 0) + 1
+
+    def travailler():
+        while (tache := repartition.prendre()) is not None:
+            try:
+                telecharger(tache)
+            except BaseException:
+                table.terminer(tache[1], None)
+                raise
+            finally:
+                repartition.terminer(tache)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_telechargements)) as executeur:
+        for travail in [executeur.submit(travailler) for _ in range(min(max_telechargements, len(taches)))]:
+            travail.result()
+
+    for (_, ressource_url, type_fichier, _), telecharge in zip(taches, telecharges):
+        if telecharge is None:
+            # Échéance atteinte avant la fin de ce téléchargement
+            resultats['ignorees'].append({'url': ressource_url, 'type': type_fichier})
+            table.terminer(ressource_url, None)
+        elif telecharge[0]:
+            ajouter_resultat(resultats, ressource_url, type_fichier, *telecharge)
+
+    # Les URLs demandées par un autre appel concurrent sont attendues, pas relancées
+    for ressource_url, _ in dict.fromkeys(ressources):
+        table.attendre(ressource_url)
+
+def url_reference(url_feuille, valeur):
+    """
+    URL absolue (sans fragment) d'une référence trouvée dans une feuille de
+    style, ou None si elle ne désigne pas une ressource HTTP (data:, about:...)
+    """
+    url = urljoin(url_feuille, valeur).partition('#')[0]
+    return url if url.startswith(('http://', 'https://')) else None
+
+def traiter_feuilles_css(session, dossier_base, resultats, max_telechargements=MAX_TELECHARGEMENTS,
+                         max_par_hote=MAX_PAR_HOTE, tailles_max=None, dossier_blobs=None,
+                         progression=None, table=None, mesures=None):
+    """
+    Télécharge les ressources référencées par les feuilles de style, puis
+    réécrit les feuilles pour qu'elles pointent vers les fichiers locaux
+
+    Les @import et url() sont résolus par rapport à l'URL de la feuille et
+    passent par la même file de téléchargement que les ressources de la page
+    (même table, mêmes limites par hôte). Les feuilles importées sont à leur
+    tour analysées, jusqu'à ce qu'aucune nouvelle feuille n'apparaisse.
+    Chaque feuille est lue et réécrite en flux (voir feuilles_css.py).
+
+    Args:
+        (voir telecharger_ressources)
+    """
+    if table is None:
+        table = TableUrls(max_par_hote)
+
+    analysees = set()
+    a_reecrire = []
+    while True:
+        feuilles = [feuille for feuille in resultats['fichiers_css'] if feuille['fichier_local'] not in analysees]
+        if not feuilles:
+            break
+        ressources = []
+        for feuille in feuilles:
+            analysees.add(feuille['fichier_local'])
+            try:
+                references = references_feuille(feuille['fichier_local'])
+            except OSError as e:
+                print(f"  ⚠️ Feuille illisible {feuille['fichier_local']}: {e}")
+                continue
+            for genre, valeur in references:
+                url = url_reference(feuille['url_original'], valeur)
+                if url:
+                    ressources.append((url, type_reference(genre, url)))
+            if references:
+                a_reecrire.append(feuille)
+        telecharger_ressources(session, ressources, dossier_base, resultats, max_telechargements, max_par_hote,
+                               tailles_max, dossier_blobs, progression, table, mesures)
+
+    url_vers_fichier = resultats['url_vers_fichier']
+    for feuille in a_reecrire:
+        chemin = feuille['fichier_local']
+
+        def remplacer(reference):
+            # Une ressource non téléchargée (erreur, échéance) garde son URL d'origine, rendue absolue
+            url = url_reference(feuille['url_original'], reference.valeur)
+            if url is None:
+                return None
+            fichier = url_vers_fichier.get(url)
+            fragment = reference.valeur.partition('#')[2]
+            return (chemin_relatif(fichier, chemin) if fichier else url) + (f'#{fragment}' if fragment else '')
+
+        try:
+            feuille['taille'], feuille['sha256'] = ecrire_flux(reecrire_feuille(chemin, remplacer), chemin,
+                                                               taille_max_pour('css', tailles_max), dossier_blobs)
+        except Exception as e:
+            # La feuille d'origine reste en place : la tâche n'échoue pas pour autant
+            print(f"  ⚠️ Réécriture impossible de {chemin}: {e}")
+            if mesures is not None:
+                mesures.erreur('css')
+
+def reserver_chemin(url, dossier_base, type_fichier, allocateur=None):
+    """
+    Réserve un chemin de fichier libre, sans écraser un fichier existant ni
+    un chemin déjà réservé par le même allocateur
+    """
+    if allocateur is None:
+        allocateur = AllocateurNoms()
+    return allocateur.reserver(f"{dossier_base}/{type_fichier}/{generer_nom_fichier(url, type_fichier)}")
+
+class FichierTropVolumineux(Exception):
+    """Levée quand un téléchargement dépasse la taille autorisée"""
+
+class EcheanceDepassee(Exception):
+    """Levée quand la tâche n'a plus le temps de commencer ou de finir une requête"""
+
+def echeance_atteinte(echeance):
+    return echeance is not None and time.monotonic() >= echeance
+
+def timeout_requete(echeance=None):
+    """
+    Délai d'une requête : TIMEOUT_REQUETE, au plus le temps restant avant l'échéance
+
+    Raises:
+        EcheanceDepassee: Si l'échéance est déjà atteinte
+    """
+    if echeance is None:
+        return TIMEOUT_REQUETE
+    restant = echeance - time.monotonic()
+    if restant <= 0:
+        raise EcheanceDepassee("échéance de la tâche atteinte")
+    return min(TIMEOUT_REQUETE, restant)
+
+def avant_echeance(morceaux, echeance):
+    """Relaie les blocs d'un flux tant que l'échéance n'est pas atteinte"""
+    for morceau in morceaux:
+        if echeance_atteinte(echeance):
+            raise EcheanceDepassee("échéance de la tâche atteinte")
+        yield morceau
+
+def taille_max_pour(type_fichier, tailles_max=None):
+    """
+    Renvoie la taille maximale autorisée pour un type de ressource
+    """
+    if tailles_max and type_fichier in tailles_max:
+        return tailles_max[type_fichier]
+    return TAILLES_MAX.get(type_fichier, TAILLE_MAX_FICHIER)
+
+def ecrire_flux(morceaux, chemin_complet, taille_max, dossier_blobs=None):
+    """
+    Écrit un flux de blocs dans un fichier temporaire puis le renomme atomiquement
+
+    Le fichier final n'apparaît que si le flux est complet. Le téléchargement
+    est interrompu dès que la taille dépasse taille_max. Avec dossier_blobs,
+    le contenu est rangé dans le stockage adressé par contenu et chemin_complet
+    devient un lien vers le blob.
+
+    Returns:
+        tuple: (nombre d'octets écrits, empreinte SHA-256 du contenu)
+    """
+    dossier_temp = dossier_temporaire(dossier_blobs) if dossier_blobs else os.path.dirname(chemin_complet)
+    descripteur, chemin_temp = fichier_temporaire(dossier_temp)
+    try:
+        taille = 0
+        empreinte = hashlib.sha256()
+        with os.fdopen(descripteur, 'wb') as f:
+            for morceau in morceaux:
+                taille += len(morceau)
+                if taille > taille_max:
+                    raise FichierTropVolumineux(f"plus de {taille_max} bytes")
+                empreinte.update(morceau)
+                f.write(morceau)
+        if dossier_blobs:
+            stocker_fichier(chemin_temp, empreinte.hexdigest(), chemin_complet, dossier_blobs)
+        else:
+            os.replace(chemin_temp, chemin_complet)
+        return taille, empreinte.hexdigest()
+    except BaseException:
+        if os.path.exists(chemin_temp):
+            os.remove(chemin_temp)
+        raise
+
+def telecharger_fichier(session, url, dossier_base, type_fichier, chemin_complet=None, taille_max=None,
+                        dossier_blobs=None, details=None, echeance=None, ordonnanceur=None):
+    """
+    Télécharge un fichier spécifique
+
+    Si chemin_complet est fourni, le fichier est écrit à cet emplacement
+    (déjà réservé), sinon un nom libre est choisi dans le sous-dossier du type.
+    Le contenu est lu par blocs, la mémoire utilisée reste donc constante.
+    Si details est fourni, il reçoit 'taille', 'sha256' et 'type_mime', ou
+    'erreur' (genre de l'échec, voir noter_erreur) si le fichier n'est pas téléchargé.
+    Avec une échéance (date time.monotonic), la requête est abandonnée quand
+    elle est atteinte.
+    Avec dossier_blobs, un grand fichier interrompu est gardé en .part et
+    repris par une requête Range au prochain téléchargement (voir reprises.py) ;
+    l'ordonnanceur permet alors de télécharger les plages d'un très grand
+    fichier en parallèle.
+    """
+    if taille_max is None:
+        taille_max = taille_max_pour(type_fichier)
+
+    reprise = None
+    try:
+        # Vérifier que l'URL est valide
+        if not url or not url.startswith(('http://', 'https://')):
+            print(f"  ❌ URL invalide: {url}")
+            noter_erreur(details, 'url')
+            return None
+
+        en_tetes = None
+        if dossier_blobs:
+            reprise = Reprise(dossier_reprises(dossier_blobs), url)
+            en_tetes = reprise.prendre()
+
+        with session.get(url, timeout=timeout_requete(echeance), stream=True, headers=en_tetes) as response:
+            content_length = reprise.accepter(response) if reprise else response.headers.get('content-length')
+            response.raise_for_status()
+
+            # Refuser d'emblée si la taille annoncée dépasse la limite
+            if content_length and int(content_length) > taille_max:
+                print(f"  ❌ Fichier trop volumineux ({content_length} bytes): {url}")
+                noter_erreur(details, 'taille')
+                return None
+
+            # Créer le sous-dossier si nécessaire
+            sous_dossier = f"{dossier_base}/{type_fichier}"
+            Path(sous_dossier).mkdir(exist_ok=True)
+
+            # Générer un nom de fichier valide
+            if chemin_complet is None:
+                chemin_complet = reserver_chemin(url, dossier_base, type_fichier)
+
+            def relayer(morceaux):
+                return morceaux if echeance is None else avant_echeance(morceaux, echeance)
+
+            # Sauvegarder le fichier bloc par bloc
+            if reprise and reprise.active:
+                taille, empreinte = reprise.terminer(session, response, timeout_requete(echeance), dossier_blobs,
+                                                     chemin_complet, ordonnanceur, relayer)
+            else:
+                taille, empreinte = ecrire_flux(relayer(response.iter_content(TAILLE_BLOC)), chemin_complet,
+                                                taille_max, dossier_blobs)
+            if details is not None:
+                details.update(taille=taille, sha256=empreinte,
+                               type_mime=type_mime(chemin_complet, response.headers.get('Content-Type')))
 
         print(f"  ✓ {type_fichier}: {os.path.basename(chemin_complet)}")
         return chemin_complet
 
-    except requests.exceptions.Timeout:
-        print(f"  ❌ Timeout lors du téléchargement: {url}")
+    except FichierTropVolumineux as e:
+        print(f"  ❌ Fichier trop volumineux ({e}): {url}")
+        noter_erreur(details, 'taille')
+        return None
+    except EcheanceDepassee:
+        print(f"  ⏱️ Échéance atteinte, ignoré: {url}")
+        noter_erreur(details, 'echeance')
         return None
     except requests.exceptions.RequestException as e:
-        print(f"  ❌ Erreur réseau {url}: {e}")
+        # Délai réduit au temps restant : l'échec vient de l'échéance de la tâche
+        if echeance_atteinte(echeance):
+            print(f"  ⏱️ Échéance atteinte, ignoré: {url}")
+            noter_erreur(details, 'echeance')
+        elif isinstance(e, requests.exceptions.Timeout):
+            print(f"  ❌ Timeout lors du téléchargement: {url}")
+            noter_erreur(details, 'timeout')
+        else:
+            print(f"  ❌ Erreur réseau {url}: {e}")
+            if isinstance(e, requests.exceptions.HTTPError):
+                noter_erreur(details, 'http', e.response.status_code, e.response.headers.get('Retry-After'))
+            else:
+                noter_erreur(details, 'reseau')
         return None
     except Exception as e:
         print(f"  ❌ Erreur téléchargement {url}: {e}")
+        noter_erreur(details, 'autre')
         return None
+    finally:
+        if reprise is not None:
+            # Garder les octets reçus d'un téléchargement inachevé
+            reprise.liberer()
+
+def noter_erreur(details, genre, statut=None, retry_after=None):
+    """
+    Indique dans details pourquoi un téléchargement a échoué : 'url', 'taille',
+    'timeout', 'echeance' (temps de la tâche écoulé), 'http' (avec le statut et
+    l'éventuel Retry-After), 'reseau' ou 'autre'
+    """
+    if details is not None:
+        details.clear()
+        details['erreur'] = genre
+        if statut is not None:
+            details['statut'] = statut
+        if retry_after is not None:
+            details['Retry-After'] = retry_after
 
 def generer_nom_fichier(url, type_fichier):
     """
@@ -190,38 +970,26 @@ def generer_nom_fichier(url, type_fichier):
 
     return nom
 
-def modifier_liens_locaux(soup, resultats):
+def modifier_liens_locaux(soup, resultats, base_url=None, dossier_page=None):
     """
     Modifie les liens dans le HTML pour pointer vers les fichiers locaux
+
+    Travaille sur une copie : la soupe d'origine n'est pas modifiée. Pour
+    éviter cette copie, utiliser directement analyser_page et reecrire_liens.
+
+    Args:
+        soup (BeautifulSoup): La page analysée
+        resultats (dict): Résultats contenant le mapping 'url_vers_fichier' et,
+            en mode exploration, 'pages_locales' (URL normalisée -> fichier de la page)
+        base_url (str): URL de la page (par défaut resultats['base_url'])
+        dossier_page (str): Si fourni, les chemins sont écrits relativement à ce dossier
     """
     soup_copie = BeautifulSoup(str(soup), 'html.parser')
+    if base_url is None:
+        base_url = resultats.get('base_url', '')
 
-    # Modifier les liens CSS - utiliser le mapping URL -> fichier pour une correspondance exacte
-    for link in soup_copie.find_all('link', rel='stylesheet'):
-        href = link.get('href')
-        if href:
-            # Reconstruire l'URL absolue pour la correspondance
-            from urllib.parse import urljoin
-            css_url = urljoin(resultats.get('base_url', ''), href)
-            if css_url in resultats['url_vers_fichier']:
-                link['href'] = resultats['url_vers_fichier'][css_url]
-
-    # Modifier les liens JavaScript
-    for script in soup_copie.find_all('script', src=True):
-        src = script.get('src')
-        if src:
-            js_url = urljoin(resultats.get('base_url', ''), src)
-            if js_url in resultats['url_vers_fichier']:
-                script['src'] = resultats['url_vers_fichier'][js_url]
-
-    # Modifier les liens des images
-    for img in soup_copie.find_all('img', src=True):
-        src = img.get('src')
-        if src:
-            img_url = urljoin(resultats.get('base_url', ''), src)
-            if img_url in resultats['url_vers_fichier']:
-                img['src'] = resultats['url_vers_fichier'][img_url]
-
+    _, noeuds = analyser_page(soup_copie, base_url)
+    reecrire_liens(noeuds, resultats, dossier_page)
     return soup_copie
 
 def afficher_resume(resultats):
@@ -236,6 +1004,7 @@ def afficher_resume(resultats):
     print(f"🎨 Fichiers CSS: {len(resultats['fichiers_css'])}")
     print(f"⚡ Fichiers JS: {len(resultats['fichiers_js'])}")
     print(f"🖼️  Images: {len(resultats['images'])}")
+    print(f"🔤 Polices: {len(resultats.get('polices', []))}")
     
     if resultats['erreurs']:
         print(f"❌ Erreurs: {len(resultats['erreurs'])}")
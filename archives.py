@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Création des archives des sites téléchargés
+
+La compression tient compte du contenu : les fichiers déjà compressés
+(images, polices, vidéos...) sont simplement stockés, les autres sont
+compressés en parallèle sur plusieurs cœurs (zlib libère le GIL) avant
+d'être assemblés dans l'archive, dans l'ordre.
+
+Formats disponibles : 'zip' et 'tar.zst' (nécessite le paquet zstandard).
+"""
+
+import io
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # format tar.zst indisponible
+    zstandard = None
+
+# Taille des blocs lus dans les fichiers à archiver
+TAILLE_BLOC = 64 * 1024
+
+# Formats d'archive et extension des fichiers correspondants
+FORMATS = {'zip': '.zip', 'tar.zst': '.tar.zst'}
+FORMAT_DEFAUT = 'zip'
+
+# Niveau de compression par défaut (DEFLATE : 1 à 9, zstd : 1 à 22)
+NIVEAUX_DEFAUT = {'zip': 6, 'tar.zst': 3}
+
+# Extensions des fichiers qu'une nouvelle compression ne réduirait pas
+EXTENSIONS_DEJA_COMPRESSEES = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.ico',
+    '.woff', '.woff2', '.mp3', '.mp4', '.webm', '.ogg',
+    '.zip', '.gz', '.br', '.zst', '.7z', '.pdf',
+}
+
+# Au-delà de cette taille, un fichier est compressé au fil de l'eau plutôt qu'en
+# mémoire dans un worker (borne la mémoire à ~2 fichiers par worker)
+TAILLE_MAX_PARALLELE = 8 * 1024 * 1024
+
+
+def format_archive(nom_fichier):
+    """
+    Format d'archive correspondant à un nom de fichier, ou None s'il n'est pas reconnu
+    """
+    for nom_format, extension in FORMATS.items():
+        if nom_fichier.endswith(extension):
+            return nom_format
+    return None
+
+
+def deja_compresse(nom_fichier):
+    """Le fichier est-il d'un type déjà compressé ?"""
+    return os.path.splitext(nom_fichier)[1].lower() in EXTENSIONS_DEJA_COMPRESSEES
+
+
+def lister_fichiers(folder_path):
+    """Liste (chemin, nom dans l'archive) des fichiers du dossier, dans un ordre stable"""
+    fichiers = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            fichiers.append((file_path, os.path.relpath(file_path, folder_path)))
+    return fichiers
+
+
+def compresser_membre(file_path, niveau):
+    """
+    Prépare un membre ZIP (exécuté dans un worker)
+
+    Returns:
+        tuple: (methode, crc, donnees) ; pour un membre ZIP_DEFLATED, donnees
+        est le flux DEFLATE complet. Un membre stocké tel quel (ZIP_STORED) est
+        recopié depuis le disque à l'écriture ; un fichier trop gros, ou tout
+        fichier sans ECRITURE_BRUTE, est compressé au fil de l'eau à
+        l'écriture (methode vaut alors None).
+    """
+    if deja_compresse(file_path):
+        return zipfile.ZIP_STORED, None, None
+
+    if not ECRITURE_BRUTE or os.path.getsize(file_path) > TAILLE_MAX_PARALLELE:
+        return None, None, None
+
+    with open(file_path, 'rb') as source:
+        brut = source.read()
+    crc = zlib.crc32(brut)
+    compresseur = zlib.compressobj(niveau, zlib.DEFLATED, -zlib.MAX_WBITS)
+    donnees = compresseur.compress(brut) + compresseur.flush()
+    if len(donnees) >= len(brut):
+        # Incompressible malgré son extension : le stocker
+        return zipfile.ZIP_STORED, None, None
+    return zipfile.ZIP_DEFLATED, crc, donnees
+
+
+def membres_prepares(fichiers, niveau, nb_workers, executeur=None):
+    """
+    Prépare les membres en parallèle et les renvoie dans l'ordre des fichiers
+
+    Seuls quelques membres d'avance sont préparés à la fois, pour borner la mémoire.
+
+    Args:
+        executeur (Executor): Pool de threads partagé avec d'autres archives
+        (par défaut : un pool de nb_workers threads, propre à cette archive)
+    """
+    if executeur is None:
+        with ThreadPoolExecutor(max_workers=nb_workers, thread_name_prefix='compression') as executeur:
+            yield from membres_prepares(fichiers, niveau, nb_workers, executeur)
+        return
+
+    avance = 2 * nb_workers
+    en_cours = deque()
+    try:
+        for file_path, arcname in fichiers:
+            en_cours.append((file_path, arcname, executeur.submit(compresser_membre, file_path, niveau)))
+            if len(en_cours) >= avance:
+                file_path, arcname, futur = en_cours.popleft()
+                yield file_path, arcname, futur.result()
+        while en_cours:
+            file_path, arcname, futur = en_cours.popleft()
+            yield file_path, arcname, futur.result()
+    finally:
+        # Archive abandonnée (client déconnecté) : ne pas occuper le pool pour rien
+        for _, _, futur in en_cours:
+            futur.cancel()
+
+
+def ecrire_membre_compresse(zipf, infos, crc, donnees):
+    """
+    Écrit un membre déjà compressé en DEFLATE, dont le CRC est connu
+
+    ZipFile.open(..., 'w') recompresserait les données : cette fonction en
+    reprend les étapes avec des détails internes de zipfile, et n'est
+    utilisée qu'avec ECRITURE_BRUTE (voir verifier_ecriture_brute). Les en-têtes étant complets dès le
+    départ, aucun descripteur de données n'est nécessaire, même sur une
+    sortie non repositionnable.
+    """
+    infos.compress_type = zipfile.ZIP_DEFLATED
+    infos.CRC = crc
+    infos.compress_size = len(donnees)
+    infos.flag_bits = 0
+    zip64 = infos.file_size > zipfile.ZIP64_LIMIT or infos.compress_size > zipfile.ZIP64_LIMIT
+    if zipf._seekable:
+        zipf.fp.seek(zipf.start_dir)
+    infos.header_offset = zipf.fp.tell()
+    zipf._writecheck(infos)
+    zipf._didModify = True
+
+    zipf.fp.write(infos.FileHeader(zip64))
+    zipf.fp.write(donnees)
+    zipf.start_dir = zipf.fp.tell()
+    zipf.filelist.append(infos)
+    zipf.NameToInfo[infos.filename] = infos
+
+
+def ecrire_zip(folder_path, sortie, niveau, nb_workers, statistiques, executeur=None):
+    """
+    Écrit l'archive ZIP du dossier dans sortie, membre par membre
+
+    Yields:
+        None: Chaque fois que de nouvelles données ont pu être écrites
+    """
+    with zipfile.ZipFile(sortie, 'w', zipfile.ZIP_DEFLATED, compresslevel=niveau) as zipf:
+        for file_path, arcname, (methode, crc, donnees) in membres_prepares(
+                lister_fichiers(folder_path), niveau, nb_workers, executeur):
+            infos = zipfile.ZipInfo.from_file(file_path, arcname)
+            statistiques['membres'] += 1
+            statistiques['octets_source'] += infos.file_size
+            if methode == zipfile.ZIP_DEFLATED:
+                ecrire_membre_compresse(zipf, infos, crc, donnees)
+            else:
+                # Membre stocké, ou compressé ici au fil de l'eau
+                if methode == zipfile.ZIP_STORED:
+                    infos.compress_type = zipfile.ZIP_STORED
+                    statistiques['membres_stockes'] += 1
+                else:
+                    infos.compress_type = zipfile.ZIP_DEFLATED
+                    infos._compresslevel = niveau
+                with open(file_path, 'rb') as source, \
+                        zipf.open(infos, 'w', force_zip64=infos.file_size > zipfile.ZIP64_LIMIT) as membre:
+                    for bloc in iter(lambda: source.read(TAILLE_BLOC), b''):
+                        membre.write(bloc)
+                        yield
+            yield
+    # Répertoire central, écrit à la fermeture de l'archive
+    yield
+
+
+def ecrire_tar_zst(folder_path, sortie, niveau, nb_workers, statistiques, executeur=None):
+    """
+    Écrit une archive tar compressée en zstd (multithread) dans sortie
+
+    Le flux zstd est découpé en blocs compressés sur nb_workers threads
+    propres à zstd (executeur n'est pas utilisé) ; zstd détecte lui-même
+    les données incompressibles.
+
+    Yields:
+        None: Chaque fois que de nouvelles données ont pu être écrites
+    """
+    if zstandard is None:
+        raise RuntimeError("Le format tar.zst nécessite le paquet zstandard (pip install zstandard)")
+
+    compresseur = zstandard.ZstdCompressor(level=niveau, threads=nb_workers)
+    with compresseur.stream_writer(sortie, closefd=False) as flux_zst:
+        for file_path, arcname in lister_fichiers(folder_path):
+            stat = os.stat(file_path)
+            infos = tarfile.TarInfo(arcname.replace(os.sep, '/'))
+            infos.size = stat.st_size
+            infos.mtime = int(stat.st_mtime)
+            infos.mode = stat.st_mode & 0o777
+            statistiques['membres'] += 1
+            statistiques['octets_source'] += infos.size
+
+            flux_zst.write(infos.tobuf(tarfile.PAX_FORMAT))
+            with open(file_path, 'rb') as source:
+                for bloc in iter(lambda: source.read(TAILLE_BLOC), b''):
+                    flux_zst.write(bloc)
+                    yield
+            reste = infos.size % tarfile.BLOCKSIZE
+            if reste:
+                flux_zst.write(tarfile.NUL * (tarfile.BLOCKSIZE - reste))
+            yield
+        # Fin d'archive : deux blocs vides
+        flux_zst.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+    yield
+
+
+ECRIVAINS = {'zip': ecrire_zip, 'tar.zst': ecrire_tar_zst}
+
+
+def nouvelles_statistiques(nom_format, niveau, nb_workers):
+    return {
+        'format': nom_format,
+        'niveau': niveau,
+        'nb_workers': nb_workers,
+        'membres': 0,
+        'membres_stockes': 0,
+        'octets_source': 0,
+        'octets_archive': 0,
+        'duree_s': 0.0,
+        'ratio': None,
+    }
+
+
+def terminer_statistiques(statistiques, debut, octets_archive):
+    statistiques['octets_archive'] = octets_archive
+    statistiques['duree_s'] = round(time.perf_counter() - debut, 3)
+    if statistiques['octets_source']:
+        statistiques['ratio'] = round(octets_archive / statistiques['octets_source'], 3)
+
+
+def parametres_archive(nom_format, niveau, nb_workers):
+    if nom_format not in FORMATS:
+        raise ValueError(f"Format d'archive inconnu : {nom_format} (formats : {', '.join(FORMATS)})")
+    if niveau is None:
+        niveau = NIVEAUX_DEFAUT[nom_format]
+    return niveau, nb_workers or os.cpu_count() or 1
+
+
+def creer_archive(folder_path, archive_path, nom_format=None, niveau=None, nb_workers=None):
+    """
+    Créer une archive du dossier téléchargé
+
+    Args:
+        folder_path (str): Dossier à archiver
+        archive_path (str): Fichier à créer
+        nom_format (str): 'zip' ou 'tar.zst' (par défaut : déduit de l'extension, sinon zip)
+        niveau (int): Niveau de compression (par défaut : NIVEAUX_DEFAUT)
+        nb_workers (int): Nombre de cœurs utilisés (par défaut : tous)
+
+    Returns:
+        dict: Statistiques (durée, tailles, ratio archive / source, membres stockés sans compression)
+    """
+    nom_format = nom_format or format_archive(archive_path) or FORMAT_DEFAUT
+    niveau, nb_workers = parametres_archive(nom_format, niveau, nb_workers)
+    statistiques = nouvelles_statistiques(nom_format, niveau, nb_workers)
+    debut = time.perf_counter()
+    with open(archive_path, 'wb') as sortie:
+        for _ in ECRIVAINS[nom_format](folder_path, sortie, niveau, nb_workers, statistiques):
+            pass
+    terminer_statistiques(statistiques, debut, os.path.getsize(archive_path))
+    return statistiques
+
+
+def create_zip(folder_path, zip_path, niveau=None, nb_workers=None):
+    """Créer un fichier ZIP du dossier téléchargé (voir creer_archive)"""
+    return creer_archive(folder_path, zip_path, 'zip', niveau, nb_workers)
+
+
+class FluxZip(io.RawIOBase):
+    """
+    Sortie en écriture seule et non repositionnable pour zipfile
+
+    zipfile écrit alors des descripteurs de données après chaque membre au
+    lieu de revenir sur les en-têtes : l'archive peut être produite d'un
+    seul tenant, morceau par morceau.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._morceaux = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, donnees):
+        self._morceaux.append(bytes(donnees))
+        self._position += len(donnees)
+        return len(donnees)
+
+    def tell(self):
+        return self._position
+
+    def vider(self):
+        """Renvoie les octets écrits depuis le dernier appel"""
+        donnees = b''.join(self._morceaux)
+        self._morceaux.clear()
+        return donnees
+
+
+def generer_archive(folder_path, nom_format=FORMAT_DEFAUT, niveau=None, nb_workers=None,
+                    statistiques=None, executeur=None):
+    """
+    Produit une archive du dossier par morceaux, sans fichier temporaire
+
+    La mémoire utilisée reste bornée quelle que soit la taille du dossier ;
+    le premier octet est disponible dès le premier membre préparé.
+
+    Args:
+        statistiques (dict): Complété avec les statistiques de l'archive une fois produite
+        executeur (Executor): Pool de threads de compression partagé (voir membres_prepares)
+        (autres paramètres : voir creer_archive)
+
+    Yields:
+        bytes: Morceaux successifs de l'archive
+    """
+    niveau, nb_workers = parametres_archive(nom_format, niveau, nb_workers)
+    if statistiques is None:
+        statistiques = {}
+    statistiques.update(nouvelles_statistiques(nom_format, niveau, nb_workers))
+    debut = time.perf_counter()
+    flux = FluxZip()
+    for _ in ECRIVAINS[nom_format](folder_path, flux, niveau, nb_workers, statistiques, executeur):
+        morceau = flux.vider()
+        if morceau:
+            yield morceau
+    terminer_statistiques(statistiques, debut, flux.tell())
+
+
+def generer_zip(folder_path, niveau=None, nb_workers=None, statistiques=None):
+    """Produit une archive ZIP du dossier par morceaux (voir generer_archive)"""
+    return generer_archive(folder_path, 'zip', niveau, nb_workers, statistiques)
+
+
+def verifier_ecriture_brute():
+    """
+    Vérifie que ecrire_membre_compresse fonctionne avec le zipfile de ce Python
+
+    Un membre est écrit sur une sortie repositionnable puis sur un FluxZip,
+    et chaque archive est relue : un attribut interne disparu ou un
+    changement de comportement de zipfile désactive l'écriture brute au lieu
+    de produire des archives invalides.
+    """
+    donnees = b'verification ' * 64
+    compresseur = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressees = compresseur.compress(donnees) + compresseur.flush()
+    try:
+        for sortie in (io.BytesIO(), FluxZip()):
+            with zipfile.ZipFile(sortie, 'w') as zipf:
+                infos = zipfile.ZipInfo('verification.txt')
+                infos.file_size = len(donnees)
+                ecrire_membre_compresse(zipf, infos, zlib.crc32(donnees), compressees)
+            contenu = sortie.getvalue() if isinstance(sortie, io.BytesIO) else sortie.vider()
+            with zipfile.ZipFile(io.BytesIO(contenu)) as relue:
+                if relue.testzip() is not None or relue.read('verification.txt') != donnees:
+                    return False
+    except Exception:
+        return False
+    return True
+
+
+# Les membres compressés par les workers sont écrits sans repasser par
+# ZipFile.open si ce Python le permet ; sinon, chaque fichier est compressé au
+# fil de l'eau par ZipFile.open, sans parallélisme
+ECRITURE_BRUTE = verifier_ecriture_brute()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de l'analyse et de la réécriture des pages HTML
+
+Compare l'ancien pipeline (trois parcours find_all, puis une seconde
+analyse complète dans modifier_liens_locaux) au pipeline en un seul
+parcours (analyser_page + reecrire_liens), avec html.parser et lxml (si le
+paquet lxml est installé).
+
+Usage :
+    python3 bench_parsing.py --tailles 5 10 20
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml
+except ImportError:  # variantes lxml ignorées
+    lxml = None
+
+from app import analyser_page, reecrire_liens
+
+BASE_URL = "https://example.com/dossier/page.html"
+
+
+def generer_html(taille_mo):
+    """
+    Génère une page HTML synthétique d'environ taille_mo mégaoctets
+    """
+    morceaux = ['<!DOCTYPE html><html><head>']
+    for i in range(50):
+        morceaux.append(f'<link rel="stylesheet" href="/css/style_{i}.css">')
+        morceaux.append(f'<script src="js/script_{i}.js"></script>')
+    morceaux.append('</head><body>')
+    taille_cible = taille_mo * 1024 * 1024
+    taille = 0
+    i = 0
+    while taille < taille_cible:
+        bloc = (f'<div class="article" id="a{i}"><h2>Titre {i}</h2>'
+                f'<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit {i}. '
+                f'<a href="/articles/{i}.html">Lire la suite</a></p>'
+                f'<img src="../images/photo_{i % 500}.jpg" alt="photo {i}"></div>\n')
+        morceaux.append(bloc)
+        taille += len(bloc)
+        i += 1
+    morceaux.append('</body></html>')
+    return ''.join(morceaux)
+
+
+def correspondances(html):
+    """
+    Mapping URL -> fichier local simulant des ressources téléchargées
+    """
+    soup = BeautifulSoup(html, 'lxml' if lxml is not None else 'html.parser')
+    ressources, _ = analyser_page(soup, BASE_URL)
+    return {url: f"site/{type_fichier}/{i}" for i, (url, type_fichier) in enumerate(ressources)}
+
+
+def pipeline_avant(html, url_vers_fichier):
+    """
+    Reproduction de l'ancien pipeline : trois find_all, str(soup), seconde analyse
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    ressources = []
+    for link in soup.find_all('link', rel='stylesheet'):
+        if link.get('href'):
+            ressources.append(urljoin(BASE_URL, link.get('href')))
+    for script in soup.find_all('script', src=True):
+        if script.get('src'):
+            ressources.append(urljoin(BASE_URL, script.get('src')))
+    for img in soup.find_all('img', src=True):
+        if img.get('src'):
+            ressources.append(urljoin(BASE_URL, img.get('src')))
+
+    soup_copie = BeautifulSoup(str(soup), 'html.parser')
+    for balise, attribut in (('link', 'href'), ('script', 'src'), ('img', 'src')):
+        filtre = {'rel': 'stylesheet'} if balise == 'link' else {attribut: True}
+        for noeud in soup_copie.find_all(balise, **filtre):
+            valeur = noeud.get(attribut)
+            if valeur:
+                url = urljoin(BASE_URL, valeur)
+                if url in url_vers_fichier:
+                    noeud[attribut] = url_vers_fichier[url]
+    return str(soup_copie)
+
+
+def pipeline_apres(html, url_vers_fichier, parseur):
+    """
+    Pipeline actuel : une analyse, un parcours, réécriture sur place
+    """
+    soup = BeautifulSoup(html, parseur)
+    _, noeuds = analyser_page(soup, BASE_URL)
+    reecrire_liens(noeuds, {'url_vers_fichier': url_vers_fichier})
+    return str(soup)
+
+
+def mesurer(fonction, *args):
+    """
+    Renvoie (durée en secondes, pic mémoire en Mo)
+
+    La durée est mesurée sans tracemalloc, qui ralentit fortement les allocations ;
+    le pic mémoire est mesuré lors d'une seconde exécution.
+    """
+    debut = time.perf_counter()
+    fonction(*args)
+    duree = time.perf_counter() - debut
+
+    tracemalloc.start()
+    fonction(*args)
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duree, pic / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tailles', type=int, nargs='+', default=[5, 10, 20], help="Tailles des pages en Mo")
+    parser.add_argument('--json', help="Fichier où écrire les résultats")
+    args = parser.parse_args()
+
+    variantes = [
+        ('avant (html.parser, 2 analyses)', lambda html, m: pipeline_avant(html, m)),
+        ('après (html.parser)', lambda html, m: pipeline_apres(html, m, 'html.parser')),
+    ]
+    if lxml is not None:
+        variantes.append(('après (lxml)', lambda html, m: pipeline_apres(html, m, 'lxml')))
+    else:
+        print("⚠️ Paquet lxml absent : variante lxml ignorée (pip install lxml)")
+
+    mesures = []
+    print(f"{'Taille':>8} | {'Variante':<32} | {'Durée':>9} | {'Pic mémoire':>12}")
+    print("-" * 70)
+    for taille in args.tailles:
+        html = generer_html(taille)
+        url_vers_fichier = correspondances(html)
+        for nom, fonction in variantes:
+            duree, pic = mesurer(fonction, html, url_vers_fichier)
+            mesures.append({'taille_mo': taille, 'variante': nom, 'duree_s': duree, 'pic_mo': pic})
+            print(f"{taille:>6}Mo | {nom:<32} | {duree:>8.2f}s | {pic:>9.0f} Mo")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(mesures, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Benchmark de bout en bout du scraper sur un site synthétique local
+
+Un serveur HTTP local sert une page et ses ressources CSS/JS/images, en
+nombre et en taille configurables, avec une latence, un débit maximal et
+un taux d'erreurs simulés. Pour chaque scénario, extraire_site_web est
+exécuté plusieurs fois et le benchmark relève le débit, les latences p50
+et p99 des tâches, la durée de création des archives et le pic de mémoire
+résidente (RSS).
+
+Les résultats sont écrits en JSON et peuvent être comparés à une
+référence enregistrée : le code de sortie vaut 1 si une mesure se dégrade
+au-delà de la tolérance.
+
+Usage :
+    python3 bench_scraper.py --json resultats.json
+    python3 bench_scraper.py --sauver-reference bench_reference.json
+    python3 bench_scraper.py --reference bench_reference.json --tolerance 0.2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from app import extraire_site_web
+from archives import creer_archive
+
+# Scénarios prédéfinis : les paramètres absents prennent la valeur de SITE_DEFAUT
+SITE_DEFAUT = {
+    'nb_css': 5, 'taille_css': 20 * 1024,
+    'nb_js': 5, 'taille_js': 40 * 1024,
+    'nb_images': 20, 'taille_image': 50 * 1024,
+    'latence_ms': 0, 'debit_ko_s': 0, 'taux_erreur': 0.0,
+}
+
+SCENARIOS = {
+    'local': {},
+    'lent': {'latence_ms': 50, 'debit_ko_s': 2048},
+    'instable': {'latence_ms': 10, 'taux_erreur': 0.1},
+    'lourd': {'nb_images': 100, 'taille_image': 200 * 1024},
+}
+
+# Métriques comparées à la référence : sens de l'amélioration et écart absolu
+# en dessous duquel une variation est considérée comme du bruit de mesure
+METRIQUES = {
+    'debit_jobs_s': ('plus', 0),
+    'debit_mo_s': ('plus', 0),
+    'latence_p50_s': ('moins', 0.01),
+    'latence_p99_s': ('moins', 0.01),
+    'archive_p50_s': ('moins', 0.01),
+    'pic_rss_mo': ('moins', 5),
+}
+
+# Paramètres qui doivent être identiques pour que deux mesures soient comparables
+PARAMETRES_COMPARABLES = ('site', 'jobs', 'concurrence', 'format')
+
+# Taille des blocs envoyés quand le débit est limité
+TAILLE_BLOC = 16 * 1024
+
+
+def contenu_texte(modele, taille):
+    """Texte de la taille demandée, en répétant un modèle (compressible comme du vrai CSS/JS)"""
+    bloc = modele.encode('utf-8')
+    return (bloc * (taille // len(bloc) + 1))[:taille]
+
+
+def contenu_image(taille, graine):
+    """Octets pseudo-aléatoires (incompressibles comme une vraie image) précédés d'un en-tête PNG"""
+    entete = b'\x89PNG\r\n\x1a\n'
+    return entete + random.Random(graine).randbytes(max(taille - len(entete), 0))
+
+
+class SiteSynthetique:
+    """
+    Contenu d'un site synthétique : une page HTML et ses ressources
+
+    Les erreurs sont tirées une fois pour toutes par ressource (à partir de
+    la graine) : chaque exécution d'un scénario rencontre les mêmes erreurs.
+    """
+
+    def __init__(self, graine=0, **parametres):
+        self.parametres = dict(SITE_DEFAUT, **parametres)
+        p = self.parametres
+        tirage = random.Random(graine)
+        self.fichiers = {}
+        for i in range(p['nb_css']):
+            self.fichiers[f'/css/style_{i}.css'] = (
+                contenu_texte(f'.bloc-{i} {{ margin: 0 auto; color: #333; }}\n', p['taille_css']), 'text/css')
+        for i in range(p['nb_js']):
+            self.fichiers[f'/js/script_{i}.js'] = (
+                contenu_texte(f'function f{i}(x) {{ return x * {i}; }}\n', p['taille_js']), 'application/javascript')
+        image = contenu_image(p['taille_image'], graine)
+        for i in range(p['nb_images']):
+            # Contenus distincts (une image ne se déduplique pas avec la suivante)
+            self.fichiers[f'/img/photo_{i}.png'] = (image[:-4] + i.to_bytes(4, 'big'), 'image/png')
+        self.en_erreur = {chemin for chemin in self.fichiers if tirage.random() < p['taux_erreur']}
+        self.page = self.generer_page()
+
+    def generer_page(self):
+        morceaux = ['<!DOCTYPE html><html><head><title>Site synthétique</title>']
+        morceaux += [f'<link rel="stylesheet" href="{chemin}">' for chemin in self.fichiers if chemin.endswith('.css')]
+        morceaux += [f'<script src="{chemin}"></script>' for chemin in self.fichiers if chemin.endswith('.js')]
+        morceaux.append('</head><body>')
+        morceaux += [f'<div><h2>Photo {i}</h2><img src="{chemin}" alt="photo {i}"></div>'
+                     for i, chemin in enumerate(c for c in self.fichiers if c.endswith('.png'))]
+        morceaux.append('</body></html>')
+        return ''.join(morceaux).encode('utf-8')
+
+    def octets_total(self):
+        """Octets que doit télécharger une tâche sans erreur"""
+        return len(self.page) + sum(len(corps) for chemin, (corps, _) in self.fichiers.items()
+                                    if chemin not in self.en_erreur)
+
+
+class GestionnaireSynthetique(BaseHTTPRequestHandler):
+    """Sert un SiteSynthetique en simulant la latence, le débit et les erreurs"""
+
+    protocol_version = 'HTTP/1.1'
+    # Sans cela, l'en-tête et le corps partent dans deux segments retardés par Nagle
+    disable_nagle_algorithm = True
+    site = None
+
+    def do_GET(self):
+        p = self.site.parametres
+        if p['latence_ms']:
+            time.sleep(p['latence_ms'] / 1000)
+        if self.path == '/':
+            corps, type_contenu = self.site.page, 'text/html; charset=utf-8'
+        elif self.path in self.site.en_erreur:
+            self.send_error(503)
+            return
+        elif self.path in self.site.fichiers:
+            corps, type_contenu = self.site.fichiers[self.path]
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', type_contenu)
+        self.send_header('Content-Length', str(len(corps)))
+        self.end_headers()
+        self.envoyer(corps, p['debit_ko_s'])
+
+    def envoyer(self, corps, debit_ko_s):
+        if not debit_ko_s:
+            self.wfile.write(corps)
+            return
+        pause = TAILLE_BLOC / (debit_ko_s * 1024)
+        for debut in range(0, len(corps), TAILLE_BLOC):
+            self.wfile.write(corps[debut:debut + TAILLE_BLOC])
+            time.sleep(pause)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serveur_synthetique(site):
+    """Démarre un serveur local pour le site et renvoie son URL de base"""
+    gestionnaire = type('Gestionnaire', (GestionnaireSynthetique,), {'site': site})
+    serveur = ThreadingHTTPServer(('127.0.0.1', 0), gestionnaire)
+    serveur.daemon_threads = True
+    thread = threading.Thread(target=serveur.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{serveur.server_address[1]}/"
+    finally:
+        serveur.shutdown()
+        serveur.server_close()
+
+
+def rss_courant():
+    """Mémoire résidente actuelle du processus en octets (None si indisponible)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PicMemoire:
+    """
+    Relève le pic de mémoire résidente pendant un bloc with
+
+    Échantillonne /proc/self/statm ; ailleurs, se rabat sur ru_maxrss, qui
+    est le pic depuis le démarrage du processus et non celui du bloc.
+    """
+
+    def __init__(self, intervalle=0.01):
+        self.intervalle = intervalle
+        self.pic = 0
+        self._arret = threading.Event()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._echantillonner, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._arret.set()
+        self._thread.join()
+        if not self.pic:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.pic = maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def _echantillonner(self):
+        while True:
+            rss = rss_courant()
+            if rss is None:
+                return
+            self.pic = max(self.pic, rss)
+            if self._arret.wait(self.intervalle):
+                return
+
+
+def centile(valeurs, rang):
+    """Centile par la méthode du rang le plus proche (valeurs non vides)"""
+    ordonnees = sorted(valeurs)
+    indice = max(0, min(len(ordonnees) - 1, -(-rang * len(ordonnees) // 100) - 1))
+    return ordonnees[indice]
+
+
+def job_reussi(resultats):
+    """
+    Une tâche réussit si sa page a été capturée sans erreur et si ses seuls
+    téléchargements en échec sont les erreurs HTTP voulues par le site (taux_erreur)
+    """
+    erreurs = resultats.get('mesures', {}).get('erreurs', {})
+    return not resultats['erreurs'] and not any(nombre for genre, nombre in erreurs.items()
+                                                if genre != 'http')
+
+
+def executer_job(url, dossier, nom_format):
+    """Exécute une tâche complète : (durée du scraping, durée de l'archive, succès)"""
+    debut = time.perf_counter()
+    resultats = extraire_site_web(url, dossier)
+    duree = time.perf_counter() - debut
+    if not job_reussi(resultats):
+        return duree, None, False
+    extension = '.tar.zst' if nom_format == 'tar.zst' else '.zip'
+    statistiques = creer_archive(dossier, dossier + extension, nom_format)
+    return duree, statistiques['duree_s'], True
+
+
+def mesurer_scenario(parametres, nb_jobs=10, concurrence=1, nom_format='zip', graine=0):
+    """
+    Exécute nb_jobs tâches sur un site synthétique et résume les mesures
+
+    Returns:
+        dict: Paramètres du site et mesures (débit, latences, archive, RSS)
+    """
+    site = SiteSynthetique(graine, **parametres)
+    with tempfile.TemporaryDirectory(prefix='bench_scraper_') as racine, serveur_synthetique(site) as url:
+        dossiers = [os.path.join(racine, f'job_{i}') for i in range(nb_jobs)]
+        # Les messages du scraper sont masqués (redirect_stdout vaut pour tous les threads)
+        with PicMemoire() as memoire, contextlib.redirect_stdout(io.StringIO()):
+            debut = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrence) as executor:
+                mesures = list(executor.map(lambda dossier: executer_job(url, dossier, nom_format), dossiers))
+            duree_totale = time.perf_counter() - debut
+        for dossier in dossiers:
+            shutil.rmtree(dossier, ignore_errors=True)
+
+    latences = [duree for duree, _, _ in mesures]
+    archives = [duree for _, duree, succes in mesures if succes]
+    reussies = len(archives)
+    return {
+        'site': site.parametres,
+        'jobs': nb_jobs,
+        'concurrence': concurrence,
+        'format': nom_format,
+        'echecs': nb_jobs - reussies,
+        'duree_totale_s': round(duree_totale, 4),
+        'debit_jobs_s': round(nb_jobs / duree_totale, 3),
+        'debit_mo_s': round(reussies * site.octets_total() / duree_totale / (1024 * 1024), 3),
+        'latence_p50_s': round(centile(latences, 50), 4),
+        'latence_p99_s': round(centile(latences, 99), 4),
+        'archive_p50_s': round(centile(archives, 50), 4) if archives else None,
+        'pic_rss_mo': round(memoire.pic / (1024 * 1024), 1),
+    }
+
+
+def comparer(resultats, reference, tolerance):
+    """
+    Compare des résultats à une référence
+
+    Returns:
+        tuple: (lignes, ignorés) ; chaque ligne vaut (scénario, métrique,
+            référence, mesure, écart relatif, régression), ignorés liste les
+            scénarios mesurés avec d'autres paramètres que la référence
+    """
+    lignes, ignores = [], []
+    for nom, mesures in resultats['scenarios'].items():
+        attendues = reference.get('scenarios', {}).get(nom)
+        if not attendues:
+            continue
+        if any(attendues.get(cle) != mesures.get(cle) for cle in PARAMETRES_COMPARABLES):
+            ignores.append(nom)
+            continue
+        for metrique, (sens, bruit) in METRIQUES.items():
+            avant, apres = attendues.get(metrique), mesures.get(metrique)
+            if not avant or apres is None:
+                continue
+            ecart = (apres - avant) / avant
+            significatif = abs(apres - avant) > bruit
+            regression = significatif and (ecart < -tolerance if sens == 'plus' else ecart > tolerance)
+            lignes.append((nom, metrique, avant, apres, ecart, regression))
+    return lignes, ignores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="Scénarios à exécuter")
+    parser.add_argument('--jobs', type=int, default=10, help="Tâches par scénario")
+    parser.add_argument('--concurrence', type=int, default=1, help="Tâches exécutées en parallèle")
+    parser.add_argument('--format', choices=('zip', 'tar.zst'), default='zip', help="Format des archives")
+    parser.add_argument('--graine', type=int, default=0, help="Graine des contenus et des erreurs simulées")
+    parser.add_argument('--json', help="Fichier où écrire les résultats")
+    parser.add_argument('--reference', help="Résultats de référence à comparer")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Dégradation relative tolérée avant de signaler une régression")
+    parser.add_argument('--sauver-reference', help="Enregistrer les résultats comme nouvelle référence")
+    args = parser.parse_args()
+
+    resultats = {
+        'machine': {'python': platform.python_version(), 'plateforme': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'cree_le': time.time(),
+        'scenarios': {},
+    }
+    print(f"{'Scénario':<10} | {'Jobs/s':>7} | {'Mo/s':>7} | {'p50':>8} | {'p99':>8} | "
+          f"{'Archive':>8} | {'RSS':>7} | Échecs")
+    print("-" * 82)
+    for nom in args.scenarios:
+        mesures = mesurer_scenario(SCENARIOS[nom], args.jobs, args.concurrence, args.format, args.graine)
+        resultats['scenarios'][nom] = mesures
+        archive = f"{mesures['archive_p50_s']:.3f}s" if mesures['archive_p50_s'] is not None else '-'
+        print(f"{nom:<10} | {mesures['debit_jobs_s']:>7.2f} | {mesures['debit_mo_s']:>7.2f} | "
+              f"{mesures['latence_p50_s']:>7.3f}s | {mesures['latence_p99_s']:>7.3f}s | {archive:>8} | "
+              f"{mesures['pic_rss_mo']:>5.0f}Mo | {mesures['echecs']}")
+
+    for chemin in (args.json, args.sauver_reference):
+        if chemin:
+            with open(chemin, 'w', encoding='utf-8') as f:
+                json.dump(resultats, f, indent=2)
+            print(f"💾 Résultats écrits dans {chemin}")
+
+    if args.reference:
+        with open(args.reference, encoding='utf-8') as f:
+            reference = json.load(f)
+        lignes, ignores = comparer(resultats, reference, args.tolerance)
+        print(f"\n📊 Comparaison avec {args.reference} (tolérance {args.tolerance:.0%})")
+        for nom in ignores:
+            print(f"⚠️  {nom}: paramètres différents de la référence, comparaison ignorée")
+        for nom, metrique, avant, apres, ecart, regression in lignes:
+            print(f"{'⚠️ ' if regression else '✅'} {nom:<10} {metrique:<14} {avant:>10} → {apres:<10} ({ecart:+.1%})")
+        if any(ligne[-1] for ligne in lignes):
+            print("❌ Régression de performance détectée")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Cache HTTP persistant sur disque pour requests
+
+L'adaptateur respecte Cache-Control, conserve les validateurs (ETag,
+Last-Modified) et revalide les réponses périmées avec If-None-Match /
+If-Modified-Since : une réponse 304 ne coûte qu'un aller-retour.
+
+Une seule réponse est gardée par URL. Avec Vary, elle n'est réutilisée que
+par une requête dont les en-têtes nommés ont les mêmes valeurs ; une réponse
+Vary: * n'est jamais mise en cache.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from stockage_blobs import fichier_temporaire
+
+# Limites par défaut du cache
+TAILLE_MAX_CACHE = 500 * 1024 * 1024
+AGE_MAX_CACHE = 7 * 24 * 3600
+
+# En-têtes qui ne décrivent plus le corps une fois décompressé et stocké
+EN_TETES_IGNORES = {'content-encoding', 'content-length', 'transfer-encoding', 'connection'}
+
+
+def lire_cache_control(valeur):
+    """
+    Découpe un en-tête Cache-Control en dictionnaire {directive: valeur}
+    """
+    directives = {}
+    for morceau in (valeur or '').split(','):
+        morceau = morceau.strip().lower()
+        if not morceau:
+            continue
+        nom, _, argument = morceau.partition('=')
+        directives[nom.strip()] = argument.strip().strip('"')
+    return directives
+
+
+def lire_date(valeur):
+    """
+    Convertit une date HTTP en timestamp, ou None si elle est invalide
+    """
+    try:
+        return parsedate_to_datetime(valeur).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def duree_fraicheur(en_tetes):
+    """
+    Calcule la durée de fraîcheur d'une réponse en secondes (RFC 9111)
+    """
+    directives = lire_cache_control(en_tetes.get('Cache-Control'))
+    if 'no-cache' in directives:
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(0, int(directives['max-age']))
+        except ValueError:
+            return 0
+
+    date = lire_date(en_tetes.get('Date')) or time.time()
+    expiration = lire_date(en_tetes.get('Expires'))
+    if en_tetes.get('Expires') is not None:
+        return max(0, expiration - date) if expiration else 0
+
+    # Heuristique : 10% du temps écoulé depuis la dernière modification
+    modification = lire_date(en_tetes.get('Last-Modified'))
+    if modification:
+        return max(0, (date - modification) / 10)
+    return 0
+
+
+def en_tetes_vary(en_tetes_reponse, en_tetes_requete):
+    """
+    Valeurs des en-têtes de la requête nommés par le Vary de la réponse
+
+    Returns:
+        dict: {nom en minuscules: valeur (None si absent)}, ou None pour
+        Vary: * (réponse qui ne peut resservir à aucune requête)
+    """
+    noms = [nom.strip().lower() for nom in (en_tetes_reponse.get('Vary') or '').split(',') if nom.strip()]
+    if '*' in noms:
+        return None
+    return {nom: en_tetes_requete.get(nom) for nom in noms}
+
+
+class FluxEnregistre:
+    """
+    Enveloppe le flux brut d'une réponse et en recopie le contenu dans le cache
+
+    L'entrée n'est validée que lorsque le corps a été lu jusqu'au bout.
+    """
+
+    def __init__(self, brut, cache, cle, meta):
+        self._brut = brut
+        self._cache = cache
+        self._cle = cle
+        self._meta = meta
+        descripteur, self._chemin_temp = fichier_temporaire(cache.dossier)
+        self._fichier = os.fdopen(descripteur, 'wb')
+        self._taille = 0
+
+    def read(self, amt=None, decode_content=True, **kwargs):
+        donnees = self._brut.read(amt, decode_content=True)
+        if self._fichier is None:
+            return donnees
+        if donnees:
+            self._fichier.write(donnees)
+            self._taille += len(donnees)
+        if not donnees or amt is None:
+            self._terminer()
+        return donnees
+
+    def _terminer(self):
+        self._fichier.close()
+        self._fichier = None
+        self._meta['taille'] = self._taille
+        self._cache.valider(self._cle, self._chemin_temp, self._meta)
+
+    def _abandonner(self):
+        if self._fichier is not None:
+            self._fichier.close()
+            self._fichier = None
+            os.remove(self._chemin_temp)
+
+    def close(self):
+        self._abandonner()
+        self._brut.close()
+
+    def release_conn(self):
+        self._abandonner()
+        self._brut.release_conn()
+
+    @property
+    def closed(self):
+        return self._brut.closed
+
+
+class CacheDisque:
+    """
+    Stockage des réponses : <cle>.json (métadonnées) et <cle>.corps (contenu)
+    """
+
+    def __init__(self, dossier, taille_max=TAILLE_MAX_CACHE, age_max=AGE_MAX_CACHE):
+        self.dossier = dossier
+        self.taille_max = taille_max
+        self.age_max = age_max
+        Path(dossier).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def cle(url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _chemin(self, cle, extension):
+        return os.path.join(self.dossier, f"{cle}.{extension}")
+
+    def lire(self, cle):
+        """
+        Renvoie (meta, fichier du corps ouvert) ou None si l'entrée est absente ou incomplète
+        """
+        try:
+            with open(self._chemin(cle, 'json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            corps = open(self._chemin(cle, 'corps'), 'rb')
+        except (OSError, ValueError):
+            return None
+        if os.fstat(corps.fileno()).st_size != meta.get('taille'):
+            # Entrée en cours de remplacement par un autre thread
+            corps.close()
+            return None
+        return meta, corps
+
+    def valider(self, cle, chemin_temp, meta):
+        """
+        Installe atomiquement un corps complet et ses métadonnées
+        """
+        os.replace(chemin_temp, self._chemin(cle, 'corps'))
+        self.ecrire_meta(cle, meta)
+
+    def ecrire_meta(self, cle, meta):
+        descripteur, chemin_temp = fichier_temporaire(self.dossier)
+        with os.fdopen(descripteur, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(chemin_temp, self._chemin(cle, 'json'))
+
+    def toucher(self, cle):
+        """
+        Marque une entrée comme récemment utilisée (pour l'éviction LRU)
+        """
+        try:
+            os.utime(self._chemin(cle, 'corps'))
+        except OSError:
+            pass
+
+    def evincer(self):
+        """
+        Supprime les entrées trop anciennes puis les moins récemment utilisées
+        jusqu'à repasser sous la taille maximale
+
+        Returns:
+            int: Nombre d'entrées supprimées
+        """
+        maintenant = time.time()
+        entrees = []
+        for nom in os.listdir(self.dossier):
+            if not nom.endswith('.corps'):
+                continue
+            try:
+                infos = os.stat(os.path.join(self.dossier, nom))
+            except FileNotFoundError:
+                continue
+            entrees.append((infos.st_mtime, infos.st_size, nom[:-len('.corps')]))
+
+        entrees.sort()
+        total = sum(taille for _, taille, _ in entrees)
+        supprimees = 0
+        for utilisation, taille, cle in entrees:
+            if total <= self.taille_max and maintenant - utilisation <= self.age_max:
+                continue
+            for extension in ('json', 'corps'):
+                try:
+                    os.remove(self._chemin(cle, extension))
+                except FileNotFoundError:
+                    pass
+            total -= taille
+            supprimees += 1
+        return supprimees
+
+
+class AdaptateurCache(HTTPAdapter):
+    """
+    Adaptateur requests qui sert les réponses depuis un CacheDisque
+
+    Les compteurs 'hits', 'misses' et 'revalidations' sont tenus dans
+    self.statistiques.
+    """
+
+    def __init__(self, dossier, taille_max=TAILLE_MAX_CACHE, age_max=AGE_MAX_CACHE, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = CacheDisque(dossier, taille_max, age_max)
+        self.statistiques = {'hits': 0, 'misses': 0, 'revalidations': 0}
+        self._verrou = threading.Lock()
+
+    def _compter(self, compteur):
+        with self._verrou:
+            self.statistiques[compteur] += 1
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET' or 'Range' in request.headers:
+            return super().send(request, **kwargs)
+
+        cle = self.cache.cle(request.url)
+        entree = self.cache.lire(cle)
+        if entree and en_tetes_vary(CaseInsensitiveDict(entree[0]['en_tetes']),
+                                    request.headers) != entree[0].get('vary', {}):
+            # Réponse choisie pour d'autres en-têtes de requête (Vary) : elle sera remplacée
+            entree[1].close()
+            entree = None
+
+        if entree:
+            meta, corps = entree
+            age = time.time() - meta['stocke_le']
+            if age < meta['fraicheur']:
+                self._compter('hits')
+                self.cache.toucher(cle)
+                return self._depuis_cache(request, meta, corps)
+
+            # Entrée périmée : revalider avec les validateurs connus
+            # (noms d'en-têtes en minuscules avec HTTP/2)
+            en_tetes = CaseInsensitiveDict(meta['en_tetes'])
+            if en_tetes.get('ETag') or en_tetes.get('Last-Modified'):
+                requete = request.copy()
+                if en_tetes.get('ETag'):
+                    requete.headers['If-None-Match'] = en_tetes['ETag']
+                if en_tetes.get('Last-Modified'):
+                    requete.headers['If-Modified-Since'] = en_tetes['Last-Modified']
+                reponse = super().send(requete, **kwargs)
+                if reponse.status_code == 304:
+                    reponse.close()
+                    self._compter('revalidations')
+                    en_tetes.update(filtrer_en_tetes(reponse.headers))
+                    meta['en_tetes'] = dict(en_tetes)
+                    meta['stocke_le'] = time.time()
+                    meta['fraicheur'] = duree_fraicheur(en_tetes)
+                    meta['vary'] = en_tetes_vary(en_tetes, request.headers)
+                    if meta['vary'] is not None:
+                        self.cache.ecrire_meta(cle, meta)
+                        self.cache.toucher(cle)
+                    return self._depuis_cache(request, meta, corps)
+                corps.close()
+                self._compter('misses')
+                return self._enregistrer(cle, reponse)
+            corps.close()
+
+        self._compter('misses')
+        return self._enregistrer(cle, super().send(request, **kwargs))
+
+    def _enregistrer(self, cle, reponse):
+        """
+        Branche l'enregistrement du corps sur une réponse réseau si elle peut être mise en cache
+        """
+        directives = lire_cache_control(reponse.headers.get('Cache-Control'))
+        vary = en_tetes_vary(reponse.headers, reponse.request.headers)
+        if reponse.status_code != 200 or 'no-store' in directives or vary is None:
+            return reponse
+        meta = {
+            'url': reponse.url,
+            'en_tetes': filtrer_en_tetes(reponse.headers),
+            'stocke_le': time.time(),
+            'fraicheur': duree_fraicheur(reponse.headers),
+            'vary': vary,
+        }
+        reponse.raw = FluxEnregistre(reponse.raw, self.cache, cle, meta)
+        return reponse
+
+    def _depuis_cache(self, request, meta, corps):
+        """
+        Construit une réponse requests à partir d'une entrée du cache
+        """
+        reponse = Response()
+        reponse.status_code = 200
+        reponse.reason = 'OK'
+        reponse.headers = CaseInsensitiveDict(meta['en_tetes'])
+        reponse.headers['Content-Length'] = str(meta['taille'])
+        reponse.encoding = get_encoding_from_headers(reponse.headers)
+        reponse.raw = corps
+        reponse.url = request.url
+        reponse.request = request
+        reponse.connection = self
+        reponse.from_cache = True
+        return reponse
+
+
+def filtrer_en_tetes(en_tetes):
+    """
+    Garde les en-têtes utiles à conserver dans le cache
+    """
+    return {nom: valeur for nom, valeur in en_tetes.items() if nom.lower() not in EN_TETES_IGNORES}
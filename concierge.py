@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Nettoyage du dossier des téléchargements en arrière-plan
+
+Un thread « concierge » libère régulièrement de la place : il supprime
+les tâches inutilisées depuis trop longtemps, puis, tant que le quota
+d'octets est dépassé, les tâches les moins récemment téléchargées ou
+prévisualisées. Les tâches en cours d'exécution ou en cours d'envoi à un
+client ne sont jamais supprimées.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Valeurs par défaut
+INTERVALLE = 60
+DELAI_GRACE = 300
+
+
+class DossiersEnService:
+    """
+    Dossiers de tâches en cours d'envoi à un client dans ce processus
+
+    Les autres processus serveur sont protégés par le délai de grâce : une
+    tâche consultée récemment n'est jamais évincée.
+    """
+
+    def __init__(self):
+        self._compteurs = Counter()
+        self._verrou = threading.Lock()
+
+    def prendre(self, dossier):
+        """Marque le dossier comme en service (à libérer avec rendre)"""
+        with self._verrou:
+            self._compteurs[dossier] += 1
+
+    def rendre(self, dossier):
+        """Libère le dossier pris avec prendre"""
+        with self._verrou:
+            self._compteurs[dossier] -= 1
+            if self._compteurs[dossier] <= 0:
+                del self._compteurs[dossier]
+
+    @contextmanager
+    def utiliser(self, dossier):
+        """Marque le dossier comme en service pendant le bloc with"""
+        self.prendre(dossier)
+        try:
+            yield
+        finally:
+            self.rendre(dossier)
+
+    def dossiers(self):
+        """Ensemble des dossiers actuellement en service"""
+        with self._verrou:
+            return set(self._compteurs)
+
+
+def liberer_place(index, supprimer, age_max=None, quota_octets=None, delai_grace=DELAI_GRACE,
+                  en_service=None):
+    """
+    Choisit les tâches à supprimer et les supprime
+
+    Args:
+        index (IndexTaches): Index des tâches
+        supprimer (callable): Appelée avec l'entrée de chaque tâche retirée de
+            l'index (voir IndexTaches.retirer) pour effacer ses fichiers
+        age_max (int): Supprimer les tâches inutilisées depuis plus de age_max
+            secondes (None : pas de limite d'âge)
+        quota_octets (int): Place maximale occupée par les tâches (None : pas de quota)
+        delai_grace (int): Une tâche utilisée depuis moins de delai_grace secondes
+            n'est jamais évincée pour respecter le quota
+        en_service (DossiersEnService): Dossiers à ne pas toucher (optionnel)
+
+    Returns:
+        dict: Nombre de tâches expirées et évincées, octets libérés
+    """
+    exclure = en_service.dossiers() if en_service is not None else set()
+    bilan = {'expirees': 0, 'evincees': 0, 'octets_liberes': 0}
+
+    if age_max is not None:
+        for entree in index.expirer(age_max, exclure):
+            supprimer(entree)
+            bilan['expirees'] += 1
+            bilan['octets_liberes'] += entree['octets']
+
+    if quota_octets is not None:
+        exces = index.octets_total() - quota_octets
+        avant = time.time() - delai_grace
+        while exces > 0:
+            candidats = index.candidats_eviction(avant, exclure)
+            if not candidats:
+                break
+            for candidat in candidats:
+                if exces <= 0:
+                    break
+                entree = index.retirer(candidat['id'])
+                if entree is None:
+                    continue
+                supprimer(entree)
+                bilan['evincees'] += 1
+                bilan['octets_liberes'] += entree['octets']
+                exces -= entree['octets']
+    return bilan
+
+
+class Concierge:
+    """
+    Thread qui appelle périodiquement une fonction de nettoyage
+
+    Args:
+        nettoyer (callable): Passe de nettoyage, sans argument
+        intervalle (int): Secondes entre deux passes
+    """
+
+    def __init__(self, nettoyer, intervalle=INTERVALLE):
+        self.nettoyer = nettoyer
+        self.intervalle = intervalle
+        self._reveil = threading.Event()
+        self._arret = threading.Event()
+        self._thread = None
+        self._verrou = threading.Lock()
+
+    def demarrer(self):
+        """Démarre le thread s'il ne tourne pas encore"""
+        with self._verrou:
+            if self._thread is None or not self._thread.is_alive():
+                self._arret.clear()
+                self._thread = threading.Thread(target=self._boucle, daemon=True, name='concierge')
+                self._thread.start()
+
+    def reveiller(self):
+        """Lance une passe sans attendre la fin de l'intervalle"""
+        self._reveil.set()
+
+    def arreter(self):
+        """Arrête le thread après la passe en cours"""
+        self._arret.set()
+        self._reveil.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _boucle(self):
+        while not self._arret.is_set():
+            self._reveil.wait(self.intervalle)
+            self._reveil.clear()
+            if self._arret.is_set():
+                break
+            try:
+                self.nettoyer()
+            except Exception as e:
+                print(f"❌ Erreur lors du nettoyage: {e}")
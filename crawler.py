@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Exploration récursive d'un site : suit les liens internes jusqu'à une
+profondeur et un nombre de pages maximum
+
+Les ressources partagées entre pages ne sont téléchargées qu'une fois et
+les liens entre pages capturées sont réécrits vers les fichiers locaux.
+"""
+
+import hashlib
+import os
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from heapq import merge
+from pathlib import Path
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup
+from requests.compat import chardet
+
+from app import (
+    MAX_PAR_HOTE, MAX_TELECHARGEMENTS, PARSEUR_DEFAUT, TAILLE_BLOC, analyser_page, creer_resultats,
+    FichierTropVolumineux, TableUrls, avant_echeance, creer_session, normaliser_url, obtenir_page,
+    reecrire_liens, taille_max_pour, telecharger_ressources, echeance_atteinte, traiter_feuilles_css,
+)
+from cache_http import AdaptateurCache
+from manifeste import ecrire_manifeste
+from mesures import MesuresTache
+from politesse import Ordonnanceur
+from transports import TRANSPORT_DEFAUT
+
+# Limites par défaut de l'exploration
+PROFONDEUR_MAX = 2
+PAGES_MAX = 50
+
+# Dossier des pages capturées (hors page de départ)
+DOSSIER_PAGES = 'pages'
+
+
+class EnsembleUrls:
+    """
+    Ensemble compact d'URLs déjà vues
+
+    Chaque URL est réduite à une empreinte de 64 bits rangée dans un tableau
+    trié (8 octets par URL, soit ~8MB pour un million d'URLs). Les ajouts
+    récents sont gardés dans un tampon fusionné avec le tableau quand il en
+    atteint le huitième : chaque fusion coûte la taille du tableau, mais
+    elles s'espacent à mesure qu'il grandit et le coût d'un ajout reste
+    constant en moyenne (comme les niveaux d'un arbre LSM).
+    La probabilité de collision reste négligeable (~1e-8 pour 1M d'URLs).
+    """
+
+    # Taille minimale du tampon, puis fraction du tableau trié
+    TAILLE_TAMPON = 4096
+    RATIO_TAMPON = 8
+
+    def __init__(self):
+        self._triees = array('Q')
+        self._tampon = set()
+
+    @staticmethod
+    def _empreinte(url):
+        return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def _contient(self, empreinte):
+        if empreinte in self._tampon:
+            return True
+        i = bisect_left(self._triees, empreinte)
+        return i < len(self._triees) and self._triees[i] == empreinte
+
+    def __contains__(self, url):
+        return self._contient(self._empreinte(url))
+
+    def ajouter(self, url):
+        """
+        Ajoute une URL
+
+        Returns:
+            bool: True si l'URL n'avait pas encore été vue
+        """
+        empreinte = self._empreinte(url)
+        if self._contient(empreinte):
+            return False
+        self._tampon.add(empreinte)
+        if len(self._tampon) >= max(self.TAILLE_TAMPON, len(self._triees) // self.RATIO_TAMPON):
+            self._triees = array('Q', merge(self._triees, sorted(self._tampon)))
+            self._tampon.clear()
+        return True
+
+    def __len__(self):
+        return len(self._triees) + len(self._tampon)
+
+
+def generer_nom_page(url):
+    """
+    Génère un nom de fichier HTML unique pour une page à partir de son URL
+    """
+    parsed = urlparse(url)
+    nom = parsed.path.strip('/') or 'index'
+    nom = os.path.splitext(nom)[0]
+    nom = re.sub(r'[^A-Za-z0-9._-]', '_', nom)[:80]
+    url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
+    return f"{nom}_{url_hash}.html"
+
+
+def extraire_liens_internes(noeuds, hote):
+    """
+    Liste les liens <a href> relevés par analyser_page qui restent sur le
+    même site (URLs normalisées)
+    """
+    liens = []
+    for _, _, cible, type_fichier in noeuds:
+        if type_fichier != 'page' or not cible.startswith(('http://', 'https://')):
+            continue
+        cible = normaliser_url(cible)
+        if urlparse(cible).netloc == hote:
+            liens.append(cible)
+    return liens
+
+
+def lire_page_html(response, taille_max, echeance=None):
+    """
+    Lit en flux le corps d'une page HTML, dans la limite de taille_max octets
+
+    Returns:
+        tuple: (contenu en octets, texte décodé comme requests le ferait)
+
+    Raises:
+        FichierTropVolumineux: Si la page dépasse taille_max
+    """
+    longueur = response.headers.get('Content-Length')
+    if longueur and longueur.isdigit() and int(longueur) > taille_max:
+        raise FichierTropVolumineux(f"{longueur} bytes")
+    morceaux = response.iter_content(TAILLE_BLOC)
+    if echeance is not None:
+        morceaux = avant_echeance(morceaux, echeance)
+    contenu = bytearray()
+    for morceau in morceaux:
+        contenu += morceau
+        if len(contenu) > taille_max:
+            raise FichierTropVolumineux(f"plus de {taille_max} bytes")
+    contenu = bytes(contenu)
+    encodage = response.encoding or chardet.detect(contenu)['encoding'] or 'utf-8'
+    return contenu, str(contenu, encodage, errors='replace')
+
+
+def crawler_site(url, dossier_sortie="site_telecharge", profondeur_max=PROFONDEUR_MAX,
+                 pages_max=PAGES_MAX, max_telechargements=MAX_TELECHARGEMENTS,
+                 max_par_hote=MAX_PAR_HOTE, tailles_max=None, dossier_blobs=None,
+                 dossier_cache=None, progression=None, parseur=PARSEUR_DEFAUT, ordonnanceur=None,
+                 delai_max=None, transport=TRANSPORT_DEFAUT, dossier_capture=None):
+    """
+    Télécharge une page, ses ressources et les pages internes liées
+
+    La page de départ est enregistrée comme avec extraire_site_web
+    (index.html et index_local.html), les autres pages dans pages/.
+
+    Args:
+        url (str): L'URL de départ
+        dossier_sortie (str): Le dossier où sauvegarder les fichiers
+        profondeur_max (int): Nombre maximum de liens suivis depuis la page de départ
+        pages_max (int): Nombre maximum de pages capturées
+        tailles_max (dict): Tailles maximales par type, dont 'pages' pour les pages HTML
+        (autres paramètres : voir extraire_site_web)
+
+    À l'échéance (delai_max), les pages restant dans la frontière sont
+    ajoutées aux ressources ignorées avec le type 'page'.
+
+    Returns:
+        dict: Résultats comme extraire_site_web, plus 'pages' (pages capturées)
+        et 'pages_locales' (URL normalisée -> fichier local)
+    """
+
+    # Valider l'URL
+    if not url or not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError("L'URL doit être une chaîne valide commençant par http:// ou https://")
+
+    Path(dossier_sortie, DOSSIER_PAGES).mkdir(parents=True, exist_ok=True)
+    echeance = time.monotonic() + delai_max if delai_max else None
+    if ordonnanceur is None:
+        ordonnanceur = Ordonnanceur(max_par_hote)
+    session, adaptateur = creer_session(max_telechargements, dossier_cache, ordonnanceur, transport,
+                                        dossier_capture)
+
+    resultats = creer_resultats()
+    resultats.update({'base_url': url, 'pages': [], 'pages_locales': {}})
+    mesures = MesuresTache()
+    if progression is None:
+        progression = {}
+    progression.update({'etape': 'exploration', 'pages_capturees': 0,
+                        'ressources_total': 0, 'ressources_terminees': 0})
+
+    depart = normaliser_url(url)
+    hote = urlparse(depart).netloc
+    vues = EnsembleUrls()
+    vues.ajouter(depart)
+    frontiere = deque([(depart, 0)])
+    table = TableUrls(max_par_hote, ordonnanceur, echeance)
+    taille_max_page = taille_max_pour('pages', tailles_max)
+
+    while frontiere and len(resultats['pages']) < pages_max:
+        if echeance_atteinte(echeance):
+            resultats['ignorees'] += [{'url': page_url, 'type': 'page'} for page_url, _ in frontiere]
+            break
+        page_url, profondeur = frontiere.popleft()
+        try:
+            print(f"Téléchargement de {page_url}...")
+            with mesures.phase('page'):
+                # Les liens vers des documents (PDF, archives, vidéos...) sont écartés sur leurs en-têtes
+                with obtenir_page(session, ordonnanceur, page_url, echeance, stream=True) as response:
+                    response.raise_for_status()
+                    if 'html' not in response.headers.get('Content-Type', 'text/html'):
+                        continue
+                    contenu, texte = lire_page_html(response, taille_max_page, echeance)
+                mesures.transfert(len(contenu))
+        except Exception as e:
+            if echeance_atteinte(echeance) and resultats['pages']:
+                resultats['ignorees'].append({'url': page_url, 'type': 'page'})
+                continue
+            resultats['erreurs'].append(f"Erreur page {page_url}: {str(e)}")
+            mesures.erreur('page')
+            print(f"❌ Erreur: {e}")
+            continue
+
+        # Enregistrer la page originale
+        premiere_page = not resultats['pages']
+        if premiere_page:
+            fichier_page = f"{dossier_sortie}/index_local.html"
+            chemin_original = f"{dossier_sortie}/index.html"
+            resultats['html_original'] = texte
+        else:
+            fichier_page = f"{dossier_sortie}/{DOSSIER_PAGES}/{generer_nom_page(page_url)}"
+            chemin_original = fichier_page
+        with mesures.phase('ecriture'):
+            with open(chemin_original, 'w', encoding='utf-8') as f:
+                f.write(texte)
+        resultats['pages'].append({'url': page_url, 'fichier_local': fichier_page,
+                                   'fichier_original': chemin_original, 'profondeur': profondeur})
+        resultats['pages_locales'][page_url] = fichier_page
+        progression['pages_capturees'] = len(resultats['pages'])
+
+        with mesures.phase('analyse'):
+            soup = BeautifulSoup(contenu, parseur)
+            ressources, noeuds = analyser_page(soup, page_url)
+
+        # La table de la tâche ignore les ressources déjà téléchargées pour une autre page
+        with mesures.phase('ressources'):
+            telecharger_ressources(session, ressources, dossier_sortie, resultats,
+                                   max_telechargements, max_par_hote, tailles_max, dossier_blobs,
+                                   progression, table, mesures)
+
+        # Ajouter les liens internes à la frontière
+        if profondeur < profondeur_max:
+            for lien in extraire_liens_internes(noeuds, hote):
+                if len(frontiere) + len(resultats['pages']) >= pages_max:
+                    break
+                if vues.ajouter(lien):
+                    frontiere.append((lien, profondeur + 1))
+
+    # Les feuilles de style de toutes les pages sont suivies et réécrites en une fois
+    with mesures.phase('css'):
+        traiter_feuilles_css(session, dossier_sortie, resultats, max_telechargements, max_par_hote,
+                             tailles_max, dossier_blobs, progression, table, mesures)
+
+    # Réécrire les liens de chaque page, une fois l'ensemble des pages connu
+    progression['etape'] = 'liens'
+    for page in resultats['pages']:
+        try:
+            with mesures.phase('liens'):
+                with open(page['fichier_original'], encoding='utf-8') as f:
+                    soup = BeautifulSoup(f.read(), parseur)
+                _, noeuds = analyser_page(soup, page['url'])
+                reecrire_liens(noeuds, resultats, dossier_page=os.path.dirname(page['fichier_local']))
+                html_local = str(soup)
+            with mesures.phase('ecriture'):
+                with open(page['fichier_local'], 'w', encoding='utf-8') as f:
+                    f.write(html_local)
+        except Exception as e:
+            resultats['erreurs'].append(f"Erreur réécriture {page['url']}: {str(e)}")
+            mesures.erreur('liens')
+    progression['etape'] = 'termine'
+
+    resultats['urls_vues'] = len(vues)
+    if resultats['pages']:
+        with mesures.phase('manifeste'):
+            ecrire_manifeste(resultats, dossier_sortie)
+    resultats['mesures'] = mesures.en_dict()
+    if isinstance(adaptateur, AdaptateurCache):
+        resultats['cache'] = dict(adaptateur.statistiques)
+        adaptateur.cache.evincer()
+    session.close()
+
+    print(f"✅ {len(resultats['pages'])} page(s) téléchargée(s) dans le dossier '{dossier_sortie}'")
+    return resultats
+
+
+if __name__ == "__main__":
+    from app import afficher_resume
+
+    resultats = crawler_site("https://example.com", "mon_site_telecharge", profondeur_max=1)
+    afficher_resume(resultats)
@@ -30,11 +30,19 @@ def test_api():
     # Test 2: Scraping d'un site
     try:
         data = {"url": "https://example.com"}
-        response = requests.post(f"{base_url}/scrape", data=data)
-        if response.status_code == 200 and "Téléchargement Terminé" in response.text:
+        response = requests.post(f"{base_url}/scrape", data=data,
+                                 headers={"Accept": "application/json"})
+        job = response.json()
+        # Attendre la fin de la tâche en arrière-plan
+        for _ in range(60):
+            statut = requests.get(base_url + job["status_url"]).json()
+            if statut["status"] in ("terminee", "echouee"):
+                break
+            time.sleep(1)
+        if response.status_code == 202 and statut["status"] == "terminee":
             print("✅ Scraping: OK")
         else:
-            print(f"❌ Scraping: {response.status_code}")
+            print(f"❌ Scraping: {response.status_code} ({statut['status']})")
     except Exception as e:
         print(f"❌ Erreur scraping: {e}")
         return False
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Analyse et réécriture en flux des feuilles de style
+
+Les feuilles CSS téléchargées référencent d'autres fichiers : feuilles
+importées (@import), polices et images (url(...)). Le ScannerCss découpe
+une feuille en texte et en références, bloc par bloc, sans jamais charger
+le fichier entier ni appliquer d'expression régulière à tout son contenu :
+la mémoire utilisée ne dépend pas de la taille de la feuille.
+
+Les commentaires, les chaînes de caractères et les URLs data: sont
+recopiés tels quels.
+"""
+
+import codecs
+import os
+import re
+from collections import namedtuple
+
+# Taille des blocs lus dans les feuilles
+TAILLE_BLOC = 64 * 1024
+
+# Extensions des polices (rangées à part des images)
+EXTENSIONS_POLICES = ('.woff', '.woff2', '.ttf', '.otf', '.eot')
+
+# Une référence trouvée dans une feuille :
+#   genre  'import' (@import) ou 'url' (url(...))
+#   valeur URL telle qu'écrite dans la feuille (sans guillemets ni espaces)
+#   brut   texte d'origine de la référence, recopié si elle n'est pas réécrite
+Reference = namedtuple('Reference', 'genre valeur brut')
+
+# Début d'un élément à traiter en dehors du texte ordinaire
+DEBUT = re.compile(r'/\*|["\']|url\(|@import', re.IGNORECASE)
+# Texte conservé en fin de bloc, au cas où il commencerait un mot-clé coupé en deux
+RESERVE = len('@import') - 1
+# Au-delà, une référence inachevée est considérée comme mal formée
+TAILLE_MAX_REFERENCE = 8 * 1024
+
+NORMAL, COMMENTAIRE, CHAINE, DONNEES, REFERENCE = range(5)
+COMPLET, INCOMPLET, INVALIDE, EN_LIGNE = range(4)
+
+
+def lire_chaine(texte, debut):
+    """
+    Lit une chaîne CSS qui commence à texte[debut] (guillemet ouvrant)
+
+    Returns:
+        tuple: (statut, indice après le guillemet fermant, contenu)
+    """
+    guillemet = texte[debut]
+    i = debut + 1
+    while i < len(texte):
+        caractere = texte[i]
+        if caractere == '\\':
+            i += 2
+            continue
+        if caractere == guillemet:
+            return COMPLET, i + 1, texte[debut + 1:i]
+        if caractere == '\n':
+            return INVALIDE, i, None
+        i += 1
+    return INCOMPLET, len(texte), None
+
+
+def sauter_espaces(texte, i):
+    while i < len(texte) and texte[i] in ' \t\r\n\f':
+        i += 1
+    return i
+
+
+def lire_url(texte, debut):
+    """
+    Lit une fonction url(...) qui commence à texte[debut]
+
+    Returns:
+        tuple: (statut, indice après la parenthèse fermante, valeur) ; le
+        statut EN_LIGNE signale une URL data:, dont l'indice est celui du
+        début des données
+    """
+    i = sauter_espaces(texte, debut + len('url('))
+    if i >= len(texte):
+        return INCOMPLET, i, None
+    guillemet = texte[i] if texte[i] in '"\'' else ''
+    debut_valeur = i + len(guillemet)
+    if len(texte) - debut_valeur < len('data:'):
+        return INCOMPLET, len(texte), None
+    if texte[debut_valeur:debut_valeur + len('data:')].lower() == 'data:':
+        return EN_LIGNE, debut_valeur, guillemet
+    if guillemet:
+        statut, i, valeur = lire_chaine(texte, i)
+        if statut != COMPLET:
+            return statut, i, None
+    else:
+        fin = i
+        while fin < len(texte) and texte[fin] not in ' \t\r\n\f)"\'(':
+            fin += 1
+        valeur, i = texte[debut_valeur:fin], fin
+    i = sauter_espaces(texte, i)
+    if i >= len(texte):
+        return INCOMPLET, i, None
+    if texte[i] != ')':
+        return INVALIDE, i, None
+    return COMPLET, i + 1, valeur
+
+
+def lire_import(texte, debut):
+    """Lit une règle @import "..." ou @import url(...) qui commence à texte[debut]"""
+    i = sauter_espaces(texte, debut + len('@import'))
+    if i >= len(texte):
+        return INCOMPLET, i, None
+    if texte[i] in '"\'':
+        return lire_chaine(texte, i)
+    if len(texte) - i < len('url('):
+        return INCOMPLET, len(texte), None
+    if texte[i:i + len('url(')].lower() == 'url(':
+        statut, fin, valeur = lire_url(texte, i)
+        return (INVALIDE, fin, None) if statut == EN_LIGNE else (statut, fin, valeur)
+    return INVALIDE, i, None
+
+
+class ScannerCss:
+    """
+    Découpe une feuille de style fournie par morceaux de texte
+
+    alimenter() et terminer() renvoient la suite des segments reconnus :
+    du texte (str) ou des Reference. Recollés dans l'ordre, les textes et
+    les champs brut des références redonnent exactement la feuille.
+    """
+
+    def __init__(self):
+        self._etat = NORMAL
+        self._tampon = ''
+        self._guillemet = ''
+        self._precedent = ''
+
+    def alimenter(self, texte):
+        self._tampon += texte
+        return self._analyser(fin=False)
+
+    def terminer(self):
+        segments = self._analyser(fin=True)
+        if self._tampon:
+            segments.append(self._tampon)
+            self._tampon = ''
+        return segments
+
+    def _analyser(self, fin):
+        segments = []
+        tampon = self._tampon
+        position = 0
+
+        def texte(jusqua):
+            nonlocal position
+            if jusqua > position:
+                segments.append(tampon[position:jusqua])
+                self._precedent = tampon[jusqua - 1]
+                position = jusqua
+
+        while position < len(tampon):
+            if self._etat == NORMAL:
+                trouve = DEBUT.search(tampon, position)
+                if trouve is None:
+                    texte(len(tampon) if fin else max(position, len(tampon) - RESERVE))
+                    break
+                texte(trouve.start())
+                jeton = trouve.group().lower()
+                if jeton == '/*':
+                    texte(position + 2)
+                    self._etat = COMMENTAIRE
+                elif jeton in ('"', "'"):
+                    texte(position + 1)
+                    self._etat, self._guillemet = CHAINE, jeton
+                elif jeton == 'url(' and (self._precedent.isalnum() or self._precedent in '-_\\'):
+                    # Fin d'un identifiant (ex : myurl(...)), pas une URL
+                    texte(trouve.end())
+                else:
+                    self._etat = REFERENCE
+
+            elif self._etat == COMMENTAIRE:
+                fin_commentaire = tampon.find('*/', position)
+                if fin_commentaire < 0:
+                    # Garder un '*' final qui pourrait commencer la fin du commentaire
+                    texte(len(tampon) if fin else max(position, len(tampon) - 1))
+                    break
+                texte(fin_commentaire + 2)
+                self._etat = NORMAL
+
+            elif self._etat in (CHAINE, DONNEES):
+                # Recopier une chaîne, ou une URL data: jusqu'à sa parenthèse fermante
+                i = position
+                while i < len(tampon):
+                    caractere = tampon[i]
+                    if caractere == '\\':
+                        i += 2
+                        continue
+                    if self._guillemet and caractere == self._guillemet:
+                        self._guillemet = ''
+                        if self._etat == CHAINE:
+                            break
+                    elif not self._guillemet and self._etat == DONNEES:
+                        if caractere in '"\'':
+                            self._guillemet = caractere
+                        elif caractere == ')':
+                            break
+                    i += 1
+                if i >= len(tampon):
+                    # Un '\' final attend le caractère qu'il protège
+                    texte(len(tampon) if fin or tampon[-1] != '\\' else len(tampon) - 1)
+                    break
+                texte(i + 1)
+                self._etat = NORMAL
+
+            else:
+                lire = lire_url if tampon[position] in 'uU' else lire_import
+                statut, suite, valeur = lire(tampon, position)
+                if statut == INCOMPLET and not fin and len(tampon) - position < TAILLE_MAX_REFERENCE:
+                    break
+                if statut == COMPLET and valeur.strip():
+                    genre = 'import' if lire is lire_import else 'url'
+                    segments.append(Reference(genre, valeur.strip(), tampon[position:suite]))
+                    self._precedent = ')'
+                    position = suite
+                    self._etat = NORMAL
+                elif statut == EN_LIGNE:
+                    texte(suite)
+                    self._etat, self._guillemet = DONNEES, valeur
+                else:
+                    # Référence vide ou mal formée : recopier le mot-clé et continuer après lui
+                    texte(position + (len('url(') if lire is lire_url else len('@import')))
+                    self._etat = NORMAL
+
+        self._tampon = tampon[position:]
+        return segments
+
+
+def lire_feuille(chemin, taille_bloc=TAILLE_BLOC):
+    """
+    Segments d'une feuille de style lue par blocs
+
+    Les octets invalides en UTF-8 sont conservés (surrogateescape) : une
+    feuille réécrite garde exactement les octets qui ne sont pas réécrits.
+    """
+    decodeur = codecs.getincrementaldecoder('utf-8')(errors='surrogateescape')
+    scanner = ScannerCss()
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(taille_bloc), b''):
+            yield from scanner.alimenter(decodeur.decode(bloc))
+    yield from scanner.alimenter(decodeur.decode(b'', final=True))
+    yield from scanner.terminer()
+
+
+def references_feuille(chemin):
+    """Références (genre, valeur) d'une feuille, dans l'ordre, sans doublons"""
+    return list(dict.fromkeys((segment.genre, segment.valeur) for segment in lire_feuille(chemin)
+                              if isinstance(segment, Reference)))
+
+
+def type_reference(genre, url):
+    """Type de ressource d'une référence : 'css' (@import), 'polices' ou 'images'"""
+    if genre == 'import':
+        return 'css'
+    chemin = url.split('?')[0].split('#')[0].lower()
+    return 'polices' if chemin.endswith(EXTENSIONS_POLICES) else 'images'
+
+
+def reecrire_feuille(chemin, remplacer):
+    """
+    Blocs (bytes) de la feuille avec ses références réécrites
+
+    Args:
+        chemin (str): Feuille à lire
+        remplacer (callable): Appelée avec chaque Reference, renvoie la
+            nouvelle URL ou None pour garder la référence d'origine
+    """
+    morceaux = []
+    taille = 0
+    for segment in lire_feuille(chemin):
+        if isinstance(segment, Reference):
+            nouvelle = remplacer(segment)
+            if nouvelle is None:
+                segment = segment.brut
+            elif segment.genre == 'import':
+                segment = f'@import url("{echapper(nouvelle)}")'
+            else:
+                segment = f'url("{echapper(nouvelle)}")'
+        morceaux.append(segment)
+        taille += len(segment)
+        if taille >= TAILLE_BLOC:
+            yield ''.join(morceaux).encode('utf-8', errors='surrogateescape')
+            morceaux, taille = [], 0
+    if morceaux:
+        yield ''.join(morceaux).encode('utf-8', errors='surrogateescape')
+
+
+def echapper(url):
+    """Échappe une URL pour l'écrire entre guillemets doubles"""
+    return url.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\a ')
+
+
+def chemin_relatif(fichier, feuille):
+    """Chemin d'un fichier local vu depuis le dossier d'une feuille, au format URL"""
+    return os.path.relpath(fichier, os.path.dirname(feuille)).replace(os.sep, '/')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+File de tâches en arrière-plan pour l'application Flask
+
+Les tâches sont placées dans une file bornée et exécutées par un nombre
+fixe de threads. Quand la file est pleine, la soumission est refusée
+(FilePleine) au lieu d'accumuler du travail sans limite.
+"""
+
+import queue
+import threading
+import time
+import uuid
+
+# Valeurs par défaut
+NB_WORKERS = 2
+TAILLE_FILE = 20
+
+# États possibles d'une tâche
+EN_ATTENTE = 'en_attente'
+EN_COURS = 'en_cours'
+TERMINEE = 'terminee'
+ECHOUEE = 'echouee'
+
+
+class FilePleine(Exception):
+    """Levée quand la file de tâches a atteint sa capacité maximale"""
+
+
+class FileTaches:
+    """
+    File bornée de tâches exécutées par un pool de threads
+
+    Args:
+        executer (callable): Fonction appelée avec le dictionnaire de la tâche ;
+            elle y range son résultat et met à jour tache['progression']
+        taches (dict): Registre des tâches par identifiant (partagé avec l'application)
+        nb_workers (int): Nombre de threads d'exécution
+        taille_max (int): Nombre maximum de tâches en attente
+        au_changement (callable): Appelée avec la tâche à chaque changement d'état,
+            par exemple pour la persister (optionnelle)
+    """
+
+    def __init__(self, executer, taches=None, nb_workers=NB_WORKERS, taille_max=TAILLE_FILE,
+                 au_changement=None):
+        self.executer = executer
+        self.au_changement = au_changement
+        self.taches = taches if taches is not None else {}
+        self.nb_workers = nb_workers
+        self.file = queue.Queue(maxsize=taille_max)
+        self._verrou = threading.Lock()
+        self._workers = []
+
+    def demarrer(self):
+        """Démarre les threads d'exécution s'ils ne tournent pas encore"""
+        with self._verrou:
+            while len(self._workers) < self.nb_workers:
+                worker = threading.Thread(target=self._boucle, daemon=True,
+                                          name=f"worker-scrape-{len(self._workers)}")
+                worker.start()
+                self._workers.append(worker)
+
+    def soumettre(self, **parametres):
+        """
+        Crée une tâche et la place dans la file
+
+        Returns:
+            dict: La tâche créée (son 'id' permet d'en suivre l'état)
+
+        Raises:
+            FilePleine: Si la file a atteint sa capacité
+        """
+        self.demarrer()
+        tache = {
+            'id': uuid.uuid4().hex,
+            'statut': EN_ATTENTE,
+            'parametres': parametres,
+            'progression': {},
+            'resultat': None,
+            'erreur': None,
+            'cree_le': time.time(),
+            'debut': None,
+            'fin': None,
+        }
+        with self._verrou:
+            # Enregistrée avant la mise en file : un worker peut la prendre aussitôt
+            self.taches[tache['id']] = tache
+            try:
+                self.file.put_nowait(tache['id'])
+            except queue.Full:
+                del self.taches[tache['id']]
+                raise FilePleine(f"{self.file.maxsize} tâches déjà en attente")
+        self._notifier(tache)
+        return tache
+
+    def obtenir(self, tache_id):
+        """Renvoie la tâche correspondant à l'identifiant, ou None"""
+        return self.taches.get(tache_id)
+
+    def en_attente(self):
+        """Nombre de tâches en attente d'exécution"""
+        return self.file.qsize()
+
+    def purger(self, age_max):
+        """
+        Oublie les tâches terminées depuis plus de age_max secondes
+
+        Returns:
+            int: Nombre de tâches supprimées du registre
+        """
+        limite = time.time() - age_max
+        with self._verrou:
+            anciennes = [tache_id for tache_id, tache in self.taches.items()
+                         if tache['fin'] and tache['fin'] < limite]
+            for tache_id in anciennes:
+                del self.taches[tache_id]
+        return len(anciennes)
+
+    def _boucle(self):
+        while True:
+            tache_id = self.file.get()
+            tache = self.taches.get(tache_id)
+            try:
+                if tache is not None:
+                    self._executer(tache)
+            finally:
+                self.file.task_done()
+
+    def _executer(self, tache):
+        tache['statut'] = EN_COURS
+        tache['debut'] = time.time()
+        self._notifier(tache)
+        try:
+            self.executer(tache)
+            tache['statut'] = TERMINEE
+        except Exception as e:
+            tache['erreur'] = str(e)
+            tache['statut'] = ECHOUEE
+        finally:
+            tache['fin'] = time.time()
+            self._notifier(tache)
+
+    def _notifier(self, tache):
+        if self.au_changement is None:
+            return
+        try:
+            self.au_changement(tache)
+        except Exception as e:
+            print(f"❌ Erreur lors de l'enregistrement de la tâche {tache['id']}: {e}")
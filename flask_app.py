@@ -4,14 +4,30 @@ Application Flask pour le scraper web
 Interface web pour télécharger des sites web
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, flash, redirect, url_for
+from flask import (Flask, Response, render_template, request, jsonify, send_file, flash, redirect,
+                   url_for, abort, stream_with_context)
+from werkzeug.utils import safe_join
 import os
 import shutil
-import zipfile
 from datetime import datetime
 import threading
 import time
-from app import extraire_site_web, afficher_resume
+import hashlib
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from app import normaliser_url
+from archives import FORMATS, format_archive, generer_archive
+from pool_processus import PoolProcessus, executer_job, job_echoue
+from stockage_blobs import dossier_reprises, nettoyer_blobs
+from reprises import nettoyer_reprises
+from manifeste import lire_manifeste
+from mesures import RegistreMetriques
+from profilage import chemins_profil, doit_profiler, supprimer_profil
+from index_taches import IndexTaches
+from concierge import Concierge, DossiersEnService, liberer_place
+from file_taches import FileTaches, FilePleine, TERMINEE, ECHOUEE
+from crawler import PAGES_MAX
 
 app = Flask(__name__)
 app.secret_key = 'scraper_web_secret_key_2024'
@@ -19,6 +35,14 @@ app.secret_key = 'scraper_web_secret_key_2024'
 # Configuration
 UPLOAD_FOLDER = 'downloads'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Stockage des ressources adressé par contenu, partagé entre toutes les tâches
+app.config['BLOBS_FOLDER'] = os.path.join(UPLOAD_FOLDER, '.blobs')
+# Cache HTTP persistant, revalidé avec ETag / Last-Modified
+app.config['CACHE_FOLDER'] = os.path.join(UPLOAD_FOLDER, '.cache')
+# Profils des tâches profilées (cProfile et tracemalloc)
+app.config['PROFILS_FOLDER'] = os.path.join(UPLOAD_FOLDER, '.profils')
+# Index SQLite des tâches et de leurs fichiers, partagé entre processus serveur
+app.config['INDEX_DB'] = os.environ.get('SCRAPER_INDEX_DB', os.path.join(UPLOAD_FOLDER, '.index.sqlite3'))
 
 # Créer le dossier de téléchargements
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -26,6 +50,83 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # Stockage des tâches en cours
 tasks = {}
 
+# Index des tâches, ouverts à la demande (un par fichier de base configuré)
+index_ouverts = {}
+verrou_index = threading.Lock()
+
+# Dossiers en cours d'envoi à un client, que le nettoyage ne doit pas supprimer
+en_service = DossiersEnService()
+
+# Utilisation du cache des résultats dans ce processus : 'frais' (capture récente
+# réutilisée), 'en_cours' (rattachée à une tâche en cours), 'absent' (nouvelle tâche)
+statistiques_cache = Counter()
+verrou_cache = threading.Lock()
+
+# Mesures agrégées des tâches de ce processus, exposées sur /metrics
+metriques = RegistreMetriques()
+
+# Exécution des tâches en arrière-plan
+app.config['NB_WORKERS'] = int(os.environ.get('SCRAPER_WORKERS', 2))
+app.config['TAILLE_FILE'] = int(os.environ.get('SCRAPER_TAILLE_FILE', 20))
+# 'threads' (par défaut) ou 'processus' pour répartir les tâches sur tous les cœurs
+app.config['MODE_EXECUTION'] = os.environ.get('SCRAPER_MODE', 'threads')
+app.config['TACHES_PAR_PROCESSUS'] = int(os.environ.get('SCRAPER_TACHES_PAR_PROCESSUS', 50))
+# Les archives sont compressées à la volée lors du téléchargement ; activer pour
+# les écrire aussi sur le disque à la fin de chaque tâche
+app.config['ZIP_SUR_DISQUE'] = os.environ.get('SCRAPER_ZIP_SUR_DISQUE', '0') == '1'
+# Format des archives ('zip' ou 'tar.zst') et niveau de compression (défaut : selon le format)
+app.config['FORMAT_ARCHIVE'] = os.environ.get('SCRAPER_FORMAT_ARCHIVE', 'zip')
+app.config['NIVEAU_COMPRESSION'] = int(os.environ['SCRAPER_NIVEAU_COMPRESSION']) \
+    if os.environ.get('SCRAPER_NIVEAU_COMPRESSION') else None
+# Cœurs utilisés au plus par une archive produite à la volée ; les téléchargements
+# simultanés se partagent un même pool de threads de compression (un par cœur)
+app.config['WORKERS_COMPRESSION'] = int(os.environ.get('SCRAPER_WORKERS_COMPRESSION', 2))
+# Nettoyage en arrière-plan : quota d'octets (0 : illimité), âge maximum depuis la
+# dernière utilisation (0 : illimité), intervalle entre deux passes, et délai de
+# grâce pendant lequel une tâche consultée n'est pas évincée
+app.config['QUOTA_OCTETS'] = int(os.environ.get('SCRAPER_QUOTA_OCTETS', 0))
+app.config['AGE_MAX'] = int(os.environ.get('SCRAPER_AGE_MAX', 3600))
+app.config['INTERVALLE_NETTOYAGE'] = int(os.environ.get('SCRAPER_INTERVALLE_NETTOYAGE', 60))
+app.config['DELAI_GRACE'] = int(os.environ.get('SCRAPER_DELAI_GRACE', 300))
+# Cache des résultats : une même URL (avec les mêmes options) demandée depuis moins de
+# CACHE_TTL secondes réutilise la capture existante (0 : désactivé)
+app.config['CACHE_TTL'] = int(os.environ.get('SCRAPER_CACHE_TTL', 300))
+# Au-delà de cette durée, une tâche encore « en cours » n'accueille plus de nouvelles demandes
+app.config['DUREE_MAX_TACHE'] = int(os.environ.get('SCRAPER_DUREE_MAX_TACHE', 3600))
+# Proportion des tâches profilées automatiquement (ex : 0.01 pour une sur cent) ;
+# une tâche peut aussi être profilée à la demande avec le paramètre 'profile'
+app.config['PROFIL_TAUX'] = float(os.environ.get('SCRAPER_PROFIL_TAUX', 0))
+# Politesse envers les sites, commune à toutes les tâches d'un processus : requêtes
+# simultanées et requêtes par seconde par hôte (0 : illimité), rafale tolérée, et
+# lecture du Crawl-delay des robots.txt
+app.config['MAX_PAR_HOTE'] = int(os.environ.get('SCRAPER_MAX_PAR_HOTE', 4))
+app.config['REQUETES_PAR_SECONDE'] = float(os.environ.get('SCRAPER_REQUETES_PAR_SECONDE', 10))
+app.config['RAFALE'] = int(os.environ.get('SCRAPER_RAFALE', 10))
+app.config['ROBOTS'] = os.environ.get('SCRAPER_ROBOTS', '1') == '1'
+# Nombre maximum de pages qu'une exploration peut demander
+app.config['PAGES_MAX'] = int(os.environ.get('SCRAPER_PAGES_MAX', 500))
+# Temps accordé à chaque tâche en secondes (0 : illimité) ; à l'échéance, la capture
+# est rendue partielle (ressources restantes listées). Une demande peut réduire ce budget
+app.config['BUDGET_TACHE'] = float(os.environ.get('SCRAPER_BUDGET_TACHE', 120))
+# Mémoire réduite pour les très grandes pages : page écrite sur le disque, analysée et
+# réécrite en flux sans BeautifulSoup (pages uniques ; l'exploration n'est pas concernée)
+app.config['MEMOIRE_REDUITE'] = os.environ.get('SCRAPER_MEMOIRE_REDUITE', '0') == '1'
+# Transport HTTP des tâches : 'requests', 'http2' (paquet httpx[http2]), 'enregistrement'
+# (réponses gardées dans CAPTURES_FOLDER) ou 'rejeu' (réponses servies depuis CAPTURES_FOLDER)
+app.config['TRANSPORT'] = os.environ.get('SCRAPER_TRANSPORT', 'requests')
+app.config['CAPTURES_FOLDER'] = os.environ.get('SCRAPER_CAPTURES', os.path.join(UPLOAD_FOLDER, '.captures'))
+
+# Pool de processus, créé au premier besoin en mode 'processus'
+pool_processus = None
+
+# Threads de compression des archives produites à la volée, communs à tous les téléchargements
+executeur_compression = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='compression')
+
+@app.before_request
+def demarrer_services():
+    """Démarrer le nettoyage en arrière-plan avec la première requête"""
+    concierge.demarrer()
+
 @app.route('/')
 def index():
     """Page d'accueil avec le formulaire"""
@@ -33,65 +134,328 @@ def index():
 
 @app.route('/scrape', methods=['POST'])
 def scrape_website():
-    """Traiter la demande de scraping"""
+    """Placer une demande de scraping dans la file des tâches"""
+    donnees = request.form if request.form else (request.get_json(silent=True) or {})
+    url = (donnees.get('url') or '').strip()
+
+    if not url:
+        return refuser('Veuillez entrer une URL', 400)
+
+    # Valider l'URL
+    if not url.startswith(('http://', 'https://')):
+        return refuser('L\'URL doit commencer par http:// ou https://', 400)
+
+    # Exploration des liens internes (optionnelle)
     try:
-        url = request.form.get('url', '').strip()
-        
-        if not url:
-            flash('Veuillez entrer une URL', 'error')
-            return redirect(url_for('index'))
-        
-        # Valider l'URL
-        if not url.startswith(('http://', 'https://')):
-            flash('L\'URL doit commencer par http:// ou https://', 'error')
-            return redirect(url_for('index'))
-        
-        # Générer un nom de dossier unique
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        folder_name = f"site_{timestamp}"
-        download_path = os.path.join(app.config['UPLOAD_FOLDER'], folder_name)
-        
-        # Lancer le scraping
-        resultats = extraire_site_web(url, download_path)
-        
-        if resultats['erreurs']:
-            error_msg = '; '.join(resultats['erreurs'])
-            flash(f'Erreurs lors du téléchargement: {error_msg}', 'error')
-            return redirect(url_for('index'))
-        
-        # Créer un fichier ZIP
-        zip_path = f"{download_path}.zip"
-        create_zip(download_path, zip_path)
-        
-        # Préparer les informations pour l'affichage
-        info = {
-            'url': url,
-            'folder': folder_name,
-            'zip_file': f"{folder_name}.zip",
-            'html_size': len(resultats['html_original']),
-            'css_count': len(resultats['fichiers_css']),
-            'js_count': len(resultats['fichiers_js']),
-            'images_count': len(resultats['images']),
-            'files': get_file_list(download_path)
-        }
-        
-        flash('Site téléchargé avec succès!', 'success')
-        return render_template('result.html', info=info)
-        
-    except ValueError as e:
-        flash(f'Erreur de validation: {str(e)}', 'error')
-        return redirect(url_for('index'))
-    except Exception as e:
-        flash(f'Erreur lors du téléchargement: {str(e)}', 'error')
+        profondeur_max = int(donnees.get('depth') or 0)
+        pages_max = int(donnees.get('max_pages') or 0) or PAGES_MAX
+    except (TypeError, ValueError):
+        return refuser('Les paramètres depth et max_pages doivent être des entiers', 400)
+    if profondeur_max < 0 or pages_max > app.config['PAGES_MAX']:
+        return refuser(f"Exploration limitée à {app.config['PAGES_MAX']} pages", 400)
+
+    try:
+        budget = float(donnees.get('budget') or 0)
+    except (TypeError, ValueError):
+        return refuser('Le paramètre budget doit être un nombre de secondes', 400)
+    if budget < 0:
+        return refuser('Le paramètre budget doit être positif', 400)
+    if app.config['BUDGET_TACHE']:
+        budget = min(budget or app.config['BUDGET_TACHE'], app.config['BUDGET_TACHE'])
+
+    format_demande = donnees.get('format') or app.config['FORMAT_ARCHIVE']
+    if format_demande not in FORMATS:
+        return refuser(f"Format d'archive inconnu (formats : {', '.join(FORMATS)})", 400)
+
+    parametres = {'url': url, 'profondeur_max': profondeur_max, 'pages_max': pages_max,
+                  'format_archive': format_demande, 'budget': budget or None}
+    forcer = str(donnees.get('force') or '').lower() in ('1', 'true', 'on')
+    # Un profil n'a de sens que pour une nouvelle capture : ignorer le cache
+    if str(donnees.get('profile') or '').lower() in ('1', 'true', 'on'):
+        parametres['profiler'] = forcer = True
+    try:
+        tache, origine = soumettre_avec_cache(parametres, forcer)
+    except FilePleine:
+        return refuser('Trop de téléchargements en cours, réessayez dans quelques instants', 429)
+
+    if veut_json():
+        return jsonify({
+            'job_id': tache['id'],
+            'cache': origine,
+            'status_url': url_for('job_status', job_id=tache['id']),
+            'result_url': url_for('job_result', job_id=tache['id']),
+        }), 200 if origine == 'frais' else 202
+    return redirect(url_for('job_result', job_id=tache['id']))
+
+def cle_cache(parametres):
+    """Clé d'une demande : URL normalisée et options qui changent le résultat"""
+    description = [normaliser_url(parametres['url']), parametres['profondeur_max'], parametres['pages_max'],
+                   parametres['format_archive'], parametres.get('budget')]
+    return hashlib.sha256(json.dumps(description).encode('utf-8')).hexdigest()
+
+def soumettre_avec_cache(parametres, forcer=False):
+    """
+    Réutiliser une capture récente ou une tâche en cours pour la même demande,
+    sinon placer une nouvelle tâche dans la file
+
+    Returns:
+        tuple: (tâche, origine) ; origine vaut 'frais', 'en_cours' ou 'absent'
+
+    Raises:
+        FilePleine: Si une nouvelle tâche est nécessaire et que la file est pleine
+    """
+    cle = cle_cache(parametres)
+    with verrou_cache:
+        if app.config['CACHE_TTL'] and not forcer:
+            maintenant = time.time()
+            tache = index_taches().tache_recente(cle, maintenant - app.config['CACHE_TTL'],
+                                                 maintenant - app.config['DUREE_MAX_TACHE'])
+            # Une capture partielle (échéance atteinte) n'est pas réutilisée
+            if tache is not None and not (tache['resultat'] or {}).get('partial'):
+                origine = 'frais' if tache['statut'] == TERMINEE else 'en_cours'
+                statistiques_cache[origine] += 1
+                return tache, origine
+        tache = file_taches.soumettre(cle=cle, **parametres)
+        statistiques_cache['absent'] += 1
+        return tache, 'absent'
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Taux de réutilisation du cache des résultats (depuis le démarrage de ce processus)"""
+    demandes = sum(statistiques_cache.values())
+    reutilisees = statistiques_cache['frais'] + statistiques_cache['en_cours']
+    return jsonify({
+        'ttl': app.config['CACHE_TTL'],
+        'demandes': demandes,
+        'frais': statistiques_cache['frais'],
+        'en_cours': statistiques_cache['en_cours'],
+        'absent': statistiques_cache['absent'],
+        'taux_reutilisation': round(reutilisees / demandes, 3) if demandes else None,
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Mesures des tâches au format Prometheus (compteurs propres à ce processus)"""
+    return Response(metriques.exposer(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/jobs')
+def job_history():
+    """Historique des tâches, filtrable par état et par URL (paramètres status, q, limit, offset)"""
+    try:
+        limite = min(int(request.args.get('limit', 50)), 500)
+        decalage = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'erreur': 'Les paramètres limit et offset doivent être des entiers'}), 400
+    taches = index_taches().historique(statut=request.args.get('status'), recherche=request.args.get('q'),
+                                       limite=limite, decalage=decalage)
+    return jsonify({'jobs': [etat_tache(tache) for tache in taches]})
+
+@app.route('/assets')
+def asset_search():
+    """Retrouver les tâches contenant une ressource, par empreinte SHA-256 ou par URL d'origine"""
+    sha256 = request.args.get('sha256')
+    url = request.args.get('url')
+    if not sha256 and not url:
+        return jsonify({'erreur': 'Paramètre sha256 ou url requis'}), 400
+    return jsonify({'assets': index_taches().taches_avec_fichier(sha256=sha256, url=url)})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """État et progression d'une tâche"""
+    tache = charger_tache(job_id)
+    if tache is None:
+        return jsonify({'erreur': 'Tâche inconnue'}), 404
+    return jsonify(etat_tache(tache))
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Statistiques cProfile complètes d'une tâche profilée (fichier .pstats)"""
+    tache = charger_tache(job_id)
+    if tache is None or not tache.get('dossier'):
+        return jsonify({'erreur': 'Tâche inconnue'}), 404
+    chemin = chemins_profil(app.config['PROFILS_FOLDER'], tache['dossier'])[0]
+    if not os.path.isfile(chemin):
+        return jsonify({'erreur': "Cette tâche n'a pas été profilée"}), 404
+    return send_file(os.path.abspath(chemin), as_attachment=True, download_name=f"{tache['dossier']}.pstats")
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Résultat d'une tâche : page de résultats, ou page d'attente si elle n'est pas finie"""
+    tache = charger_tache(job_id)
+    if tache is None:
+        if veut_json():
+            return jsonify({'erreur': 'Tâche inconnue'}), 404
+        abort(404)
+
+    if veut_json():
+        if tache['statut'] not in (TERMINEE, ECHOUEE):
+            return jsonify(etat_tache(tache)), 202
+        return jsonify(dict(etat_tache(tache), resultat=tache['resultat']))
+
+    if tache['statut'] == ECHOUEE:
+        flash(f"Erreurs lors du téléchargement: {tache['erreur']}", 'error')
         return redirect(url_for('index'))
+    if tache['statut'] == TERMINEE:
+        flash('Site téléchargé avec succès!', 'success')
+        return render_template('result.html', info=tache['resultat'], job_id=job_id)
+    return render_template('job.html', tache=etat_tache(tache))
+
+def executer_scraping(tache):
+    """Exécuter une tâche de scraping (appelée par un worker de la file)"""
+    url = tache['parametres']['url']
+
+    # Générer un nom de dossier unique
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    folder_name = f"site_{timestamp}_{tache['id'][:8]}"
+    download_path = os.path.join(app.config['UPLOAD_FOLDER'], folder_name)
+    tache['dossier'] = folder_name
+    index_taches().enregistrer_tache(tache)
+    archive_file = folder_name + FORMATS[tache['parametres'].get('format_archive', 'zip')]
+    zip_path = os.path.join(app.config['UPLOAD_FOLDER'], archive_file) if app.config['ZIP_SUR_DISQUE'] else None
+    options = {
+        'niveau_compression': app.config['NIVEAU_COMPRESSION'],
+        'dossier_blobs': app.config['BLOBS_FOLDER'],
+        'dossier_cache': app.config['CACHE_FOLDER'],
+        'profondeur_max': tache['parametres'].get('profondeur_max', 0),
+        'pages_max': tache['parametres'].get('pages_max', PAGES_MAX),
+        'max_par_hote': app.config['MAX_PAR_HOTE'],
+        'delai_max': tache['parametres'].get('budget'),
+        'memoire_reduite': app.config['MEMOIRE_REDUITE'],
+        'transport': app.config['TRANSPORT'],
+        'dossier_capture': app.config['CAPTURES_FOLDER'],
+        'politesse': {
+            'max_par_hote': app.config['MAX_PAR_HOTE'],
+            'requetes_par_seconde': app.config['REQUETES_PAR_SECONDE'],
+            'rafale': app.config['RAFALE'],
+            'robots': app.config['ROBOTS'],
+        },
+    }
+    if doit_profiler(tache['parametres'].get('profiler'), app.config['PROFIL_TAUX']):
+        options['dossier_profils'] = app.config['PROFILS_FOLDER']
+
+    # Lancer le scraping (et créer l'archive sur le disque si demandé)
+    if app.config['MODE_EXECUTION'] == 'processus':
+        pool = obtenir_pool_processus()
+        tache['progression'] = pool.progression_partagee()
+        manifeste = pool.soumettre(url, download_path, zip_path, tache['progression'], **options).result()
+    else:
+        manifeste = executer_job(url, download_path, zip_path, tache['progression'], **options)
+    metriques.observer_tache(manifeste['mesures'])
+
+    if job_echoue(manifeste):
+        raise RuntimeError('; '.join(manifeste['erreurs']))
+
+    # Indexer les fichiers produits, décrits par le manifeste de la tâche
+    fichiers = lire_manifeste(download_path)
+    if fichiers is not None:
+        octets = fichiers['taille_totale'] + (os.path.getsize(zip_path) if zip_path else 0)
+        index_taches().enregistrer_fichiers(tache['id'], fichiers, octets)
+
+    # Préparer les informations pour l'affichage
+    tache['resultat'] = {
+        'url': url,
+        'folder': folder_name,
+        'zip_file': archive_file,
+        'archive': manifeste.get('archive'),
+        'html_size': manifeste['html_size'],
+        'css_count': len(manifeste['fichiers_css']),
+        'js_count': len(manifeste['fichiers_js']),
+        'images_count': len(manifeste['images']),
+        'fonts_count': len(manifeste.get('polices', [])),
+        'partial': bool(manifeste.get('ignorees')),
+        'skipped': manifeste.get('ignorees', []),
+        'pages_count': len(manifeste.get('pages', [])) or 1,
+        'mesures': manifeste['mesures'],
+        'profil': manifeste.get('profil'),
+        'files': get_file_list(download_path)
+    }
+
+def index_taches():
+    """Renvoie l'index des tâches configuré, ouvert au premier appel"""
+    chemin = app.config['INDEX_DB']
+    with verrou_index:
+        if chemin not in index_ouverts:
+            index_ouverts[chemin] = IndexTaches(chemin, app.config['UPLOAD_FOLDER'])
+        return index_ouverts[chemin]
+
+def charger_tache(job_id):
+    """
+    Renvoie une tâche de ce processus, ou à défaut celle enregistrée dans l'index
+    (tâche d'un autre processus serveur ou d'avant un redémarrage)
+    """
+    tache = file_taches.obtenir(job_id)
+    if tache is None:
+        tache = index_taches().obtenir(job_id)
+        if tache is not None and tache['resultat'] is not None:
+            tache['resultat']['files'] = [{
+                'name': os.path.basename(fichier['chemin']),
+                'path': fichier['chemin'],
+                'size': format_file_size(fichier['taille'] or 0)
+            } for fichier in index_taches().fichiers(job_id)]
+    return tache
+
+def obtenir_pool_processus():
+    """Renvoie le pool de processus, créé au premier appel"""
+    global pool_processus
+    if pool_processus is None:
+        pool_processus = PoolProcessus(app.config['NB_WORKERS'], app.config['TACHES_PAR_PROCESSUS'])
+    return pool_processus
+
+def etat_tache(tache):
+    """Représentation publique (JSON) d'une tâche"""
+    return {
+        'job_id': tache['id'],
+        'url': tache['parametres']['url'],
+        'status': tache['statut'],
+        'progress': dict(tache['progression']),
+        'error': tache['erreur'],
+        'created_at': tache['cree_le'],
+        'started_at': tache['debut'],
+        'finished_at': tache['fin'],
+        'queued': file_taches.en_attente(),
+    }
+
+def veut_json():
+    """La requête attend-elle une réponse JSON plutôt qu'une page HTML ?"""
+    if request.is_json:
+        return True
+    meilleur = request.accept_mimetypes.best_match(['text/html', 'application/json'])
+    return meilleur == 'application/json'
+
+def refuser(message, code):
+    """Répondre par une erreur, en JSON ou sur la page d'accueil"""
+    if veut_json():
+        return jsonify({'erreur': message}), code
+    flash(message, 'error')
+    return render_template('index.html'), code
+
+def tache_modifiee(tache):
+    """Enregistrer chaque changement d'état dans l'index et compter les tâches finies"""
+    index_taches().enregistrer_tache(tache)
+    if tache['statut'] in (TERMINEE, ECHOUEE):
+        metriques.compter_tache(tache['statut'])
+
+file_taches = FileTaches(executer_scraping, taches=tasks, nb_workers=app.config['NB_WORKERS'],
+                         taille_max=app.config['TAILLE_FILE'], au_changement=tache_modifiee)
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    """Télécharger le fichier ZIP"""
+    """Télécharger l'archive, depuis le disque ou compressée à la volée"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
+        nom_format = format_archive(filename)
+        tache = index_taches().par_dossier(filename[:-len(FORMATS[nom_format])]) if nom_format else None
+        # L'état en mémoire est le plus à jour pour les tâches de ce processus
+        tache = tache and (file_taches.obtenir(tache['id']) or tache)
+        if tache is None or tache['statut'] != TERMINEE:
+            flash('Fichier non trouvé', 'error')
+            return redirect(url_for('index'))
+        index_taches().toucher(tache['dossier'])
+        file_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        folder_path = safe_join(app.config['UPLOAD_FOLDER'], tache['dossier'])
+        if os.path.isfile(file_path):
             return send_file(file_path, as_attachment=True)
+        elif os.path.isdir(folder_path):
+            return streamer_archive(folder_path, filename, nom_format, tache['id'])
         else:
             flash('Fichier non trouvé', 'error')
             return redirect(url_for('index'))
@@ -99,13 +463,43 @@ def download_file(filename):
         flash(f'Erreur lors du téléchargement: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def streamer_archive(folder_path, filename, nom_format, job_id=None):
+    """Réponse HTTP découpée (chunked) contenant l'archive produite à la volée"""
+    def generer():
+        statistiques = {}
+        nb_workers = max(1, min(app.config['WORKERS_COMPRESSION'], os.cpu_count() or 1))
+        yield from generer_archive(folder_path, nom_format, app.config['NIVEAU_COMPRESSION'], nb_workers,
+                                   statistiques=statistiques, executeur=executeur_compression)
+        metriques.observer_archive(statistiques['duree_s'])
+        print(f"📦 {filename} : {statistiques['octets_archive']} octets en {statistiques['duree_s']} s "
+              f"(ratio {statistiques['ratio']}, {statistiques['membres_stockes']} fichier(s) stocké(s) sans compression)")
+        # Rattacher les statistiques à la tâche qui a produit ce dossier
+        tache = charger_tache(job_id) if job_id else None
+        if tache is not None and tache['resultat'] is not None:
+            tache['resultat']['archive'] = statistiques
+            index_taches().enregistrer_tache(tache)
+
+    # Le dossier est lu pendant tout l'envoi : le protéger du nettoyage jusqu'à la fin de la réponse
+    dossier = os.path.basename(folder_path)
+    en_service.prendre(dossier)
+    mimetype = 'application/zip' if nom_format == 'zip' else 'application/zstd'
+    reponse = Response(
+        stream_with_context(generer()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+    reponse.call_on_close(lambda: en_service.rendre(dossier))
+    return reponse
+
 @app.route('/preview/<folder>/<path:filename>')
 def preview_file(folder, filename):
-    """Prévisualiser un fichier"""
+    """Prévisualiser un fichier enregistré dans l'index"""
     try:
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], folder, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path)
+        fichier = index_taches().fichier(folder, filename)
+        file_path = safe_join(app.config['UPLOAD_FOLDER'], folder, filename)
+        if fichier is not None and file_path and os.path.isfile(file_path):
+            index_taches().toucher(folder)
+            return send_file(file_path, mimetype=fichier['type_mime'])
         else:
             return "Fichier non trouvé", 404
     except Exception as e:
@@ -113,25 +507,25 @@ def preview_file(folder, filename):
 
 @app.route('/cleanup')
 def cleanup():
-    """Nettoyer les anciens fichiers"""
+    """Lancer le nettoyage des anciens fichiers en arrière-plan"""
     try:
-        cleanup_old_files()
-        flash('Nettoyage effectué avec succès', 'success')
+        concierge.reveiller()
+        flash('Nettoyage lancé', 'success')
     except Exception as e:
         flash(f'Erreur lors du nettoyage: {str(e)}', 'error')
     return redirect(url_for('index'))
 
-def create_zip(folder_path, zip_path):
-    """Créer un fichier ZIP du dossier téléchargé"""
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zipf.write(file_path, arcname)
-
 def get_file_list(folder_path):
-    """Obtenir la liste des fichiers téléchargés"""
+    """Obtenir la liste des fichiers téléchargés, depuis le manifeste de la tâche"""
+    manifeste = lire_manifeste(folder_path)
+    if manifeste is not None:
+        return [{
+            'name': os.path.basename(fichier['chemin']),
+            'path': fichier['chemin'],
+            'size': format_file_size(fichier['taille'] or 0)
+        } for fichier in manifeste['fichiers']]
+
+    # Dossier sans manifeste (tâche antérieure) : parcourir le disque
     files = []
     if os.path.exists(folder_path):
         for root, dirs, filenames in os.walk(folder_path):
@@ -156,16 +550,56 @@ def format_file_size(size_bytes):
         i += 1
     return f"{size_bytes:.1f} {size_names[i]}"
 
-def cleanup_old_files():
-    """Nettoyer les fichiers de plus de 1 heure"""
-    current_time = time.time()
-    for item in os.listdir(app.config['UPLOAD_FOLDER']):
-        item_path = os.path.join(app.config['UPLOAD_FOLDER'], item)
-        if os.path.getctime(item_path) < current_time - 3600:  # 1 heure
-            if os.path.isdir(item_path):
-                shutil.rmtree(item_path)
-            else:
-                os.remove(item_path)
+def cleanup_old_files(age_max=None, quota_octets=None, delai_grace=None):
+    """
+    Supprimer les tâches inutilisées depuis plus de age_max secondes, puis les
+    moins récemment téléchargées ou prévisualisées tant que le quota est dépassé,
+    et enfin les blobs qui ne sont plus utilisés
+
+    Les paramètres non fournis sont lus dans la configuration. Les tâches en
+    cours ou en cours d'envoi ne sont jamais supprimées. Les tâches et leurs
+    blobs sont lus dans l'index : le travail dépend du nombre de tâches
+    supprimées, pas du nombre de fichiers sur le disque. Les téléchargements
+    partiels (.part) abandonnés depuis plus d'un jour sont aussi supprimés.
+
+    Returns:
+        dict: Bilan du nettoyage (voir concierge.liberer_place)
+    """
+    if age_max is None:
+        age_max = app.config['AGE_MAX'] or None
+    if quota_octets is None:
+        quota_octets = app.config['QUOTA_OCTETS'] or None
+    if delai_grace is None:
+        delai_grace = app.config['DELAI_GRACE']
+
+    empreintes = set()
+    tout_verifier = False
+
+    def supprimer(entree):
+        nonlocal tout_verifier
+        empreintes.update(entree['empreintes'])
+        tout_verifier = tout_verifier or not entree['empreintes_completes']
+        item_path = safe_join(app.config['UPLOAD_FOLDER'], entree['dossier']) if entree['dossier'] else None
+        if item_path is None:
+            return
+        supprimer_profil(app.config['PROFILS_FOLDER'], entree['dossier'])
+        if os.path.isdir(item_path):
+            shutil.rmtree(item_path, ignore_errors=True)
+        for chemin in [item_path + extension for extension in FORMATS.values()]:
+            if os.path.isfile(chemin):
+                os.remove(chemin)
+
+    bilan = liberer_place(index_taches(), supprimer, age_max, quota_octets, delai_grace, en_service)
+    if bilan['expirees'] or bilan['evincees']:
+        nettoyer_blobs(app.config['BLOBS_FOLDER'], None if tout_verifier else empreintes)
+        print(f"🧹 {bilan['expirees']} tâche(s) expirée(s), {bilan['evincees']} évincée(s) "
+              f"pour respecter le quota, {format_file_size(bilan['octets_liberes'])} libérés")
+    file_taches.purger(age_max or 3600)
+    # Téléchargements partiels jamais repris
+    nettoyer_reprises(dossier_reprises(app.config['BLOBS_FOLDER']))
+    return bilan
+
+concierge = Concierge(cleanup_old_files, app.config['INTERVALLE_NETTOYAGE'])
 
 if __name__ == '__main__':
     print("🚀 Démarrage du serveur Flask...")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Analyse et réécriture en flux des pages HTML
+
+Pour les très grandes pages, BeautifulSoup construit un arbre qui occupe
+plusieurs fois la taille du document. Le ScannerHtml découpe la page
+bloc par bloc en texte et en balises ouvrantes, ce qui suffit à trouver
+les ressources et à réécrire leurs liens : la mémoire utilisée ne dépend
+pas de la taille de la page.
+
+Comme html.parser (l'analyseur par défaut de BeautifulSoup), le contenu
+des balises script et style n'est pas analysé, ni celui des commentaires.
+"""
+
+import codecs
+import html
+import re
+from collections import namedtuple
+
+# Taille des blocs lus dans les pages
+TAILLE_BLOC = 64 * 1024
+
+# Une balise ouvrante :
+#   nom        nom de la balise, en minuscules
+#   attributs  nom (minuscules) -> Attribut, premier attribut de ce nom
+#   brut       texte d'origine de la balise
+Balise = namedtuple('Balise', 'nom attributs brut')
+
+# Un attribut d'une balise : valeur décodée (entités HTML résolues), position
+# de la valeur dans le texte brut de la balise (guillemets exclus) et guillemet
+Attribut = namedtuple('Attribut', 'valeur debut fin guillemet')
+
+NOM_BALISE = re.compile(r'<([a-zA-Z][^\s/>]*)')
+ATTRIBUT = re.compile(r'''([^\s"'>/=][^\s"'>/=]*)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?''')
+# Balises dont le contenu est du texte brut, jusqu'à la balise fermante
+TEXTE_BRUT = ('script', 'style')
+FIN_COMMENTAIRE = re.compile('-->')
+# Au-delà, une balise inachevée est recopiée telle quelle
+TAILLE_MAX_BALISE = 64 * 1024
+
+NORMAL, COMMENTAIRE, BRUT = range(3)
+
+
+def fin_balise(texte, debut):
+    """Indice après le '>' de la balise qui commence à texte[debut], ou None si elle est inachevée"""
+    guillemet = None
+    apres_egal = False
+    for i in range(debut + 1, len(texte)):
+        caractere = texte[i]
+        if guillemet:
+            if caractere == guillemet:
+                guillemet = None
+            continue
+        if caractere in '"\'' and apres_egal:
+            guillemet = caractere
+        elif caractere == '>':
+            return i + 1
+        apres_egal = caractere == '=' or (apres_egal and caractere in ' \t\r\n\f')
+    return None
+
+
+def lire_balise(brut):
+    """Balise décrite par le texte complet d'une balise ouvrante"""
+    nom = NOM_BALISE.match(brut)
+    attributs = {}
+    for attribut in ATTRIBUT.finditer(brut, nom.end(), len(brut) - 1):
+        cle = attribut.group(1).lower()
+        if cle in attributs:
+            continue
+        for groupe, guillemet in ((2, '"'), (3, "'"), (4, '')):
+            if attribut.group(groupe) is not None:
+                attributs[cle] = Attribut(html.unescape(attribut.group(groupe)), attribut.start(groupe),
+                                          attribut.end(groupe), guillemet)
+                break
+        else:
+            attributs[cle] = Attribut('', attribut.end(), attribut.end(), None)
+    return Balise(nom.group(1).lower(), attributs, brut)
+
+
+class ScannerHtml:
+    """
+    Découpe une page HTML fournie par morceaux de texte
+
+    alimenter() et terminer() renvoient la suite des segments reconnus : du
+    texte (str) ou des Balise ouvrantes. Recollés dans l'ordre, les textes et
+    les champs brut des balises redonnent exactement la page.
+    """
+
+    def __init__(self):
+        self._etat = NORMAL
+        self._tampon = ''
+        # Marque de fin du commentaire ou du texte brut en cours (ex : </script)
+        self._fin = None
+
+    def alimenter(self, texte):
+        self._tampon += texte
+        return self._analyser(fin=False)
+
+    def terminer(self):
+        segments = self._analyser(fin=True)
+        if self._tampon:
+            segments.append(self._tampon)
+            self._tampon = ''
+        return segments
+
+    def _analyser(self, fin):
+        segments = []
+        tampon = self._tampon
+        position = 0
+
+        def texte(jusqua):
+            nonlocal position
+            if jusqua > position:
+                segments.append(tampon[position:jusqua])
+                position = jusqua
+
+        while position < len(tampon):
+            if self._etat == NORMAL:
+                debut = tampon.find('<', position)
+                if debut < 0:
+                    texte(len(tampon))
+                    break
+                texte(debut)
+                if len(tampon) - debut < 4 and not fin:
+                    break
+                if tampon.startswith('<!--', debut):
+                    texte(debut + 4)
+                    self._etat, self._fin = COMMENTAIRE, FIN_COMMENTAIRE
+                    continue
+                if not NOM_BALISE.match(tampon, debut):
+                    # Balise fermante, doctype ou simple '<' : recopiés sans analyse
+                    texte(debut + 1)
+                    continue
+                fin_texte = fin_balise(tampon, debut)
+                if fin_texte is None:
+                    if not fin and len(tampon) - debut < TAILLE_MAX_BALISE:
+                        break
+                    texte(debut + 1)
+                    continue
+                balise = lire_balise(tampon[debut:fin_texte])
+                segments.append(balise)
+                position = fin_texte
+                if balise.nom in TEXTE_BRUT and not balise.brut.endswith('/>'):
+                    self._etat, self._fin = BRUT, re.compile(re.escape('</' + balise.nom), re.IGNORECASE)
+
+            else:
+                trouve = self._fin.search(tampon, position)
+                if trouve is None:
+                    # Garder de quoi reconnaître une marque coupée entre deux blocs
+                    reserve = len(self._fin.pattern) - 1
+                    texte(len(tampon) if fin else max(position, len(tampon) - reserve))
+                    break
+                # La balise fermante d'un texte brut est recopiée avec le texte qui suit
+                texte(trouve.end() if self._etat == COMMENTAIRE else trouve.start())
+                self._etat = NORMAL
+
+        self._tampon = tampon[position:]
+        return segments
+
+
+def lire_page(chemin, encodage='utf-8', taille_bloc=TAILLE_BLOC):
+    """
+    Segments d'une page HTML lue par blocs
+
+    Les octets invalides dans l'encodage sont conservés (surrogateescape) :
+    une page réécrite garde exactement les octets qui ne sont pas réécrits.
+    """
+    decodeur = codecs.getincrementaldecoder(encodage)(errors='surrogateescape')
+    scanner = ScannerHtml()
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(taille_bloc), b''):
+            yield from scanner.alimenter(decodeur.decode(bloc))
+    yield from scanner.alimenter(decodeur.decode(b'', final=True))
+    yield from scanner.terminer()
+
+
+def remplacer_attribut(balise, nom, valeur):
+    """Texte brut de la balise avec la valeur de l'attribut remplacée"""
+    attribut = balise.attributs[nom]
+    valeur = html.escape(valeur, quote=True)
+    if attribut.guillemet:
+        return balise.brut[:attribut.debut] + valeur + balise.brut[attribut.fin:]
+    return f'{balise.brut[:attribut.debut]}"{valeur}"{balise.brut[attribut.fin:]}'
+
+
+def reecrire_page(chemin, encodage, remplacer):
+    """
+    Blocs (bytes) de la page avec des balises réécrites
+
+    Args:
+        chemin (str): Page à lire
+        encodage (str): Encodage de la page, conservé dans le résultat
+        remplacer (callable): Appelée avec chaque Balise, renvoie son nouveau
+            texte brut ou None pour la garder telle quelle
+    """
+    morceaux = []
+    taille = 0
+    for segment in lire_page(chemin, encodage):
+        if isinstance(segment, Balise):
+            segment = remplacer(segment) or segment.brut
+        morceaux.append(segment)
+        taille += len(segment)
+        if taille >= TAILLE_BLOC:
+            yield ''.join(morceaux).encode(encodage, errors='surrogateescape')
+            morceaux, taille = [], 0
+    if morceaux:
+        yield ''.join(morceaux).encode(encodage, errors='surrogateescape')
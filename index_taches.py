@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Index SQLite des tâches et des fichiers qu'elles ont produits
+
+La base (en mode WAL) est un simple fichier dans le dossier des
+téléchargements : plusieurs processus serveur peuvent partager l'état des
+tâches sans service réseau, et cet état survit aux redémarrages. Les
+routes de téléchargement, de prévisualisation, de nettoyage et
+d'historique l'interrogent au lieu de parcourir le disque.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from archives import FORMATS
+from manifeste import lire_manifeste, type_mime
+
+# Version du schéma, conservée dans PRAGMA user_version
+VERSION_SCHEMA = 3
+
+SCHEMA_V1 = """
+CREATE TABLE IF NOT EXISTS taches (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    dossier TEXT UNIQUE,
+    statut TEXT NOT NULL,
+    parametres TEXT,
+    erreur TEXT,
+    resultat TEXT,
+    cree_le REAL NOT NULL,
+    debut REAL,
+    fin REAL
+);
+CREATE INDEX IF NOT EXISTS taches_cree_le ON taches (cree_le);
+CREATE INDEX IF NOT EXISTS taches_statut ON taches (statut, cree_le);
+CREATE INDEX IF NOT EXISTS taches_url ON taches (url);
+
+CREATE TABLE IF NOT EXISTS fichiers (
+    tache_id TEXT NOT NULL REFERENCES taches (id) ON DELETE CASCADE,
+    chemin TEXT NOT NULL,
+    taille INTEGER,
+    sha256 TEXT,
+    type_mime TEXT,
+    url TEXT,
+    PRIMARY KEY (tache_id, chemin)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fichiers_sha256 ON fichiers (sha256);
+CREATE INDEX IF NOT EXISTS fichiers_url ON fichiers (url);
+"""
+
+# Taille de chaque tâche sur le disque et date de son dernier téléchargement ou
+# de sa dernière prévisualisation, pour l'éviction par quota
+SCHEMA_V2 = """
+ALTER TABLE taches ADD COLUMN octets INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE taches ADD COLUMN dernier_acces REAL;
+UPDATE taches SET octets = (SELECT COALESCE(SUM(taille), 0) FROM fichiers WHERE tache_id = taches.id);
+CREATE INDEX IF NOT EXISTS taches_utilisation ON taches (COALESCE(dernier_acces, fin, cree_le));
+"""
+
+# Clé de cache (URL normalisée et options) pour réutiliser une tâche récente
+SCHEMA_V3 = """
+ALTER TABLE taches ADD COLUMN cle TEXT;
+CREATE INDEX IF NOT EXISTS taches_cle ON taches (cle, cree_le);
+"""
+
+MIGRATIONS = {1: SCHEMA_V1, 2: SCHEMA_V2, 3: SCHEMA_V3}
+
+# Dernière utilisation d'une tâche : dernier accès, sinon fin, sinon création
+UTILISATION = 'COALESCE(dernier_acces, fin, cree_le)'
+
+# Les tâches dans ces états ne sont jamais supprimées par le nettoyage
+ETATS_ACTIFS = ('en_attente', 'en_cours')
+
+COLONNES_TACHE = 'id, url, dossier, statut, parametres, erreur, resultat, cree_le, debut, fin'
+
+
+class IndexTaches:
+    """
+    Index des tâches et de leurs fichiers
+
+    Chaque thread utilise sa propre connexion ; SQLite en mode WAL permet
+    des lectures concurrentes pendant une écriture, y compris depuis
+    d'autres processus.
+
+    Args:
+        chemin (str): Fichier de la base
+        dossier_racine (str): Dossier des téléchargements ; à la création de la
+            base, les dossiers déjà présents y sont importés (optionnel)
+    """
+
+    def __init__(self, chemin, dossier_racine=None):
+        self.chemin = chemin
+        self.dossier_racine = dossier_racine
+        self._local = threading.local()
+        self._initialiser()
+
+    def _connexion(self):
+        connexion = getattr(self._local, 'connexion', None)
+        if connexion is None:
+            connexion = sqlite3.connect(self.chemin, timeout=30, isolation_level=None)
+            connexion.row_factory = sqlite3.Row
+            connexion.execute('PRAGMA journal_mode=WAL')
+            connexion.execute('PRAGMA synchronous=NORMAL')
+            connexion.execute('PRAGMA foreign_keys=ON')
+            self._local.connexion = connexion
+        return connexion
+
+    def _initialiser(self):
+        os.makedirs(os.path.dirname(self.chemin) or '.', exist_ok=True)
+        connexion = self._connexion()
+        connexion.execute('BEGIN IMMEDIATE')
+        try:
+            version = connexion.execute('PRAGMA user_version').fetchone()[0]
+            for numero in range(version + 1, VERSION_SCHEMA + 1):
+                for instruction in MIGRATIONS[numero].split(';'):
+                    if instruction.strip():
+                        connexion.execute(instruction)
+            if version == 0 and self.dossier_racine:
+                self._importer_dossiers(connexion)
+            connexion.execute(f'PRAGMA user_version={VERSION_SCHEMA}')
+            connexion.execute('COMMIT')
+        except BaseException:
+            connexion.execute('ROLLBACK')
+            raise
+
+    def _importer_dossiers(self, connexion):
+        """Enregistre les tâches antérieures à l'index, d'après le contenu du dossier"""
+        extensions = tuple(FORMATS.values())
+        for nom in sorted(os.listdir(self.dossier_racine)):
+            chemin = os.path.join(self.dossier_racine, nom)
+            if nom.startswith('.') or (os.path.isfile(chemin) and not nom.endswith(extensions)):
+                continue
+            dossier = nom
+            for extension in extensions:
+                if nom.endswith(extension):
+                    dossier = nom[:-len(extension)]
+            manifeste = None
+            if os.path.isdir(chemin):
+                manifeste = lire_manifeste(chemin) or lister_dossier(chemin)
+            connexion.execute(
+                'INSERT OR IGNORE INTO taches (id, url, dossier, statut, cree_le, fin) VALUES (?, ?, ?, ?, ?, ?)',
+                (dossier, (manifeste or {}).get('url') or '', dossier, 'terminee',
+                 os.path.getctime(chemin), os.path.getctime(chemin)))
+            if manifeste:
+                self._inserer_fichiers(connexion, dossier, manifeste)
+            else:
+                # Archive sur le disque (le dossier, nommé avant elle, a déjà été compté)
+                connexion.execute('UPDATE taches SET octets = octets + ? WHERE id = ?',
+                                  (os.path.getsize(chemin), dossier))
+
+    def enregistrer_tache(self, tache):
+        """
+        Crée ou met à jour une tâche de la file (voir file_taches.FileTaches)
+
+        La liste des fichiers du résultat n'est pas dupliquée : elle est
+        reconstruite à partir de la table des fichiers. Le paramètre 'cle'
+        de la tâche, s'il existe, sert à la retrouver (voir tache_recente).
+        """
+        resultat = tache['resultat']
+        if resultat is not None:
+            resultat = {cle: valeur for cle, valeur in resultat.items() if cle != 'files'}
+        self._connexion().execute(
+            # Mise à jour en place : un REPLACE supprimerait en cascade les fichiers de la tâche
+            f'INSERT INTO taches ({COLONNES_TACHE}, cle) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (id) DO UPDATE SET dossier = excluded.dossier, statut = excluded.statut, '
+            'erreur = excluded.erreur, resultat = excluded.resultat, debut = excluded.debut, fin = excluded.fin',
+            (tache['id'], tache['parametres']['url'], tache.get('dossier'), tache['statut'],
+             json.dumps(tache['parametres']), tache['erreur'],
+             json.dumps(resultat) if resultat is not None else None,
+             tache['cree_le'], tache['debut'], tache['fin'], tache['parametres'].get('cle')))
+
+    def tache_recente(self, cle, terminee_depuis, active_depuis):
+        """
+        Renvoie la tâche la plus récente pour cette clé qui peut encore servir,
+        ou None
+
+        Args:
+            cle (str): Clé de cache de la tâche
+            terminee_depuis (float): Une tâche terminée n'est retenue que si elle
+                a fini après cette date
+            active_depuis (float): Une tâche en attente ou en cours n'est retenue
+                que si elle a été créée après cette date (une tâche plus ancienne
+                a sans doute été interrompue par l'arrêt de son processus)
+        """
+        ligne = self._connexion().execute(
+            f'SELECT {COLONNES_TACHE} FROM taches WHERE cle = ? AND ('
+            f'(statut = ? AND fin >= ?) OR '
+            f'(statut IN ({", ".join("?" * len(ETATS_ACTIFS))}) AND cree_le >= ?)) '
+            'ORDER BY cree_le DESC LIMIT 1',
+            (cle, 'terminee', terminee_depuis, *ETATS_ACTIFS, active_depuis)).fetchone()
+        return self._tache(ligne)
+
+    def enregistrer_fichiers(self, tache_id, manifeste, octets=None):
+        """
+        Enregistre les fichiers décrits par le manifeste d'une tâche
+
+        Args:
+            octets (int): Place occupée par la tâche sur le disque (par défaut :
+                somme des tailles du manifeste)
+        """
+        connexion = self._connexion()
+        connexion.execute('BEGIN IMMEDIATE')
+        try:
+            connexion.execute('DELETE FROM fichiers WHERE tache_id = ?', (tache_id,))
+            self._inserer_fichiers(connexion, tache_id, manifeste, octets)
+            connexion.execute('COMMIT')
+        except BaseException:
+            connexion.execute('ROLLBACK')
+            raise
+
+    def _inserer_fichiers(self, connexion, tache_id, manifeste, octets=None):
+        connexion.executemany(
+            'INSERT OR REPLACE INTO fichiers (tache_id, chemin, taille, sha256, type_mime, url) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(tache_id, fichier['chemin'], fichier['taille'], fichier['sha256'],
+              fichier['type_mime'], fichier['url']) for fichier in manifeste['fichiers']])
+        if octets is None:
+            octets = sum(fichier['taille'] or 0 for fichier in manifeste['fichiers'])
+        connexion.execute('UPDATE taches SET octets = ? WHERE id = ?', (octets, tache_id))
+
+    def toucher(self, dossier, resolution=60):
+        """
+        Note l'accès à une tâche (téléchargement ou prévisualisation)
+
+        La date n'est réécrite que si elle a plus de resolution secondes, pour
+        qu'une page prévisualisée avec ses ressources ne coûte qu'une écriture.
+        """
+        maintenant = time.time()
+        self._connexion().execute(
+            'UPDATE taches SET dernier_acces = ? WHERE dossier = ? AND COALESCE(dernier_acces, 0) < ?',
+            (maintenant, dossier, maintenant - resolution))
+
+    def octets_total(self):
+        """Place occupée par l'ensemble des tâches indexées"""
+        return self._connexion().execute('SELECT COALESCE(SUM(octets), 0) FROM taches').fetchone()[0]
+
+    def obtenir(self, tache_id):
+        """Renvoie la tâche (même forme que dans la file, sans la liste des fichiers), ou None"""
+        ligne = self._connexion().execute(
+            f'SELECT {COLONNES_TACHE} FROM taches WHERE id = ?', (tache_id,)).fetchone()
+        return self._tache(ligne)
+
+    def par_dossier(self, dossier):
+        """Renvoie la tâche qui a produit ce dossier, ou None"""
+        ligne = self._connexion().execute(
+            f'SELECT {COLONNES_TACHE} FROM taches WHERE dossier = ?', (dossier,)).fetchone()
+        return self._tache(ligne)
+
+    def fichier(self, dossier, chemin):
+        """Renvoie la description d'un fichier d'une tâche, ou None"""
+        ligne = self._connexion().execute(
+            'SELECT f.chemin, f.taille, f.sha256, f.type_mime, f.url FROM fichiers f '
+            'JOIN taches t ON t.id = f.tache_id WHERE t.dossier = ? AND f.chemin = ?',
+            (dossier, chemin)).fetchone()
+        return dict(ligne) if ligne else None
+
+    def fichiers(self, tache_id):
+        """Liste les fichiers d'une tâche"""
+        return [dict(ligne) for ligne in self._connexion().execute(
+            'SELECT chemin, taille, sha256, type_mime, url FROM fichiers WHERE tache_id = ? ORDER BY chemin',
+            (tache_id,))]
+
+    def historique(self, statut=None, recherche=None, limite=50, decalage=0):
+        """
+        Liste les tâches, des plus récentes aux plus anciennes
+
+        Args:
+            statut (str): Ne garder que les tâches dans cet état (optionnel)
+            recherche (str): Ne garder que les tâches dont l'URL contient ce texte (optionnel)
+        """
+        conditions, parametres = [], []
+        if statut:
+            conditions.append('statut = ?')
+            parametres.append(statut)
+        if recherche:
+            conditions.append("url LIKE ? ESCAPE '\\'")
+            parametres.append('%' + recherche.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        lignes = self._connexion().execute(
+            f'SELECT {COLONNES_TACHE} FROM taches {where} ORDER BY cree_le DESC LIMIT ? OFFSET ?',
+            parametres + [limite, decalage])
+        return [self._tache(ligne) for ligne in lignes]
+
+    def taches_avec_fichier(self, sha256=None, url=None, limite=50):
+        """
+        Liste les fichiers de toutes les tâches ayant ce contenu (SHA-256) ou cette URL d'origine
+        """
+        if sha256:
+            condition, valeur = 'f.sha256 = ?', sha256
+        else:
+            condition, valeur = 'f.url = ?', url
+        lignes = self._connexion().execute(
+            'SELECT t.id AS job_id, t.dossier, t.cree_le, f.chemin, f.taille, f.sha256, f.type_mime, f.url '
+            f'FROM fichiers f JOIN taches t ON t.id = f.tache_id WHERE {condition} '
+            'ORDER BY t.cree_le DESC LIMIT ?', (valeur, limite))
+        return [dict(ligne) for ligne in lignes]
+
+    def expirer(self, age_max, exclure=()):
+        """
+        Retire de l'index les tâches inutilisées depuis plus de age_max secondes
+
+        Les tâches en attente ou en cours, et celles dont le dossier figure
+        dans exclure (en cours de service), sont conservées.
+
+        Returns:
+            list: Entrées des tâches retirées (voir retirer), dont les fichiers
+            restent à supprimer du disque
+        """
+        limite = time.time() - age_max
+        connexion = self._connexion()
+        connexion.execute('BEGIN IMMEDIATE')
+        try:
+            lignes = connexion.execute(
+                f'SELECT id, dossier, octets FROM taches WHERE {UTILISATION} < ? '
+                f'AND statut NOT IN ({", ".join("?" * len(ETATS_ACTIFS))})',
+                (limite, *ETATS_ACTIFS)).fetchall()
+            expirees = [self._retirer(connexion, ligne) for ligne in lignes if ligne['dossier'] not in exclure]
+            connexion.execute('COMMIT')
+        except BaseException:
+            connexion.execute('ROLLBACK')
+            raise
+        return expirees
+
+    def candidats_eviction(self, avant, exclure=(), limite=100):
+        """
+        Tâches terminées inutilisées depuis la date avant, de la moins
+        récemment utilisée à la plus récente, hors dossiers de exclure
+
+        Returns:
+            list: Dictionnaires {'id', 'dossier', 'octets'}
+        """
+        exclure = list(exclure)
+        lignes = self._connexion().execute(
+            f'SELECT id, dossier, octets FROM taches WHERE {UTILISATION} < ? '
+            f'AND statut NOT IN ({", ".join("?" * len(ETATS_ACTIFS))}) '
+            f'AND COALESCE(dossier, \'\') NOT IN ({", ".join("?" * len(exclure))}) '
+            f'ORDER BY {UTILISATION} LIMIT ?', (avant, *ETATS_ACTIFS, *exclure, limite))
+        return [dict(ligne) for ligne in lignes]
+
+    def retirer(self, tache_id):
+        """
+        Retire une tâche terminée de l'index
+
+        Returns:
+            dict: {'dossier', 'octets', 'empreintes', 'empreintes_completes'},
+            ou None si la tâche n'existe plus ou est redevenue active ;
+            'empreintes_completes' est faux si des fichiers n'ont pas d'empreinte
+            connue (tâche importée sans manifeste)
+        """
+        connexion = self._connexion()
+        connexion.execute('BEGIN IMMEDIATE')
+        try:
+            ligne = connexion.execute(
+                f'SELECT id, dossier, octets FROM taches WHERE id = ? '
+                f'AND statut NOT IN ({", ".join("?" * len(ETATS_ACTIFS))})',
+                (tache_id, *ETATS_ACTIFS)).fetchone()
+            entree = self._retirer(connexion, ligne) if ligne else None
+            connexion.execute('COMMIT')
+        except BaseException:
+            connexion.execute('ROLLBACK')
+            raise
+        return entree
+
+    def _retirer(self, connexion, ligne):
+        empreintes = [empreinte for (empreinte,) in connexion.execute(
+            'SELECT sha256 FROM fichiers WHERE tache_id = ?', (ligne['id'],))]
+        connexion.execute('DELETE FROM taches WHERE id = ?', (ligne['id'],))
+        return {'dossier': ligne['dossier'], 'octets': ligne['octets'],
+                'empreintes': [empreinte for empreinte in empreintes if empreinte],
+                'empreintes_completes': all(empreintes)}
+
+    def _tache(self, ligne):
+        if ligne is None:
+            return None
+        return {
+            'id': ligne['id'],
+            'statut': ligne['statut'],
+            'parametres': json.loads(ligne['parametres']) if ligne['parametres'] else {'url': ligne['url']},
+            'dossier': ligne['dossier'],
+            'progression': {},
+            'resultat': json.loads(ligne['resultat']) if ligne['resultat'] else None,
+            'erreur': ligne['erreur'],
+            'cree_le': ligne['cree_le'],
+            'debut': ligne['debut'],
+            'fin': ligne['fin'],
+        }
+
+
+def lister_dossier(dossier):
+    """
+    Manifeste minimal (sans empreintes) d'un dossier antérieur aux manifestes,
+    établi une seule fois lors de son import dans l'index
+    """
+    fichiers = []
+    for racine, _, noms in os.walk(dossier):
+        for nom in noms:
+            chemin = os.path.join(racine, nom)
+            fichiers.append({
+                'chemin': os.path.relpath(chemin, dossier).replace(os.sep, '/'),
+                'taille': os.path.getsize(chemin),
+                'sha256': None,
+                'type_mime': type_mime(chemin),
+                'url': None,
+            })
+    return {'url': None, 'fichiers': fichiers}
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Manifeste des tâches : liste des fichiers produits, établie une fois à la
+fin du scraping
+
+Chaque dossier de tâche contient un manifeste.json décrivant ses fichiers
+(chemin, taille, SHA-256, type MIME et URL d'origine) : l'affichage des
+résultats et l'index des tâches le lisent au lieu de parcourir et
+d'interroger le système de fichiers.
+"""
+
+import hashlib
+import json
+import mimetypes
+import os
+import time
+
+from stockage_blobs import fichier_temporaire
+
+NOM_MANIFESTE = 'manifeste.json'
+
+# Taille des blocs lus pour calculer une empreinte
+TAILLE_BLOC = 64 * 1024
+
+
+def type_mime(chemin, en_tete=None):
+    """
+    Type MIME d'un fichier : celui annoncé par le serveur, sinon déduit de l'extension
+    """
+    if en_tete:
+        return en_tete.split(';')[0].strip().lower()
+    return mimetypes.guess_type(chemin)[0] or 'application/octet-stream'
+
+
+def decrire_fichier(chemin, url=None):
+    """
+    Décrit un fichier en le relisant (utilisé pour les pages HTML, écrites sans empreinte)
+    """
+    empreinte = hashlib.sha256()
+    taille = 0
+    with open(chemin, 'rb') as f:
+        for bloc in iter(lambda: f.read(TAILLE_BLOC), b''):
+            empreinte.update(bloc)
+            taille += len(bloc)
+    return {'taille': taille, 'sha256': empreinte.hexdigest(), 'type_mime': type_mime(chemin), 'url': url}
+
+
+def construire_manifeste(resultats, dossier_sortie):
+    """
+    Construit le manifeste d'une tâche à partir de son dictionnaire de résultats
+
+    Les ressources reprennent la taille, l'empreinte et le type MIME relevés
+    pendant leur téléchargement ; seules les pages HTML sont relues.
+    """
+    def relatif(chemin):
+        return os.path.relpath(chemin, dossier_sortie).replace(os.sep, '/')
+
+    fichiers = {}
+    if 'pages' in resultats:
+        pages = [(page['fichier_original'], page['url']) for page in resultats['pages']]
+        pages += [(page['fichier_local'], None) for page in resultats['pages']
+                  if page['fichier_local'] != page['fichier_original']]
+    else:
+        pages = [(os.path.join(dossier_sortie, 'index.html'), resultats.get('base_url')),
+                 (os.path.join(dossier_sortie, 'index_local.html'), None)]
+    for chemin, url in pages:
+        if os.path.exists(chemin):
+            fichiers[relatif(chemin)] = decrire_fichier(chemin, url)
+
+    for cle in ('fichiers_css', 'fichiers_js', 'images', 'polices'):
+        for ressource in resultats.get(cle, []):
+            chemin = ressource['fichier_local']
+            fichiers[relatif(chemin)] = {
+                'taille': ressource.get('taille'),
+                'sha256': ressource.get('sha256'),
+                'type_mime': ressource.get('type_mime') or type_mime(chemin),
+                'url': ressource['url_original'],
+            }
+
+    return {
+        'url': resultats.get('base_url'),
+        'cree_le': time.time(),
+        'taille_totale': sum(infos['taille'] or 0 for infos in fichiers.values()),
+        'fichiers': [dict(chemin=chemin, **infos) for chemin, infos in fichiers.items()],
+        # Capture partielle : ressources et pages non téléchargées faute de temps
+        'ignorees': resultats.get('ignorees', []),
+    }
+
+
+def ecrire_json(chemin, donnees):
+    """Écrit un fichier JSON via un fichier temporaire renommé atomiquement"""
+    descripteur, chemin_temp = fichier_temporaire(os.path.dirname(chemin))
+    try:
+        with os.fdopen(descripteur, 'w', encoding='utf-8') as f:
+            json.dump(donnees, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(chemin_temp, chemin)
+    except BaseException:
+        if os.path.exists(chemin_temp):
+            os.remove(chemin_temp)
+        raise
+
+
+def ecrire_manifeste(resultats, dossier_sortie):
+    """
+    Écrit le manifeste.json d'une tâche dans son dossier
+
+    Returns:
+        dict: Le manifeste écrit
+    """
+    manifeste = construire_manifeste(resultats, dossier_sortie)
+    ecrire_json(os.path.join(dossier_sortie, NOM_MANIFESTE), manifeste)
+    return manifeste
+
+
+def lire_manifeste(dossier):
+    """Renvoie le manifeste d'un dossier de tâche, ou None s'il n'en a pas"""
+    try:
+        with open(os.path.join(dossier, NOM_MANIFESTE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
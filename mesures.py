@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Mesures des tâches de scraping et export au format Prometheus
+
+Chaque tâche relève la durée de ses phases (page principale, analyse,
+ressources, réécriture des liens, écriture des fichiers, archive), les
+octets transférés, le nombre de ressources par type et d'erreurs par
+genre, et la répartition des durées de téléchargement des ressources.
+Ces mesures sont ajoutées au dictionnaire de résultats sous 'mesures'.
+
+Le relevé se limite à quelques appels à time.perf_counter et à des
+compteurs : il peut rester actif en production. Les histogrammes sont à
+intervalles fixes, si bien que les mesures de plusieurs tâches (et de
+plusieurs processus) s'additionnent sans conserver chaque valeur.
+"""
+
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Bornes supérieures (secondes) des intervalles des histogrammes de durées
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogramme:
+    """
+    Histogramme à intervalles fixes : un compteur par intervalle, la somme et le nombre de valeurs
+    """
+
+    def __init__(self, bornes=BORNES_DUREE):
+        self.bornes = bornes
+        self.compteurs = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+        self.nombre = 0
+
+    def observer(self, valeur):
+        self.compteurs[bisect.bisect_left(self.bornes, valeur)] += 1
+        self.somme += valeur
+        self.nombre += 1
+
+    def fusionner(self, donnees):
+        """Ajoute un histogramme exporté par en_dict (mêmes bornes)"""
+        for i, compteur in enumerate(donnees['compteurs']):
+            self.compteurs[i] += compteur
+        self.somme += donnees['somme']
+        self.nombre += donnees['nombre']
+
+    def en_dict(self):
+        return {'compteurs': list(self.compteurs), 'somme': round(self.somme, 6), 'nombre': self.nombre}
+
+
+class MesuresTache:
+    """
+    Mesures d'une tâche, alimentées par les threads de téléchargement
+
+    Utilisation :
+        mesures = MesuresTache()
+        with mesures.phase('page'):
+            ...
+        resultats['mesures'] = mesures.en_dict()
+    """
+
+    def __init__(self):
+        self.debut = time.perf_counter()
+        self.phases = Counter()
+        self.octets = 0
+        self.ressources = Counter()
+        self.erreurs = Counter()
+        self.telechargements = Histogramme()
+        self._verrou = threading.Lock()
+
+    @contextmanager
+    def phase(self, nom):
+        """Ajoute la durée du bloc with à la phase (les phases répétées s'additionnent)"""
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ajouter_phase(nom, time.perf_counter() - debut)
+
+    def ajouter_phase(self, nom, duree):
+        with self._verrou:
+            self.phases[nom] += duree
+
+    def transfert(self, octets):
+        """Octets reçus hors ressources (pages HTML)"""
+        with self._verrou:
+            self.octets += octets
+
+    def telechargement(self, type_fichier, duree, details):
+        """
+        Enregistre le téléchargement d'une ressource
+
+        details est le dictionnaire rempli par telecharger_fichier : 'taille'
+        en cas de succès, 'erreur' (genre de l'échec) sinon.
+        """
+        with self._verrou:
+            self.telechargements.observer(duree)
+            if 'erreur' in details:
+                self.erreurs[details['erreur']] += 1
+            else:
+                self.ressources[type_fichier] += 1
+                self.octets += details.get('taille') or 0
+
+    def erreur(self, genre):
+        with self._verrou:
+            self.erreurs[genre] += 1
+
+    def en_dict(self):
+        """Mesures sérialisables (JSON, pickle), à ranger dans resultats['mesures']"""
+        with self._verrou:
+            return {
+                'duree_s': round(time.perf_counter() - self.debut, 6),
+                'phases': {nom: round(duree, 6) for nom, duree in self.phases.items()},
+                'octets': self.octets,
+                'ressources': dict(self.ressources),
+                'erreurs': dict(self.erreurs),
+                'telechargements': self.telechargements.en_dict(),
+            }
+
+
+def echapper(valeur):
+    """Échappe une valeur d'étiquette Prometheus"""
+    return str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RegistreMetriques:
+    """
+    Agrège les mesures des tâches d'un processus et les expose au format texte de Prometheus
+    """
+
+    def __init__(self, prefixe='scraper'):
+        self.prefixe = prefixe
+        self._verrou = threading.Lock()
+        self._taches = Counter()
+        self._octets = 0
+        self._ressources = Counter()
+        self._erreurs = Counter()
+        self._durees_taches = Histogramme()
+        self._phases = {}
+        self._telechargements = Histogramme()
+        self._archives = Histogramme()
+
+    def compter_tache(self, statut):
+        """Compte une tâche arrivée à son état final"""
+        with self._verrou:
+            self._taches[statut] += 1
+
+    def observer_tache(self, mesures):
+        """Ajoute les mesures d'une tâche (le dictionnaire de MesuresTache.en_dict)"""
+        with self._verrou:
+            self._durees_taches.observer(mesures['duree_s'])
+            for nom, duree in mesures['phases'].items():
+                self._phases.setdefault(nom, Histogramme()).observer(duree)
+            self._octets += mesures['octets']
+            self._ressources.update(mesures['ressources'])
+            self._erreurs.update(mesures['erreurs'])
+            self._telechargements.fusionner(mesures['telechargements'])
+
+    def observer_archive(self, duree):
+        """Durée d'une archive produite à la volée, pendant son envoi"""
+        with self._verrou:
+            self._archives.observer(duree)
+
+    def exposer(self):
+        """Texte à servir sur /metrics (format d'exposition Prometheus 0.0.4)"""
+        lignes = []
+        p = self.prefixe
+
+        def compteur(nom, aide, valeurs, etiquette=None):
+            lignes.append(f'# HELP {p}_{nom} {aide}')
+            lignes.append(f'# TYPE {p}_{nom} counter')
+            if etiquette is None:
+                lignes.append(f'{p}_{nom} {valeurs}')
+                return
+            for cle, valeur in sorted(valeurs.items()):
+                lignes.append(f'{p}_{nom}{{{etiquette}="{echapper(cle)}"}} {valeur}')
+
+        def histogrammes(nom, aide, series, etiquette=None):
+            lignes.append(f'# HELP {p}_{nom} {aide}')
+            lignes.append(f'# TYPE {p}_{nom} histogram')
+            for cle, histogramme in series:
+                base = f'{etiquette}="{echapper(cle)}",' if etiquette else ''
+                cumul = 0
+                for borne, nombre in zip(histogramme.bornes + ('+Inf',), histogramme.compteurs):
+                    cumul += nombre
+                    lignes.append(f'{p}_{nom}_bucket{{{base}le="{borne}"}} {cumul}')
+                suffixe = f'{{{base[:-1]}}}' if base else ''
+                lignes.append(f'{p}_{nom}_sum{suffixe} {histogramme.somme}')
+                lignes.append(f'{p}_{nom}_count{suffixe} {histogramme.nombre}')
+
+        with self._verrou:
+            compteur('taches_total', 'Tâches terminées, par statut final', self._taches, 'statut')
+            compteur('octets_total', 'Octets reçus (pages et ressources)', self._octets)
+            compteur('ressources_total', 'Ressources téléchargées, par type', self._ressources, 'type')
+            compteur('erreurs_total', 'Erreurs, par genre', self._erreurs, 'genre')
+            histogrammes('tache_duree_secondes', 'Durée des tâches', [(None, self._durees_taches)])
+            histogrammes('phase_duree_secondes', 'Durée des phases des tâches',
+                         sorted(self._phases.items()), 'phase')
+            histogrammes('telechargement_duree_secondes', 'Durée du téléchargement de chaque ressource',
+                         [(None, self._telechargements)])
+            histogrammes('archive_duree_secondes', 'Durée des archives produites à la volée',
+                         [(None, self._archives)])
+        return '\n'.join(lignes) + '\n'
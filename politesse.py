@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Ordonnancement poli des requêtes, partagé par toutes les tâches d'un processus
+
+Pour chaque hôte, l'ordonnanceur limite le nombre de requêtes simultanées
+et le nombre de requêtes par seconde (seau à jetons). Il respecte aussi le
+Crawl-delay du robots.txt de l'hôte et l'en-tête Retry-After des réponses
+429 et 503 : l'hôte est mis en pause jusqu'à la date indiquée.
+
+Les workers ne restent pas bloqués sur un hôte en attente : la
+RepartitionHotes d'un appel leur confie en priorité une ressource d'un
+hôte prêt, si bien que les autres hôtes continuent d'avancer.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+# Valeurs par défaut
+MAX_PAR_HOTE = 4
+REQUETES_PAR_SECONDE = 0  # 0 : pas de limite de débit
+RAFALE = 5  # Requêtes autorisées d'affilée après une période calme
+
+# Durée de validité d'un robots.txt lu, et délai maximal de sa lecture
+DUREE_ROBOTS = 3600
+TIMEOUT_ROBOTS = 10
+
+# Un hôte sans requête depuis cette durée est oublié (son robots.txt a expiré,
+# son seau s'est rempli) : l'état d'un ordonnanceur partagé ne grandit pas sans fin
+DUREE_INACTIVITE = DUREE_ROBOTS
+
+# Pause maximale imposée par un Retry-After (un serveur peut annoncer des heures)
+PAUSE_MAX = 300
+
+# Statuts qui mettent l'hôte en pause quand la réponse contient Retry-After
+STATUTS_PAUSE = (429, 503)
+
+# Nombre de tentatives pour une requête mise en attente par un Retry-After
+ESSAIS = 2
+
+
+def hote_de(url):
+    """Hôte (schéma compris) d'une URL, clé de l'ordonnancement"""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def duree_retry_after(valeur, maintenant=None):
+    """
+    Secondes à attendre d'après un en-tête Retry-After (nombre de secondes ou
+    date HTTP), ou None s'il est absent ou illisible
+    """
+    if not valeur:
+        return None
+    valeur = valeur.strip()
+    if valeur.isdigit():
+        return float(valeur)
+    try:
+        date = parsedate_to_datetime(valeur)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - (maintenant or time.time()))
+
+
+def a_reessayer(statut, en_tetes):
+    """Une réponse 429 ou 503 avec Retry-After est redemandée après la pause de l'hôte"""
+    return statut in STATUTS_PAUSE and bool(en_tetes.get('Retry-After'))
+
+
+class SeauJetons:
+    """
+    Seau à jetons : debit jetons par seconde, au plus capacite en réserve
+    """
+
+    def __init__(self, debit, capacite):
+        self.debit = debit
+        self.capacite = capacite
+        self.jetons = capacite
+        self.date = time.monotonic()
+
+    def prendre(self, maintenant):
+        """
+        Prend un jeton s'il y en a un
+
+        Returns:
+            float: 0 si le jeton est pris, sinon le délai avant le prochain jeton
+        """
+        self.jetons = min(self.capacite, self.jetons + (maintenant - self.date) * self.debit)
+        self.date = maintenant
+        if self.jetons >= 1:
+            self.jetons -= 1
+            return 0.0
+        return (1 - self.jetons) / self.debit
+
+
+class EtatHote:
+    """Limites et pause en cours d'un hôte"""
+
+    def __init__(self, debit, rafale):
+        self.actives = 0
+        self.seau = SeauJetons(debit, rafale) if debit else None
+        self.pause_jusqua = 0.0
+        self.robots_lu_le = None
+        self.verrou_robots = threading.Lock()
+        self.utilise_le = time.monotonic()
+
+    def oubliable(self, maintenant):
+        """Aucune requête en cours, ni pause, ni lecture du robots.txt"""
+        return (not self.actives and self.pause_jusqua <= maintenant
+                and not self.verrou_robots.locked())
+
+
+class Ordonnanceur:
+    """
+    Limites par hôte partagées par toutes les tâches qui utilisent cet ordonnanceur
+
+    Args:
+        max_par_hote (int): Requêtes simultanées vers un même hôte
+        requetes_par_seconde (float): Débit maximal par hôte (0 : illimité)
+        rafale (int): Requêtes autorisées d'affilée avant d'appliquer le débit
+        robots (bool): Lire le robots.txt de chaque hôte pour son Crawl-delay
+        user_agent (str): Agent recherché dans le robots.txt
+    """
+
+    def __init__(self, max_par_hote=MAX_PAR_HOTE, requetes_par_seconde=REQUETES_PAR_SECONDE,
+                 rafale=RAFALE, robots=False, user_agent='*'):
+        self.max_par_hote = max(1, max_par_hote)
+        self.requetes_par_seconde = requetes_par_seconde
+        self.rafale = max(1, rafale)
+        self.robots = robots
+        self.user_agent = user_agent
+        # Hôtes du moins au plus récemment utilisé
+        self._hotes = OrderedDict()
+        # Verrou réentrant : les répartitions réservent des créneaux en le tenant déjà
+        self._condition = threading.Condition(threading.RLock())
+
+    def _etat(self, hote):
+        # Appelée avec self._condition tenu
+        maintenant = time.monotonic()
+        self._oublier_inactifs(maintenant)
+        etat = self._hotes.get(hote)
+        if etat is None:
+            etat = self._hotes[hote] = EtatHote(self.requetes_par_seconde, self.rafale)
+        else:
+            self._hotes.move_to_end(hote)
+        etat.utilise_le = maintenant
+        return etat
+
+    def _oublier_inactifs(self, maintenant):
+        """Supprime les hôtes inutilisés depuis DUREE_INACTIVITE (les plus anciens sont en tête)"""
+        # Un seul passage : un hôte occupé remis en queue n'est pas réexaminé
+        for _ in range(len(self._hotes)):
+            hote, etat = next(iter(self._hotes.items()))
+            if maintenant - etat.utilise_le < DUREE_INACTIVITE:
+                return
+            if etat.oubliable(maintenant):
+                del self._hotes[hote]
+            else:
+                # Encore occupé (long téléchargement, pause) : considéré comme utilisé
+                etat.utilise_le = maintenant
+                self._hotes.move_to_end(hote)
+
+    def reserver(self, hote):
+        """
+        Réserve un créneau pour une requête vers l'hôte, sans attendre
+
+        Returns:
+            float: 0 si le créneau est réservé (à libérer avec liberer), sinon
+            le délai conseillé avant de réessayer (None : attendre une libération)
+        """
+        with self._condition:
+            etat = self._etat(hote)
+            maintenant = time.monotonic()
+            if etat.pause_jusqua > maintenant:
+                return etat.pause_jusqua - maintenant
+            if etat.actives >= self.max_par_hote:
+                return None
+            if etat.seau is not None:
+                delai = etat.seau.prendre(maintenant)
+                if delai:
+                    return delai
+            etat.actives += 1
+            return 0.0
+
+    def liberer(self, hote):
+        """Libère un créneau réservé et réveille les workers en attente"""
+        with self._condition:
+            self._hotes[hote].actives -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def creneau(self, url):
+        """Bloc with exécuté dans un créneau de l'hôte de l'URL (attend si nécessaire)"""
+        hote = hote_de(url)
+        with self._condition:
+            # Le verrou est tenu entre la réservation et l'attente : aucune libération n'est manquée
+            while (delai := self.reserver(hote)) != 0:
+                self._condition.wait(delai)
+        try:
+            yield
+        finally:
+            self.liberer(hote)
+
+    def observer(self, reponse):
+        """
+        Met l'hôte en pause si la réponse est un 429 ou un 503 avec Retry-After
+
+        Returns:
+            float: Durée de la pause (None si la réponse n'en impose pas)
+        """
+        if reponse.status_code not in STATUTS_PAUSE:
+            return None
+        pause = duree_retry_after(reponse.headers.get('Retry-After'))
+        if pause is None:
+            return None
+        pause = min(pause, PAUSE_MAX)
+        with self._condition:
+            etat = self._etat(hote_de(reponse.url))
+            etat.pause_jusqua = max(etat.pause_jusqua, time.monotonic() + pause)
+        print(f"  ⏸️ {hote_de(reponse.url)} en pause pendant {pause:.0f} s (Retry-After)")
+        return pause
+
+    def crochet_reponse(self, reponse, *args, **kwargs):
+        """Crochet 'response' d'une requests.Session : applique observer à chaque réponse"""
+        self.observer(reponse)
+        return reponse
+
+    def preparer(self, session, url, echeance=None):
+        """
+        Lit le robots.txt de l'hôte de l'URL s'il n'est pas connu ou trop ancien,
+        et applique son Crawl-delay au débit de l'hôte
+
+        Appelée avant la première requête vers chaque hôte, par le thread qui
+        la fait : les robots.txt des différents hôtes sont lus en parallèle.
+        Avec une échéance (date time.monotonic), la lecture ne dure pas
+        au-delà ; une lecture interrompue par l'échéance n'est pas retenue.
+        """
+        if not self.robots:
+            return
+        hote = hote_de(url)
+        with self._condition:
+            etat = self._etat(hote)
+        # Un seul thread lit le robots.txt d'un hôte ; les autres attendent sa lecture
+        with etat.verrou_robots:
+            if etat.robots_lu_le is not None and time.monotonic() - etat.robots_lu_le < DUREE_ROBOTS:
+                return
+            timeout = TIMEOUT_ROBOTS
+            if echeance is not None:
+                timeout = min(timeout, echeance - time.monotonic())
+                if timeout <= 0:
+                    return
+            delai = self.lire_crawl_delay(session, hote, timeout)
+            if echeance is not None and time.monotonic() >= echeance:
+                return
+            with self._condition:
+                etat.robots_lu_le = time.monotonic()
+                if delai:
+                    debit = 1 / delai
+                    if etat.seau is None or etat.seau.debit > debit:
+                        etat.seau = SeauJetons(debit, 1)
+
+    def lire_crawl_delay(self, session, hote, timeout=TIMEOUT_ROBOTS):
+        """Crawl-delay du robots.txt de l'hôte (None s'il n'y en a pas ou s'il est illisible)"""
+        try:
+            reponse = session.get(f"{hote}/robots.txt", timeout=timeout)
+            if reponse.status_code != 200:
+                return None
+            robots = RobotFileParser()
+            robots.parse(reponse.text.splitlines())
+            delai = robots.crawl_delay(self.user_agent)
+            return float(delai) if delai else None
+        except Exception as e:
+            print(f"  ⚠️ robots.txt illisible pour {hote}: {e}")
+            return None
+
+
+class RepartitionHotes:
+    """
+    Distribue les ressources d'un appel aux workers en choisissant un hôte prêt
+
+    Les éléments sont servis dans l'ordre de la liste (ordre de priorité) :
+    parmi les hôtes prêts, celui dont le prochain élément vient le plus tôt
+    dans la liste passe en premier. Un worker appelle prendre() jusqu'à
+    obtenir None, et terminer(element) après chaque requête.
+
+    Avec une échéance (date time.monotonic), prendre() renvoie None dès
+    qu'elle est atteinte : les éléments restants ne sont pas distribués.
+    """
+
+    def __init__(self, ordonnanceur, elements, url_de=lambda element: element[0], echeance=None):
+        self.ordonnanceur = ordonnanceur
+        self.url_de = url_de
+        self.echeance = echeance
+        self._files = {}
+        self._rangs = {}
+        for rang, element in enumerate(elements):
+            self._files.setdefault(hote_de(url_de(element)), []).append(element)
+            self._rangs[element] = rang
+        self._en_cours = 0
+        # Les files sont protégées par le verrou de l'ordonnanceur, sur lequel les workers attendent
+        self._condition = ordonnanceur._condition
+
+    def remettre(self, element):
+        """Replace un élément en tête de la file de son hôte (nouvel essai)"""
+        with self._condition:
+            self._files.setdefault(hote_de(self.url_de(element)), []).insert(0, element)
+            self._condition.notify_all()
+
+    def prendre(self):
+        """
+        Renvoie le prochain élément dont l'hôte a un créneau libre (réservé pour
+        l'appelant), en attendant si aucun hôte n'est prêt ; None quand tout est
+        distribué et terminé (un élément en cours peut encore être remis)
+        """
+        with self._condition:
+            while True:
+                restant = None
+                if self.echeance is not None:
+                    restant = self.echeance - time.monotonic()
+                    if restant <= 0:
+                        return None
+                if not self._files:
+                    if not self._en_cours:
+                        return None
+                    self._condition.wait(restant)
+                    continue
+                delai_min = restant
+                for hote in sorted(self._files, key=lambda hote: self._rangs[self._files[hote][0]]):
+                    delai = self.ordonnanceur.reserver(hote)
+                    if delai == 0:
+                        file = self._files[hote]
+                        element = file.pop(0)
+                        if not file:
+                            del self._files[hote]
+                        self._en_cours += 1
+                        return element
+                    if delai is not None:
+                        delai_min = delai if delai_min is None else min(delai_min, delai)
+                self._condition.wait(delai_min)
+
+    def terminer(self, element):
+        """Libère le créneau réservé pour l'élément (après un éventuel remettre)"""
+        with self._condition:
+            self._en_cours -= 1
+            self.ordonnanceur.liberer(hote_de(self.url_de(element)))
+
+
+# Ordonnanceurs partagés d'un processus, par configuration
+_partages = {}
+_verrou_partages = threading.Lock()
+
+
+def ordonnanceur_partage(**configuration):
+    """
+    Ordonnanceur commun à toutes les tâches du processus ayant cette configuration
+
+    Utile en mode processus, où l'ordonnanceur ne peut pas être transmis au
+    processus de la tâche : chaque processus crée le sien au premier appel.
+    """
+    cle = tuple(sorted(configuration.items()))
+    with _verrou_partages:
+        if cle not in _partages:
+            _partages[cle] = Ordonnanceur(**configuration)
+        return _partages[cle]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Exécution des tâches de scraping complètes dans un pool de processus
+
+Le parsing HTML et la compression DEFLATE sont limités par le GIL : en
+mode processus, chaque tâche (scraping + archive) s'exécute dans un
+processus séparé et seul un manifeste léger revient au processus parent.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app import extraire_site_web
+from archives import creer_archive
+from crawler import crawler_site
+from profilage import Profilage
+from politesse import ordonnanceur_partage
+
+# Nombre de tâches exécutées par un processus avant son remplacement
+TACHES_PAR_PROCESSUS = 50
+
+
+def manifeste_resultats(resultats):
+    """
+    Réduit le dictionnaire de résultats à un manifeste léger à transmettre entre processus
+
+    Le HTML complet n'est pas renvoyé : seule sa taille est conservée (en
+    octets si la page a été traitée en mémoire réduite, en caractères sinon).
+    """
+    manifeste = {cle: valeur for cle, valeur in resultats.items()
+                 if cle not in ('html_original', 'pages_locales')}
+    manifeste['html_size'] = resultats.get('html_taille') or len(resultats['html_original'])
+    return manifeste
+
+
+def executer_job(url, dossier_sortie, zip_path=None, progression=None, **options):
+    """
+    Exécute une tâche complète : scraping puis archive
+
+    Utilisable directement (mode threads) ou dans un processus du pool.
+
+    Args:
+        url (str): L'URL du site à télécharger
+        dossier_sortie (str): Le dossier où sauvegarder les fichiers
+        zip_path (str): Chemin de l'archive à créer (optionnel), au format déduit
+            de son extension (.zip ou .tar.zst)
+        progression (dict): Suivi de progression, éventuellement partagé entre processus
+        **options: Paramètres supplémentaires transmis à extraire_site_web, ou à
+            crawler_site si 'profondeur_max' est fourni (exploration des liens internes) ;
+            'niveau_compression' règle la compression de l'archive, et
+            'dossier_profils' active le profilage de toute la tâche, archive comprise ;
+            'politesse' (paramètres d'un Ordonnanceur) soumet la tâche à l'ordonnanceur
+            partagé par toutes les tâches du processus
+
+    Returns:
+        dict: Manifeste des résultats (voir manifeste_resultats), avec les
+        statistiques de l'archive dans 'archive' si elle a été créée et le
+        résumé du profil dans 'profil' si la tâche a été profilée
+    """
+    dossier_profils = options.pop('dossier_profils', None)
+    if dossier_profils:
+        with Profilage(dossier_profils, os.path.basename(os.path.normpath(dossier_sortie))) as profil:
+            manifeste = executer_job(url, dossier_sortie, zip_path, progression, **options)
+        manifeste['profil'] = profil.resume
+        return manifeste
+
+    if progression is None:
+        progression = {}
+    niveau_compression = options.pop('niveau_compression', None)
+    politesse = options.pop('politesse', None)
+    if politesse is not None:
+        options['ordonnanceur'] = ordonnanceur_partage(**politesse)
+    if options.get('profondeur_max'):
+        # L'exploration analyse chaque page avec BeautifulSoup (liens internes)
+        options.pop('memoire_reduite', None)
+        resultats = crawler_site(url, dossier_sortie, progression=progression, **options)
+    else:
+        options.pop('profondeur_max', None)
+        options.pop('pages_max', None)
+        resultats = extraire_site_web(url, dossier_sortie, progression=progression, **options)
+    if zip_path and not job_echoue(resultats):
+        progression['etape'] = 'archive'
+        resultats['archive'] = creer_archive(dossier_sortie, zip_path, niveau=niveau_compression)
+        resultats['mesures']['phases']['archive'] = resultats['archive']['duree_s']
+        resultats['mesures']['duree_s'] += resultats['archive']['duree_s']
+        progression['etape'] = 'termine'
+    return manifeste_resultats(resultats)
+
+
+def job_echoue(resultats):
+    """
+    Une tâche échoue si la page principale n'a pas pu être capturée
+
+    En exploration, les erreurs sur des pages secondaires ne font pas échouer la tâche.
+    """
+    if 'pages' in resultats:
+        return not resultats['pages']
+    return bool(resultats['erreurs'])
+
+
+class PoolProcessus:
+    """
+    Pool de processus pour les tâches de scraping
+
+    Args:
+        nb_processus (int): Nombre de processus (par défaut : nombre de cœurs)
+        taches_par_processus (int): Recyclage d'un processus après ce nombre de tâches,
+            pour borner la croissance de la mémoire
+    """
+
+    def __init__(self, nb_processus=None, taches_par_processus=TACHES_PAR_PROCESSUS):
+        contexte = multiprocessing.get_context('spawn')
+        self.nb_processus = nb_processus or multiprocessing.cpu_count()
+        self._executeur = ProcessPoolExecutor(max_workers=self.nb_processus, mp_context=contexte,
+                                              max_tasks_per_child=taches_par_processus)
+        # Gestionnaire démarré à la demande pour partager la progression avec les processus
+        self._contexte = contexte
+        self._gestionnaire = None
+
+    def progression_partagee(self):
+        """Crée un dictionnaire de progression lisible depuis le processus parent"""
+        if self._gestionnaire is None:
+            self._gestionnaire = self._contexte.Manager()
+        return self._gestionnaire.dict()
+
+    def soumettre(self, url, dossier_sortie, zip_path=None, progression=None, **options):
+        """
+        Soumet une tâche au pool
+
+        Returns:
+            concurrent.futures.Future: Futur dont le résultat est le manifeste de la tâche
+        """
+        return self._executeur.submit(executer_job, url, dossier_sortie, zip_path, progression, **options)
+
+    def arreter(self):
+        """Arrête le pool et le gestionnaire de progression"""
+        self._executeur.shutdown()
+        if self._gestionnaire is not None:
+            self._gestionnaire.shutdown()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Profilage à la demande d'une tâche de scraping
+
+Pendant la tâche, cProfile relève le temps passé dans chaque fonction du
+thread de la tâche, les threads qu'elle démarre (comme les téléchargements)
+sont échantillonnés, et tracemalloc suit les allocations. À la fin, deux
+fichiers sont écrits dans le dossier des profils :
+
+    <nom>.pstats  statistiques complètes, à ouvrir avec pstats ou snakeviz
+    <nom>.json    résumé : fonctions les plus coûteuses, principales
+                  allocations encore en mémoire et pic de mémoire
+
+Depuis Python 3.12, cProfile repose sur sys.monitoring : un seul profileur
+peut être actif dans le processus. Les tâches profilées passent donc l'une
+après l'autre, et les autres threads sont suivis par échantillonnage des
+piles (sys._current_frames) plutôt que par un profileur chacun.
+
+Le profilage ralentit nettement la tâche : il est réservé aux tâches
+demandées explicitement ou à un petit échantillon du trafic.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+from manifeste import ecrire_json
+
+# Nombre de fonctions et d'allocations conservées dans le résumé
+NB_FONCTIONS = 25
+NB_ALLOCATIONS = 20
+
+# Intervalle d'échantillonnage des piles des autres threads (secondes)
+INTERVALLE_ECHANTILLONS = 0.002
+
+# tracemalloc est global au processus : il reste actif tant qu'un profil est en cours
+_verrou_traces = threading.Lock()
+_profils_en_cours = 0
+
+# Un seul cProfile actif par processus : les tâches profilées passent l'une après l'autre
+_verrou_profil = threading.Lock()
+
+
+def doit_profiler(demande=False, taux=0.0):
+    """Profiler si la tâche le demande, ou au hasard avec la probabilité taux"""
+    return bool(demande) or (taux > 0 and random.random() < taux)
+
+
+def chemins_profil(dossier_profils, nom):
+    """Chemins (.pstats, .json) du profil d'une tâche"""
+    base = os.path.join(dossier_profils, nom)
+    return base + '.pstats', base + '.json'
+
+
+def lire_resume(dossier_profils, nom):
+    """Résumé du profil d'une tâche, ou None s'il n'y en a pas"""
+    try:
+        with open(chemins_profil(dossier_profils, nom)[1], encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def supprimer_profil(dossier_profils, nom):
+    """Supprime les fichiers du profil d'une tâche s'ils existent"""
+    for chemin in chemins_profil(dossier_profils, nom):
+        if os.path.exists(chemin):
+            os.remove(chemin)
+
+
+def cle_fonction(code):
+    """Clé pstats (fichier, ligne, nom) d'un objet code"""
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class Echantillons:
+    """
+    Piles des threads relevées à intervalles réguliers, converties au format pstats
+
+    Chaque relevé compte pour intervalle secondes : en temps propre pour la
+    fonction en cours d'exécution, en temps cumulé pour toutes les fonctions
+    de la pile. Les nombres d'appels sont des nombres d'échantillons.
+    """
+
+    def __init__(self, intervalle):
+        self.intervalle = intervalle
+        self.threads = set()
+        self._piles = Counter()
+
+    def relever(self, frame, ident):
+        pile = []
+        while frame is not None:
+            pile.append(cle_fonction(frame.f_code))
+            frame = frame.f_back
+        self._piles[tuple(pile)] += 1
+        self.threads.add(ident)
+
+    def create_stats(self):
+        # Appelée par pstats.Stats (même protocole que cProfile.Profile)
+        propres = Counter()
+        cumules = Counter()
+        appelants = {}
+        for pile, nombre in self._piles.items():
+            propres[pile[0]] += nombre
+            for fonction in set(pile):
+                cumules[fonction] += nombre
+            for appelee, appelante in zip(pile, pile[1:]):
+                compteur = appelants.setdefault(appelee, Counter())
+                compteur[appelante] += nombre
+        # Appelants au format de cProfile (appels, appels primitifs, temps propre, temps cumulé)
+        self.stats = {
+            fonction: (nombre, nombre, propres[fonction] * self.intervalle, nombre * self.intervalle,
+                       {appelante: (n, n, 0.0, n * self.intervalle)
+                        for appelante, n in appelants.get(fonction, {}).items()})
+            for fonction, nombre in cumules.items()
+        }
+
+
+class Profilage:
+    """
+    Profile le bloc with et écrit le profil à la sortie
+
+    Args:
+        dossier_profils (str): Dossier où écrire le profil
+        nom (str): Nom des fichiers (en général le dossier de la tâche)
+
+    Après le bloc, l'attribut resume contient le résumé écrit dans <nom>.json.
+
+    Le thread qui entre dans le bloc est profilé par cProfile ; les threads
+    démarrés pendant le bloc sont échantillonnés. Sur un serveur chargé, les
+    threads des autres tâches démarrés pendant le bloc en font aussi partie.
+    Un deuxième profilage attend la fin du premier.
+    """
+
+    def __init__(self, dossier_profils, nom, nb_fonctions=NB_FONCTIONS, nb_allocations=NB_ALLOCATIONS,
+                 intervalle=INTERVALLE_ECHANTILLONS):
+        self.chemin_stats, self.chemin_resume = chemins_profil(dossier_profils, nom)
+        self.nb_fonctions = nb_fonctions
+        self.nb_allocations = nb_allocations
+        self.resume = None
+        self._echantillons = Echantillons(intervalle)
+        self._arret = threading.Event()
+
+    def _echantillonner(self, exclus):
+        # Threads démarrés pendant le bloc, sauf celui de la tâche et l'échantillonneur
+        exclus = exclus | {threading.get_ident()}
+        while not self._arret.wait(self._echantillons.intervalle):
+            for ident, frame in sys._current_frames().items():
+                if ident not in exclus:
+                    self._echantillons.relever(frame, ident)
+
+    def __enter__(self):
+        global _profils_en_cours
+        _verrou_profil.acquire()
+        with _verrou_traces:
+            if _profils_en_cours == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            _profils_en_cours += 1
+        tracemalloc.reset_peak()
+        self._debut = time.perf_counter()
+        self._echantillonneur = threading.Thread(
+            target=self._echantillonner, args=(set(sys._current_frames()),), daemon=True)
+        self._echantillonneur.start()
+        self._principal = cProfile.Profile()
+        self._principal.enable()
+        return self
+
+    def __exit__(self, *exc):
+        global _profils_en_cours
+        try:
+            self._principal.disable()
+            self._arret.set()
+            self._echantillonneur.join()
+        finally:
+            _verrou_profil.release()
+        duree = time.perf_counter() - self._debut
+        instantane = tracemalloc.take_snapshot()
+        _, pic = tracemalloc.get_traced_memory()
+        with _verrou_traces:
+            _profils_en_cours -= 1
+            if _profils_en_cours == 0:
+                tracemalloc.stop()
+
+        statistiques = pstats.Stats(self._principal)
+        if self._echantillons.threads:
+            statistiques.add(self._echantillons)
+        Path(os.path.dirname(self.chemin_stats) or '.').mkdir(parents=True, exist_ok=True)
+        statistiques.dump_stats(self.chemin_stats)
+        self.resume = {
+            'duree_s': round(duree, 6),
+            'threads': 1 + len(self._echantillons.threads),
+            'pic_memoire_octets': pic,
+            'fonctions': self._fonctions(statistiques),
+            'allocations': self._allocations(instantane),
+            'fichier': os.path.basename(self.chemin_stats),
+        }
+        ecrire_json(self.chemin_resume, self.resume)
+        return False
+
+    def _fonctions(self, statistiques):
+        """Fonctions triées par temps cumulé"""
+        lignes = []
+        for (fichier, ligne, fonction), (_, appels, propre, cumule, _) in statistiques.stats.items():
+            lignes.append({
+                'fonction': f"{os.path.basename(fichier)}:{ligne}({fonction})",
+                'appels': appels,
+                'temps_propre_s': round(propre, 6),
+                'temps_cumule_s': round(cumule, 6),
+            })
+        lignes.sort(key=lambda ligne: ligne['temps_cumule_s'], reverse=True)
+        return lignes[:self.nb_fonctions]
+
+    def _allocations(self, instantane):
+        """Lignes de code qui occupent le plus de mémoire à la fin de la tâche"""
+        instantane = instantane.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [{'ligne': f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                 'octets': stat.size, 'blocs': stat.count}
+                for stat in instantane.statistics('lineno')[:self.nb_allocations]]
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Téléchargements reprenables des grandes ressources
+
+Quand le téléchargement d'une grande ressource est interrompu (timeout,
+coupure, échéance de la tâche), les octets déjà reçus sont conservés dans
+un fichier .part, avec les validateurs de la réponse (ETag ou
+Last-Modified) et la taille totale dans un fichier .json. La prochaine
+demande de la même URL, par cette tâche ou par une autre, reprend là où la
+précédente s'est arrêtée avec une requête Range et If-Range : si la
+ressource a changé entre-temps, le serveur renvoie le fichier entier (200)
+et le téléchargement repart de zéro.
+
+Les très grands fichiers sont découpés en plages, téléchargées en parallèle
+quand l'ordonnanceur de la tâche a des créneaux libres pour leur hôte. Le
+.part garde la progression de chaque plage.
+
+Un .part est pris par une seule tâche à la fois : elle le renomme en
+fichier de travail (opération atomique) et le remet en place si elle ne
+termine pas.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from manifeste import ecrire_json
+from politesse import hote_de
+from stockage_blobs import stocker_fichier
+
+# Taille minimale d'une ressource pour que son téléchargement soit reprenable
+SEUIL_REPRISE = 1024 * 1024
+# Au-delà, la ressource est téléchargée en NB_PLAGES plages (parallèles si possible)
+SEUIL_PLAGES = 32 * 1024 * 1024
+NB_PLAGES = 4
+# Les téléchargements partiels plus anciens sont supprimés par le nettoyage
+AGE_MAX_REPRISE = 24 * 3600
+
+TAILLE_BLOC = 64 * 1024
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+def validateur(en_tetes):
+    """Validateur utilisable avec If-Range : ETag fort, sinon Last-Modified (None s'il n'y en a pas)"""
+    etag = en_tetes.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return en_tetes.get('Last-Modified')
+
+
+def reprenable(reponse):
+    """
+    Une réponse 200 complète peut être reprise si le serveur accepte les
+    plages, fournit un validateur et n'encode pas le corps (gzip...)
+    """
+    en_tetes = reponse.headers
+    taille = en_tetes.get('Content-Length')
+    return (reponse.status_code == 200
+            and en_tetes.get('Accept-Ranges', '').lower() == 'bytes'
+            and en_tetes.get('Content-Encoding', 'identity').lower() == 'identity'
+            and validateur(en_tetes) is not None
+            and taille is not None and taille.isdigit() and int(taille) >= SEUIL_REPRISE)
+
+
+def decouper(taille, nb_plages):
+    """Plages [debut, fin (exclue), position] couvrant taille octets"""
+    pas = -(-taille // nb_plages)
+    return [[debut, min(debut + pas, taille), debut] for debut in range(0, taille, pas)]
+
+
+class PlageInattendue(Exception):
+    """Le serveur a répondu à une requête Range par une autre plage, ou par le fichier entier"""
+
+
+class Reprise:
+    """
+    Téléchargement reprenable d'une URL
+
+    Utilisation :
+        reprise = Reprise(dossier_reprises, url)
+        en_tetes = reprise.prendre()          # Range et If-Range si un .part existe
+        try:
+            reponse = session.get(url, headers=en_tetes, stream=True)
+            taille_totale = reprise.accepter(reponse)
+            reponse.raise_for_status()
+            if reprise.active:
+                taille, empreinte = reprise.terminer(...)
+        finally:
+            reprise.liberer()                 # remet le .part en place si inachevé
+    """
+
+    def __init__(self, dossier, url):
+        self.url = url
+        self.dossier = dossier
+        base = os.path.join(dossier, hashlib.sha256(url.encode('utf-8')).hexdigest())
+        self.chemin_part = base + '.part'
+        self.chemin_meta = base + '.json'
+        self.chemin = f"{base}.{uuid.uuid4().hex}.tmp"
+        self.meta = None
+        self.active = False
+        self.repris = 0
+        self._termine = False
+
+    def prendre(self):
+        """
+        Prend le .part de l'URL s'il existe
+
+        Returns:
+            dict: En-têtes de la requête (Range, If-Range), vides sans reprise possible
+        """
+        os.makedirs(self.dossier, exist_ok=True)
+        try:
+            os.rename(self.chemin_part, self.chemin)
+        except FileNotFoundError:
+            return {}
+        try:
+            with open(self.chemin_meta, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            meta = None
+        if not meta or meta.get('url') != self.url or os.path.getsize(self.chemin) != meta['taille']:
+            os.remove(self.chemin)
+            return {}
+        self.meta = meta
+        self.repris = sum(position - debut for debut, _, position in meta['plages'])
+        debut, fin, position = self._restantes()[0]
+        return {'Range': f'bytes={position}-{fin - 1}', 'If-Range': meta['validateur'],
+                'Accept-Encoding': 'identity'}
+
+    def _restantes(self):
+        return [plage for plage in self.meta['plages'] if plage[2] < plage[1]]
+
+    def accepter(self, reponse):
+        """
+        Examine la réponse à la première requête et décide de la suite
+
+        À appeler avant raise_for_status : un 416 (plage refusée) invalide le .part.
+
+        Returns:
+            int: Taille totale annoncée de la ressource (None si inconnue)
+        """
+        if reponse.status_code == 206 and self.meta:
+            trouve = CONTENT_RANGE.fullmatch(reponse.headers.get('Content-Range', ''))
+            position = self._restantes()[0][2]
+            if not trouve or int(trouve.group(1)) != position or int(trouve.group(3)) != self.meta['taille']:
+                # Le .part ne peut plus être repris : la prochaine tentative repart de zéro
+                self.abandonner()
+                raise PlageInattendue(reponse.headers.get('Content-Range'))
+            self.active = True
+            print(f"  ↻ Reprise à {self.repris} octets sur {self.meta['taille']}: {self.url}")
+            return self.meta['taille']
+
+        if not reponse.ok and reponse.status_code != 416:
+            # Erreur passagère : le .part est gardé pour une prochaine tentative
+            return None
+
+        # Fichier entier (ressource modifiée, ou pas de .part) ou plage refusée : repartir de zéro
+        self.meta = None
+        self.repris = 0
+        if os.path.exists(self.chemin):
+            os.remove(self.chemin)
+        if reprenable(reponse):
+            taille = int(reponse.headers['Content-Length'])
+            self.meta = {
+                'url': self.url,
+                'validateur': validateur(reponse.headers),
+                'taille': taille,
+                'plages': decouper(taille, NB_PLAGES if taille >= SEUIL_PLAGES else 1),
+            }
+            self.active = True
+        length = reponse.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+    def terminer(self, session, reponse, timeout, dossier_blobs, chemin_complet,
+                 ordonnanceur=None, relayer=None):
+        """
+        Télécharge les plages restantes et range le fichier terminé dans le stockage
+
+        La première plage restante est lue dans la réponse déjà reçue. Les
+        autres sont demandées en parallèle pour celles qui obtiennent un
+        créneau libre de l'ordonnanceur, l'une après l'autre sinon.
+
+        Args:
+            relayer (callable): Appliquée à chaque flux de blocs (ex : arrêt à l'échéance)
+
+        Returns:
+            tuple: (taille, empreinte SHA-256)
+        """
+        relayer = relayer or (lambda morceaux: morceaux)
+        descripteur = os.open(self.chemin, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(descripteur, self.meta['taille'])
+            restantes = self._restantes()
+            self._ecrire(descripteur, restantes[0], reponse, relayer)
+            reponse.close()
+
+            hote = hote_de(self.url)
+            paralleles = []
+            if ordonnanceur is not None:
+                for plage in restantes[1:]:
+                    if ordonnanceur.reserver(hote) != 0:
+                        break
+                    paralleles.append(plage)
+
+            def telecharger(plage, creneau):
+                try:
+                    self._telecharger_plage(session, descripteur, plage, timeout, relayer)
+                finally:
+                    if creneau:
+                        ordonnanceur.liberer(hote)
+
+            with ThreadPoolExecutor(max_workers=max(1, len(paralleles))) as executeur:
+                travaux = [executeur.submit(telecharger, plage, True) for plage in paralleles]
+                for plage in restantes[1 + len(paralleles):]:
+                    telecharger(plage, False)
+                for travail in travaux:
+                    travail.result()
+        finally:
+            os.close(descripteur)
+
+        empreinte = hashlib.sha256()
+        with open(self.chemin, 'rb') as f:
+            for bloc in iter(lambda: f.read(TAILLE_BLOC), b''):
+                empreinte.update(bloc)
+        stocker_fichier(self.chemin, empreinte.hexdigest(), chemin_complet, dossier_blobs)
+        self._termine = True
+        self._supprimer_meta()
+        return self.meta['taille'], empreinte.hexdigest()
+
+    def _telecharger_plage(self, session, descripteur, plage, timeout, relayer):
+        debut, fin, position = plage
+        en_tetes = {'Range': f'bytes={position}-{fin - 1}', 'If-Range': self.meta['validateur'],
+                    'Accept-Encoding': 'identity'}
+        with session.get(self.url, headers=en_tetes, timeout=timeout, stream=True) as reponse:
+            reponse.raise_for_status()
+            trouve = CONTENT_RANGE.fullmatch(reponse.headers.get('Content-Range', ''))
+            if reponse.status_code != 206 or not trouve or int(trouve.group(1)) != position:
+                # Ressource modifiée pendant le téléchargement : le .part n'est plus valable
+                self.meta['plages'] = []
+                raise PlageInattendue(f"{reponse.status_code} {reponse.headers.get('Content-Range')}")
+            self._ecrire(descripteur, plage, reponse, relayer)
+
+    def _ecrire(self, descripteur, plage, reponse, relayer):
+        """Écrit la réponse dans sa plage ; la position avance après chaque bloc écrit"""
+        for morceau in relayer(reponse.iter_content(TAILLE_BLOC)):
+            morceau = morceau[:plage[1] - plage[2]]
+            os.pwrite(descripteur, morceau, plage[2])
+            plage[2] += len(morceau)
+            if plage[2] >= plage[1]:
+                return
+        if plage[2] < plage[1]:
+            raise PlageInattendue(f"plage incomplète ({plage[2]}/{plage[1]})")
+
+    def liberer(self):
+        """
+        Remet en place un téléchargement inachevé pour une prochaine reprise
+        (ou supprime le fichier de travail s'il n'y a rien à garder)
+        """
+        if self._termine or not os.path.exists(self.chemin):
+            return
+        if self.meta and self.meta['plages'] and any(position > debut for debut, _, position in self.meta['plages']):
+            ecrire_json(self.chemin_meta, self.meta)
+            os.replace(self.chemin, self.chemin_part)
+        else:
+            os.remove(self.chemin)
+            self._supprimer_meta()
+
+    def abandonner(self):
+        """Supprime le téléchargement partiel (fichier de travail et métadonnées)"""
+        self.meta = None
+        self.repris = 0
+        if os.path.exists(self.chemin):
+            os.remove(self.chemin)
+        self._supprimer_meta()
+
+    def _supprimer_meta(self):
+        try:
+            os.remove(self.chemin_meta)
+        except FileNotFoundError:
+            pass
+
+
+def nettoyer_reprises(dossier, age_max=AGE_MAX_REPRISE):
+    """
+    Supprime les téléchargements partiels abandonnés depuis plus de age_max secondes
+
+    Returns:
+        int: Nombre de fichiers supprimés
+    """
+    if not os.path.isdir(dossier):
+        return 0
+    limite = time.time() - age_max
+    supprimes = 0
+    for nom in os.listdir(dossier):
+        chemin = os.path.join(dossier, nom)
+        try:
+            if os.path.getmtime(chemin) < limite:
+                os.remove(chemin)
+                supprimes += 1
+        except FileNotFoundError:
+            pass
+    return supprimes
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Moteur de scraping asynchrone basé sur asyncio et aiohttp
+Permet de lancer de nombreuses captures de pages dans un seul processus
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from app import (
+    EN_TETES, MAX_PAR_HOTE, MAX_TELECHARGEMENTS, PARSEUR_DEFAUT, TAILLE_BLOC, FichierTropVolumineux,
+    AllocateurNoms, ajouter_resultat, analyser_page, creer_resultats, noter_erreur, reecrire_liens,
+    reserver_chemin, taille_max_pour,
+)
+from manifeste import ecrire_manifeste, type_mime
+from mesures import MesuresTache
+from stockage_blobs import dossier_temporaire, fichier_temporaire, stocker_fichier
+
+# Timeout par requête, identique à la version synchrone
+TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+
+def creer_session(max_telechargements=MAX_TELECHARGEMENTS, max_par_hote=MAX_PAR_HOTE):
+    """
+    Crée une session aiohttp avec un pool de connexions borné
+
+    La session peut être partagée entre plusieurs appels à
+    extraire_site_web_async pour mutualiser les connexions.
+    """
+    connecteur = aiohttp.TCPConnector(limit=max_telechargements, limit_per_host=max_par_hote)
+    return aiohttp.ClientSession(connector=connecteur, headers=EN_TETES, timeout=TIMEOUT)
+
+
+def analyser_contenu(contenu, parseur, base_url):
+    """
+    Parse la page et relève ses ressources et ses liens (voir analyser_page)
+
+    Exécutée dans un thread : le parcours d'une grande page bloquerait la
+    boucle d'événements et les téléchargements en cours.
+
+    Returns:
+        tuple: (soup, ressources, noeuds)
+    """
+    soup = BeautifulSoup(contenu, parseur)
+    return (soup, *analyser_page(soup, base_url))
+
+
+def html_local(soup, noeuds, resultats):
+    """Réécrit les liens vers les fichiers locaux et sérialise la page (exécutée dans un thread)"""
+    reecrire_liens(noeuds, resultats)
+    return str(soup)
+
+
+async def extraire_site_web_async(url, dossier_sortie="site_telecharge", session=None,
+                                  max_telechargements=MAX_TELECHARGEMENTS, max_par_hote=MAX_PAR_HOTE,
+                                  tailles_max=None, dossier_blobs=None, parseur=PARSEUR_DEFAUT):
+    """
+    Télécharge une page web et tous ses fichiers CSS/JS de manière asynchrone
+
+    Args:
+        url (str): L'URL du site à télécharger
+        dossier_sortie (str): Le dossier où sauvegarder les fichiers
+        session (aiohttp.ClientSession): Session partagée (optionnelle)
+        max_telechargements (int): Nombre maximum de téléchargements simultanés
+        max_par_hote (int): Nombre maximum de téléchargements simultanés vers un même hôte
+        tailles_max (dict): Taille maximale en octets par type ('css', 'js', 'images')
+        dossier_blobs (str): Stockage adressé par contenu partagé entre tâches (optionnel)
+        parseur (str): Analyseur HTML de BeautifulSoup ('html.parser' ou 'lxml')
+
+    Returns:
+        dict: Informations sur les fichiers téléchargés, comme extraire_site_web
+    """
+
+    # Valider l'URL
+    if not url or not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError("L'URL doit être une chaîne valide commençant par http:// ou https://")
+
+    # Créer le dossier de sortie
+    Path(dossier_sortie).mkdir(exist_ok=True)
+
+    session_locale = session is None
+    if session_locale:
+        session = creer_session(max_telechargements, max_par_hote)
+
+    resultats = creer_resultats()
+    mesures = MesuresTache()
+
+    try:
+        # Télécharger la page principale
+        print(f"Téléchargement de {url}...")
+        with mesures.phase('page'):
+            async with session.get(url) as response:
+                response.raise_for_status()
+                contenu = await response.read()
+                texte = contenu.decode(response.get_encoding(), errors='replace')
+            mesures.transfert(len(contenu))
+
+        # Parser le HTML et relever ses liens hors de la boucle d'événements
+        with mesures.phase('analyse'):
+            soup, ressources, noeuds = await asyncio.to_thread(analyser_contenu, contenu, parseur, url)
+        resultats['html_original'] = texte
+
+        # Sauvegarder le HTML original
+        with mesures.phase('ecriture'):
+            await asyncio.to_thread(ecrire_texte, f"{dossier_sortie}/index.html", texte)
+
+        # Réserver les chemins dans l'ordre du document puis télécharger chaque URL une fois
+        allocateur = AllocateurNoms()
+        taches = [
+            (ressource_url, type_fichier,
+             reserver_chemin(ressource_url, dossier_sortie, type_fichier, allocateur))
+            for ressource_url, type_fichier in dict.fromkeys(ressources)
+        ]
+
+        limite = asyncio.Semaphore(max(1, max_telechargements))
+
+        async def telecharger(ressource_url, type_fichier, chemin):
+            async with limite:
+                details = {}
+                debut = time.perf_counter()
+                nom_fichier = await telecharger_fichier_async(session, ressource_url, dossier_sortie,
+                                                              type_fichier, chemin,
+                                                              taille_max_pour(type_fichier, tailles_max),
+                                                              dossier_blobs, details)
+                mesures.telechargement(type_fichier, time.perf_counter() - debut, details)
+                return nom_fichier, details
+
+        with mesures.phase('ressources'):
+            telecharges = await asyncio.gather(*(telecharger(*tache) for tache in taches))
+
+        for (ressource_url, type_fichier, _), (nom_fichier, details) in zip(taches, telecharges):
+            if nom_fichier:
+                ajouter_resultat(resultats, ressource_url, type_fichier, nom_fichier, details)
+
+        # Ajouter l'URL de base pour la correspondance des liens
+        resultats['base_url'] = url
+
+        # Créer un HTML modifié avec les liens locaux
+        with mesures.phase('liens'):
+            html_modifie = await asyncio.to_thread(html_local, soup, noeuds, resultats)
+        with mesures.phase('ecriture'):
+            await asyncio.to_thread(ecrire_texte, f"{dossier_sortie}/index_local.html", html_modifie)
+        with mesures.phase('manifeste'):
+            await asyncio.to_thread(ecrire_manifeste, resultats, dossier_sortie)
+
+        print(f"✅ Téléchargement terminé dans le dossier '{dossier_sortie}'")
+
+    except Exception as e:
+        resultats['erreurs'].append(f"Erreur principale: {str(e)}")
+        mesures.erreur('page')
+        print(f"❌ Erreur: {e}")
+    finally:
+        if session_locale:
+            await session.close()
+
+    resultats['mesures'] = mesures.en_dict()
+
+    return resultats
+
+
+async def telecharger_fichier_async(session, url, dossier_base, type_fichier, chemin_complet=None,
+                                    taille_max=None, dossier_blobs=None, details=None):
+    """
+    Télécharge un fichier spécifique avec aiohttp, bloc par bloc
+
+    Si details est fourni, il reçoit 'taille', 'sha256' et 'type_mime', ou
+    'erreur' comme pour telecharger_fichier.
+    """
+    if taille_max is None:
+        taille_max = taille_max_pour(type_fichier)
+
+    try:
+        # Vérifier que l'URL est valide
+        if not url or not url.startswith(('http://', 'https://')):
+            print(f"  ❌ URL invalide: {url}")
+            noter_erreur(details, 'url')
+            return None
+
+        async with session.get(url) as response:
+            response.raise_for_status()
+
+            # Refuser d'emblée si la taille annoncée dépasse la limite
+            if response.content_length and response.content_length > taille_max:
+                print(f"  ❌ Fichier trop volumineux ({response.content_length} bytes): {url}")
+                noter_erreur(details, 'taille')
+                return None
+
+            # Créer le sous-dossier si nécessaire
+            await asyncio.to_thread(Path(f"{dossier_base}/{type_fichier}").mkdir, exist_ok=True)
+
+            if chemin_complet is None:
+                chemin_complet = reserver_chemin(url, dossier_base, type_fichier)
+
+            # Sauvegarder le fichier sans bloquer la boucle d'événements
+            taille, empreinte = await ecrire_flux_async(response.content.iter_chunked(TAILLE_BLOC),
+                                                        chemin_complet, taille_max, dossier_blobs)
+            if details is not None:
+                details.update(taille=taille, sha256=empreinte,
+                               type_mime=type_mime(chemin_complet, response.headers.get('Content-Type')))
+
+        print(f"  ✓ {type_fichier}: {os.path.basename(chemin_complet)}")
+        return chemin_complet
+
+    except FichierTropVolumineux as e:
+        print(f"  ❌ Fichier trop volumineux ({e}): {url}")
+        noter_erreur(details, 'taille')
+        return None
+    except asyncio.TimeoutError:
+        print(f"  ❌ Timeout lors du téléchargement: {url}")
+        noter_erreur(details, 'timeout')
+        return None
+    except aiohttp.ClientError as e:
+        print(f"  ❌ Erreur réseau {url}: {e}")
+        noter_erreur(details, 'http' if isinstance(e, aiohttp.ClientResponseError) else 'reseau')
+        return None
+    except Exception as e:
+        print(f"  ❌ Erreur téléchargement {url}: {e}")
+        noter_erreur(details, 'autre')
+        return None
+
+
+def ecrire_texte(chemin, texte):
+    """Écrit un fichier texte en UTF-8"""
+    with open(chemin, 'w', encoding='utf-8') as f:
+        f.write(texte)
+
+
+async def ecrire_flux_async(morceaux, chemin_complet, taille_max, dossier_blobs=None):
+    """
+    Version asynchrone de app.ecrire_flux : fichier temporaire puis renommage atomique
+    """
+    if dossier_blobs:
+        dossier_temp = await asyncio.to_thread(dossier_temporaire, dossier_blobs)
+    else:
+        dossier_temp = os.path.dirname(chemin_complet)
+    descripteur, chemin_temp = await asyncio.to_thread(fichier_temporaire, dossier_temp)
+    try:
+        taille = 0
+        empreinte = hashlib.sha256()
+        with os.fdopen(descripteur, 'wb') as f:
+            async for morceau in morceaux:
+                taille += len(morceau)
+                if taille > taille_max:
+                    raise FichierTropVolumineux(f"plus de {taille_max} bytes")
+                empreinte.update(morceau)
+                await asyncio.to_thread(f.write, morceau)
+        if dossier_blobs:
+            await asyncio.to_thread(stocker_fichier, chemin_temp, empreinte.hexdigest(),
+                                    chemin_complet, dossier_blobs)
+        else:
+            await asyncio.to_thread(os.replace, chemin_temp, chemin_complet)
+        return taille, empreinte.hexdigest()
+    except BaseException:
+        if os.path.exists(chemin_temp):
+            os.remove(chemin_temp)
+        raise
+
+
+async def extraire_plusieurs_sites(urls_et_dossiers, max_telechargements=MAX_TELECHARGEMENTS,
+                                   max_par_hote=MAX_PAR_HOTE):
+    """
+    Capture plusieurs pages en parallèle avec une seule session partagée
+
+    Args:
+        urls_et_dossiers (list): Tuples (url, dossier_sortie)
+
+    Returns:
+        list: Les dictionnaires de résultats, dans l'ordre d'entrée
+    """
+    async with creer_session(max_telechargements, max_par_hote) as session:
+        return await asyncio.gather(*(
+            extraire_site_web_async(url, dossier, session=session,
+                                    max_telechargements=max_telechargements,
+                                    max_par_hote=max_par_hote)
+            for url, dossier in urls_et_dossiers
+        ))
+
+
+if __name__ == "__main__":
+    from app import afficher_resume
+
+    resultats = asyncio.run(extraire_site_web_async("https://example.com", "mon_site_telecharge"))
+    afficher_resume(resultats)
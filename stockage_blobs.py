@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Stockage de fichiers adressé par contenu (SHA-256)
+
+Chaque contenu distinct n'est écrit qu'une seule fois dans le dossier des
+blobs. Les dossiers des tâches y font référence par des liens physiques
+(hardlinks) : le nombre de liens du blob sert de compteur de références,
+partagé entre processus sans fichier d'index.
+"""
+
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+# Sous-dossier des fichiers temporaires, sur le même système de fichiers que les blobs
+DOSSIER_TEMP = 'tmp'
+# Sous-dossier des téléchargements interrompus, à reprendre (voir reprises.py)
+DOSSIER_REPRISES = 'reprises'
+
+
+# Droits d'un fichier ordinaire créé par open() : 0666 moins le umask du processus,
+# lu une seule fois (os.umask le modifie le temps de la lecture)
+_umask = os.umask(0)
+os.umask(_umask)
+DROITS_FICHIERS = 0o666 & ~_umask
+
+
+def fichier_temporaire(dossier, suffixe='.tmp'):
+    """
+    Crée un fichier temporaire comme tempfile.mkstemp, avec les droits d'un fichier ordinaire
+
+    mkstemp crée les fichiers en 0600 et le renommage atomique conserve ces
+    droits : sans correction, les fichiers des sites (et leurs archives)
+    ne seraient lisibles que par leur propriétaire.
+
+    Returns:
+        tuple: (descripteur, chemin)
+    """
+    descripteur, chemin = tempfile.mkstemp(dir=dossier or '.', suffix=suffixe)
+    os.fchmod(descripteur, DROITS_FICHIERS)
+    return descripteur, chemin
+
+
+def chemin_blob(dossier_blobs, empreinte):
+    """
+    Renvoie le chemin du blob pour une empreinte SHA-256 (ex: blobs/ab/abcdef...)
+    """
+    return os.path.join(dossier_blobs, empreinte[:2], empreinte)
+
+
+def dossier_temporaire(dossier_blobs):
+    """
+    Renvoie (et crée si besoin) le dossier des écritures en cours
+    """
+    dossier = os.path.join(dossier_blobs, DOSSIER_TEMP)
+    Path(dossier).mkdir(parents=True, exist_ok=True)
+    return dossier
+
+
+def dossier_reprises(dossier_blobs):
+    """
+    Renvoie le dossier des téléchargements partiels (.part) du stockage
+    """
+    return os.path.join(dossier_blobs, DOSSIER_REPRISES)
+
+
+def stocker_fichier(chemin_temp, empreinte, chemin_complet, dossier_blobs):
+    """
+    Range un fichier temporaire dans le stockage et le lie à chemin_complet
+
+    Si un blob identique existe déjà, le fichier temporaire est supprimé et
+    seul un nouveau lien est créé : aucune donnée n'est réécrite.
+
+    Returns:
+        bool: True si le contenu était déjà présent (déduplication)
+    """
+    blob = chemin_blob(dossier_blobs, empreinte)
+    deja_present = True
+    try:
+        lier(blob, chemin_complet)
+    except FileNotFoundError:
+        # Premier exemplaire de ce contenu : le ranger dans le stockage
+        Path(os.path.dirname(blob)).mkdir(parents=True, exist_ok=True)
+        os.replace(chemin_temp, blob)
+        deja_present = False
+        lier(blob, chemin_complet)
+    if deja_present:
+        os.remove(chemin_temp)
+    return deja_present
+
+
+def lier(blob, chemin_complet):
+    """
+    Crée un lien physique vers le blob, ou une copie si les liens ne sont pas supportés
+    """
+    if os.path.exists(chemin_complet):
+        os.remove(chemin_complet)
+    try:
+        os.link(blob, chemin_complet)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # Système de fichiers sans liens physiques : pas de déduplication possible
+        shutil.copyfile(blob, chemin_complet)
+
+
+def compter_references(blob):
+    """
+    Nombre de fichiers de tâches qui utilisent encore ce blob
+    """
+    return os.stat(blob).st_nlink - 1
+
+
+def parcourir_blobs(dossier_blobs):
+    """
+    Itère sur les chemins de tous les blobs du stockage
+    """
+    if not os.path.isdir(dossier_blobs):
+        return
+    for prefixe in os.listdir(dossier_blobs):
+        if prefixe in (DOSSIER_TEMP, DOSSIER_REPRISES):
+            continue
+        dossier = os.path.join(dossier_blobs, prefixe)
+        if os.path.isdir(dossier):
+            for nom in os.listdir(dossier):
+                yield os.path.join(dossier, nom)
+
+
+def nettoyer_blobs(dossier_blobs, empreintes=None):
+    """
+    Supprime les blobs qui ne sont plus référencés par aucune tâche
+
+    Args:
+        dossier_blobs (str): Dossier du stockage
+        empreintes (iterable): Limiter la vérification à ces blobs (ceux des
+            tâches supprimées, lus dans leurs manifestes) au lieu de parcourir
+            tout le stockage
+
+    Returns:
+        int: Nombre de blobs supprimés
+    """
+    if empreintes is None:
+        blobs = parcourir_blobs(dossier_blobs)
+    else:
+        blobs = (chemin_blob(dossier_blobs, empreinte) for empreinte in empreintes)
+    supprimes = 0
+    for blob in blobs:
+        try:
+            if compter_references(blob) <= 0:
+                os.remove(blob)
+                supprimes += 1
+        except FileNotFoundError:
+            pass
+    return supprimes
+
+
+def statistiques_blobs(dossier_blobs):
+    """
+    Renvoie le nombre de blobs, leur taille totale et le nombre de références
+    """
+    stats = {'blobs': 0, 'octets': 0, 'references': 0}
+    for blob in parcourir_blobs(dossier_blobs):
+        try:
+            infos = os.stat(blob)
+        except FileNotFoundError:
+            continue
+        stats['blobs'] += 1
+        stats['octets'] += infos.st_size
+        stats['references'] += infos.st_nlink - 1
+    return stats
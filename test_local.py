@@ -0,0 +1,1386 @@
+#!/usr/bin/env python3
+"""
+Tests du scraper web sur un serveur HTTP local (sans accès réseau)
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import requests
+
+from app import extraire_site_web, telecharger_fichier
+
+PAGE_HTML = """<!DOCTYPE html>
+<html>
+<head>
+  <link rel="stylesheet" href="/css/style.css">
+  <link rel="stylesheet" href="http://{hote}/autre/style.css">
+  <script src="/js/app.js"></script>
+</head>
+<body>
+  <img src="/img/logo.png">
+  <img src="/img/absent.png">
+  <img src="img/logo.png">
+  <script src="/js/app.js"></script>
+  <a href="/page2.html#haut">Page 2</a>
+  <a href="mailto:contact@example.com">Contact</a>
+  <a href="https://ailleurs.example/">Autre site</a>
+</body>
+</html>
+"""
+
+PAGE_2_HTML = """<!DOCTYPE html>
+<html>
+<head><link rel="stylesheet" href="css/style.css"></head>
+<body>
+  <a href="./">Accueil</a>
+  <a href="/page3.html">Page 3</a>
+</body>
+</html>
+"""
+
+PAGE_3_HTML = """<!DOCTYPE html>
+<html><body><img src="/img/logo.png"></body></html>
+"""
+
+# Page dont les liens internes mènent à un document binaire et à une très grande page
+PAGE_DOCUMENTS_HTML = """<!DOCTYPE html>
+<html><body><a href="/gros.bin">Archive</a><a href="/grande.html">Grande</a><a href="/page3.html">3</a></body></html>
+"""
+
+PAGE_BUDGET_HTML = """<!DOCTYPE html>
+<html>
+<head><link rel="stylesheet" href="/css/style.css"></head>
+<body><img src="/img/logo.png" loading="lazy"><img src="/lent.png"></body>
+</html>
+"""
+
+# Très grande page (plusieurs Mo) pour le mode mémoire réduite
+PARAGRAPHE = '<p class="texte">Paragraphe é &amp; suite — ' + 'x' * 200 + '</p>\n'
+GRANDE_PAGE_HTML = ('<!DOCTYPE html>\n<html><head><link rel="stylesheet" href="/css/style.css">'
+                    '<script>var balise = "<img src=\'/non.png\'>";</script></head><body>\n'
+                    + PARAGRAPHE * 8000 + '<!-- <img src="/commentaire.png"> -->\n<IMG SRC=/img/logo.png ALT="a > b">'
+                    + PARAGRAPHE * 8000 + "<script src='/js/app.js'></script><a href=\"/page2.html\">2</a>"
+                    '</body></html>\n')
+GRANDE_PAGE = GRANDE_PAGE_HTML.encode('utf-8')
+
+FICHIERS = {
+    '/css/style.css': (b'body { color: red; }', 'text/css'),
+    '/autre/style.css': (b'p { margin: 0; }', 'text/css'),
+    '/js/app.js': (b'console.log("ok");', 'application/javascript'),
+    '/img/logo.png': (b'\x89PNG\r\n\x1a\n' + b'0' * 256, 'image/png'),
+}
+
+# Grand fichier servi par plages (Range), dont la première demande est coupée
+GROS_FICHIER = bytes(range(256)) * 10000
+
+# Feuilles de style qui importent d'autres fichiers (hors du site principal)
+THEME = {
+    '/theme/theme.css': (b'@import "base.css";\n/* url(commentaire.png) */\n'
+                         b'@font-face { src: url(../polices/titre.woff2?v=2#x) format("woff2"); }\n'
+                         b'h1 { background: url( \'/img/logo.png\' ); content: "url(chaine.png)"; }\n'
+                         b'i { background: url(data:image/png;base64,AAAA); }', 'text/css'),
+    '/theme/base.css': (b'body { background: url("fond.png") }', 'text/css'),
+    '/theme/fond.png': (b'\x89PNG\r\n\x1a\nfond', 'image/png'),
+    '/polices/titre.woff2': (b'wOF2police', 'font/woff2'),
+}
+
+
+class GestionnaireSite(BaseHTTPRequestHandler):
+    """Sert une page HTML et ses ressources depuis la mémoire"""
+
+    requetes = Counter()
+    plages = []
+
+    def do_GET(self):
+        GestionnaireSite.requetes[self.path] += 1
+        if self.path == '/flux':
+            # Réponse sans Content-Length, lue jusqu'à la fermeture de la connexion
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.end_headers()
+            for _ in range(16):
+                self.wfile.write(b'x' * 1024)
+            return
+        if self.path == '/limite.png' and GestionnaireSite.requetes[self.path] == 1:
+            # Première demande refusée : le client doit attendre la durée annoncée
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/limite.png':
+            self.path = '/img/logo.png'
+        if self.path == '/lent.png':
+            # Hôte d'images lent : la tâche doit abandonner à son échéance
+            time.sleep(2)
+            self.path = '/img/logo.png'
+        if self.path.split('?')[0] == '/gros.bin':
+            self.servir_plages(GROS_FICHIER)
+            return
+        if self.path in ('/langue.txt', '/partout.txt'):
+            # Réponse qui dépend d'un en-tête de la requête (Vary)
+            corps = (self.headers.get('Accept-Language') or 'aucune').encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Cache-Control', 'max-age=3600')
+            self.send_header('Vary', 'Accept-Language' if self.path == '/langue.txt' else '*')
+            self.send_header('Content-Length', str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+            return
+        if self.path.split('?')[0] in THEME:
+            corps, type_contenu = THEME[self.path.split('?')[0]]
+            self.send_response(200)
+            self.send_header('Content-Type', type_contenu)
+            self.send_header('Content-Length', str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+            return
+        if self.path == '/':
+            corps = PAGE_HTML.format(hote=self.headers['Host']).encode('utf-8')
+            type_contenu = 'text/html; charset=utf-8'
+        elif self.path in ('/budget.html', '/grande.html'):
+            corps = PAGE_BUDGET_HTML.encode('utf-8') if self.path == '/budget.html' else GRANDE_PAGE
+            type_contenu = 'text/html; charset=utf-8'
+        elif self.path in ('/page2.html', '/page3.html', '/documents.html'):
+            corps = {'/page2.html': PAGE_2_HTML, '/page3.html': PAGE_3_HTML,
+                     '/documents.html': PAGE_DOCUMENTS_HTML}[self.path].encode('utf-8')
+            type_contenu = 'text/html; charset=utf-8'
+        elif self.path in FICHIERS:
+            corps, type_contenu = FICHIERS[self.path]
+            etag = f'"{hash(corps) & 0xffffffff:x}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', type_contenu)
+        if self.path in FICHIERS:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'max-age=3600' if self.path == '/css/style.css' else 'no-cache')
+        self.send_header('Content-Length', str(len(corps)))
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def servir_plages(self, corps):
+        """Sert un fichier par plages (Range, If-Range) ; la première demande est coupée à mi-chemin"""
+        etag = '"gros-v1"'
+        plage = self.headers.get('Range')
+        GestionnaireSite.plages.append(plage)
+        debut, fin = 0, len(corps)
+        if plage and self.headers.get('If-Range') == etag:
+            premier, dernier = plage[len('bytes='):].split('-')
+            debut, fin = int(premier), int(dernier) + 1 if dernier else len(corps)
+            self.send_response(206)
+            # '?decale' : plage annoncée différente de celle demandée
+            decalage = 1 if self.path.endswith('?decale') else 0
+            self.send_header('Content-Range', f'bytes {debut + decalage}-{fin - 1}/{len(corps)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(fin - debut))
+        self.end_headers()
+        if GestionnaireSite.requetes[self.path] == 1:
+            self.wfile.write(corps[:len(corps) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(corps[debut:fin])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def serveur_local():
+    """Démarre un serveur HTTP local et renvoie son URL de base"""
+    GestionnaireSite.requetes.clear()
+    GestionnaireSite.plages.clear()
+    serveur = ThreadingHTTPServer(('127.0.0.1', 0), GestionnaireSite)
+    thread = threading.Thread(target=serveur.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{serveur.server_address[1]}/"
+    serveur.shutdown()
+    serveur.server_close()
+
+
+def test_telechargement_parallele(serveur_local, tmp_path):
+    """Les ressources sont téléchargées et référencées dans l'ordre du document"""
+    dossier = str(tmp_path / "site")
+    resultats = extraire_site_web(serveur_local, dossier, max_telechargements=4, max_par_hote=2)
+
+    assert resultats['erreurs'] == []
+    assert [f['fichier_local'] for f in resultats['fichiers_css']] == [
+        f"{dossier}/css/style.css",
+        f"{dossier}/css/style_1.css",
+    ]
+    assert len(resultats['fichiers_js']) == 1
+    assert [f['url_original'] for f in resultats['images']] == [serveur_local + "img/logo.png"]
+
+    # Les ressources référencées plusieurs fois ne sont demandées qu'une fois
+    assert GestionnaireSite.requetes['/img/logo.png'] == 1
+    assert GestionnaireSite.requetes['/js/app.js'] == 1
+    assert os.listdir(f"{dossier}/images") == ['logo.png']
+
+    with open(f"{dossier}/css/style_1.css", 'rb') as f:
+        assert f.read() == FICHIERS['/autre/style.css'][0]
+    with open(f"{dossier}/index_local.html", encoding='utf-8') as f:
+        html_local = f.read()
+    for chemin in resultats['url_vers_fichier'].values():
+        assert chemin in html_local
+    assert os.path.exists(f"{dossier}/index.html")
+
+
+def test_analyse_en_un_passage(serveur_local, tmp_path, monkeypatch):
+    """La page est analysée une seule fois, chaque URL relative résolue une fois, quel que soit l'analyseur"""
+    import app
+
+    analyses = []
+    resolutions = Counter()
+    soupe, joindre = app.BeautifulSoup, app.urljoin
+
+    def compter_analyses(*args, **kwargs):
+        analyses.append(args[1] if len(args) > 1 else kwargs.get('features'))
+        return soupe(*args, **kwargs)
+
+    def compter_resolutions(base, url, *args):
+        resolutions[url] += 1
+        return joindre(base, url, *args)
+
+    monkeypatch.setattr(app, 'BeautifulSoup', compter_analyses)
+    monkeypatch.setattr(app, 'urljoin', compter_resolutions)
+
+    parseurs = ['html.parser']
+    try:
+        import lxml  # noqa: F401
+        parseurs.append('lxml')
+    except ImportError:
+        pass
+    pages = []
+    for parseur in parseurs:
+        dossier = str(tmp_path / parseur)
+        resultats = extraire_site_web(serveur_local, dossier, parseur=parseur)
+        assert resultats['erreurs'] == []
+        with open(f"{dossier}/index_local.html", encoding='utf-8') as f:
+            html_local = f.read()
+        assert f'src="{dossier}/js/app.js"' in html_local and f'href="{dossier}/css/style_1.css"' in html_local
+        assert serveur_local + 'img/logo.png' not in html_local
+        pages.append(sorted((f['url_original'], f['sha256'])
+                            for cle in ('fichiers_css', 'fichiers_js', 'images') for f in resultats[cle]))
+
+    # Une seule soupe par extraction, sans seconde analyse du HTML réécrit
+    assert analyses == parseurs
+    # '/js/app.js' apparaît deux fois dans la page : une seule résolution par extraction
+    assert resolutions['/js/app.js'] == len(parseurs)
+    assert all(liste == pages[0] for liste in pages)
+
+
+def test_extraction_async_identique(serveur_local, tmp_path):
+    """La version asynchrone produit le même résultat que la version synchrone"""
+    pytest.importorskip('aiohttp')
+    import asyncio
+    from scraper_async import extraire_site_web_async, extraire_plusieurs_sites
+
+    synchrone = extraire_site_web(serveur_local, str(tmp_path / "sync"))
+    asynchrone = asyncio.run(extraire_site_web_async(serveur_local, str(tmp_path / "async")))
+
+    assert asynchrone['erreurs'] == []
+    assert asynchrone['html_original'] == synchrone['html_original']
+    for cle in ('fichiers_css', 'fichiers_js', 'images'):
+        assert ([f['url_original'] for f in asynchrone[cle]] ==
+                [f['url_original'] for f in synchrone[cle]])
+    with open(tmp_path / "async" / "index_local.html", encoding='utf-8') as f:
+        assert f"{tmp_path / 'async'}/css/style_1.css" in f.read()
+
+    plusieurs = asyncio.run(extraire_plusieurs_sites(
+        [(serveur_local, str(tmp_path / f"site_{i}")) for i in range(3)]))
+    assert all(not r['erreurs'] and len(r['images']) == 1 for r in plusieurs)
+
+
+def test_extraction_async_analyse_hors_boucle(serveur_local, tmp_path, monkeypatch):
+    """Le parcours et la réécriture de la page ne bloquent pas la boucle d'événements"""
+    pytest.importorskip('aiohttp')
+    import asyncio
+    import scraper_async
+
+    threads = []
+    analyser, reecrire = scraper_async.analyser_page, scraper_async.reecrire_liens
+
+    def analyser_page(*args):
+        threads.append(threading.get_ident())
+        return analyser(*args)
+
+    def reecrire_liens(*args):
+        threads.append(threading.get_ident())
+        return reecrire(*args)
+
+    monkeypatch.setattr(scraper_async, 'analyser_page', analyser_page)
+    monkeypatch.setattr(scraper_async, 'reecrire_liens', reecrire_liens)
+
+    async def extraire():
+        return threading.get_ident(), await scraper_async.extraire_site_web_async(serveur_local, str(tmp_path))
+
+    boucle, resultats = asyncio.run(extraire())
+    assert resultats['erreurs'] == []
+    assert len(threads) == 2 and boucle not in threads
+
+
+def test_limite_taille_sans_content_length(serveur_local, tmp_path):
+    """La limite de taille s'applique même sans en-tête Content-Length"""
+    session = requests.Session()
+    dossier = str(tmp_path)
+
+    assert telecharger_fichier(session, serveur_local + "flux", dossier, 'js', taille_max=4096) is None
+    assert os.listdir(tmp_path / 'js') == []
+
+    chemin = telecharger_fichier(session, serveur_local + "flux", dossier, 'js', taille_max=32 * 1024)
+    assert os.path.getsize(chemin) == 16 * 1024
+    assert os.listdir(tmp_path / 'js') == ['flux.js']
+
+
+def test_reprise_telechargement_interrompu(serveur_local, tmp_path, monkeypatch):
+    """Un grand fichier interrompu est repris là où il s'était arrêté, en une ou plusieurs plages"""
+    import hashlib
+    import reprises
+    from politesse import Ordonnanceur
+    from stockage_blobs import dossier_reprises
+
+    session = requests.Session()
+    blobs = str(tmp_path / ".blobs")
+    dossier_parts = dossier_reprises(blobs)
+    taille_max = 2 * len(GROS_FICHIER)
+    empreinte = hashlib.sha256(GROS_FICHIER).hexdigest()
+
+    details = {}
+    assert telecharger_fichier(session, serveur_local + "gros.bin", str(tmp_path), 'images', None, taille_max,
+                               blobs, details) is None
+    assert details['erreur'] == 'reseau'
+    assert len([nom for nom in os.listdir(dossier_parts) if nom.endswith('.part')]) == 1
+
+    chemin = telecharger_fichier(session, serveur_local + "gros.bin", str(tmp_path), 'images', None, taille_max,
+                                 blobs, details)
+    with open(chemin, 'rb') as f:
+        assert f.read() == GROS_FICHIER
+    assert details['sha256'] == empreinte and details['taille'] == len(GROS_FICHIER)
+    # Seule la fin du fichier a été demandée à nouveau
+    debut = int(GestionnaireSite.plages[1][len('bytes='):].split('-')[0])
+    assert 0 < debut <= len(GROS_FICHIER) // 2
+    assert os.listdir(dossier_parts) == []
+
+    # Découpé en plages : la première est lue dans la réponse (coupée après elle), les autres en parallèle
+    monkeypatch.setattr(reprises, 'SEUIL_PLAGES', reprises.SEUIL_REPRISE)
+    GestionnaireSite.plages.clear()
+    chemin = telecharger_fichier(session, serveur_local + "gros.bin?plages", str(tmp_path), 'images', None,
+                                 taille_max, blobs, details, ordonnanceur=Ordonnanceur(max_par_hote=4))
+    with open(chemin, 'rb') as f:
+        assert f.read() == GROS_FICHIER
+    assert GestionnaireSite.plages[0] is None
+    assert len(GestionnaireSite.plages) == reprises.NB_PLAGES
+    assert os.listdir(dossier_parts) == []
+
+    # Plage inattendue à la reprise : le .part est abandonné, la tentative suivante repart de zéro
+    monkeypatch.setattr(reprises, 'SEUIL_PLAGES', len(GROS_FICHIER) + 1)
+    GestionnaireSite.plages.clear()
+    url = serveur_local + "gros.bin?decale"
+    for _ in range(2):
+        assert telecharger_fichier(session, url, str(tmp_path), 'images', None, taille_max, blobs, details) is None
+    assert os.listdir(dossier_parts) == []
+    chemin = telecharger_fichier(session, url, str(tmp_path), 'images', None, taille_max, blobs, details)
+    with open(chemin, 'rb') as f:
+        assert f.read() == GROS_FICHIER
+    assert GestionnaireSite.plages[1] is not None and GestionnaireSite.plages[2] is None
+
+
+def test_enregistrement_puis_rejeu(serveur_local, tmp_path):
+    """Une capture enregistrée est rejouée à l'identique, sans aucune requête au serveur"""
+    from transports import AdaptateurRejeu
+
+    capture = str(tmp_path / "capture")
+    enregistre = extraire_site_web(serveur_local, str(tmp_path / "a"), transport='enregistrement',
+                                   dossier_capture=capture)
+    demandes = sum(GestionnaireSite.requetes.values())
+    rejoue = extraire_site_web(serveur_local, str(tmp_path / "b"), transport='rejeu', dossier_capture=capture)
+
+    assert sum(GestionnaireSite.requetes.values()) == demandes
+    assert enregistre['erreurs'] == rejoue['erreurs'] == []
+    assert rejoue['html_original'] == enregistre['html_original']
+    for cle in ('fichiers_css', 'fichiers_js', 'images', 'polices'):
+        assert ([(f['url_original'], f['sha256']) for f in rejoue[cle]] ==
+                [(f['url_original'], f['sha256']) for f in enregistre[cle]])
+
+    # Les plages sont servies depuis la réponse entière ; une URL non capturée est une erreur réseau
+    session = requests.Session()
+    session.mount('http://', AdaptateurRejeu(capture))
+    reponse = session.get(serveur_local + "img/logo.png", headers={'Range': 'bytes=4-7'})
+    assert reponse.status_code == 206 and reponse.content == FICHIERS['/img/logo.png'][0][4:8]
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get(serveur_local + "inconnu.png")
+
+
+def test_transport_http2(serveur_local, tmp_path):
+    """Le transport HTTP/2 capture le site comme le transport par défaut (HTTP/1.1 en local)"""
+    pytest.importorskip('httpx')
+    pytest.importorskip('h2')
+
+    par_defaut = extraire_site_web(serveur_local, str(tmp_path / "a"))
+    http2 = extraire_site_web(serveur_local, str(tmp_path / "b"), transport='http2')
+    assert http2['erreurs'] == []
+    for cle in ('fichiers_css', 'fichiers_js', 'images'):
+        assert ([(f['url_original'], f['sha256']) for f in http2[cle]] ==
+                [(f['url_original'], f['sha256']) for f in par_defaut[cle]])
+
+
+def test_transport_http2_verify_et_proxies(serveur_local):
+    """Le transport HTTP/2 applique verify, cert et proxies comme le transport par défaut"""
+    import ssl
+    pytest.importorskip('httpx')
+    pytest.importorskip('h2')
+    from transports import AdaptateurHttp2, contexte_ssl
+
+    assert contexte_ssl() is True
+    assert contexte_ssl(False).verify_mode == ssl.CERT_NONE
+    with pytest.raises(OSError):
+        contexte_ssl('/inexistant/autorites.pem')
+
+    # Un hôte inexistant est joint à travers le proxy (ici le serveur local, qui répond 404)
+    session = requests.Session()
+    session.trust_env = False
+    session.mount('http://', AdaptateurHttp2())
+    reponse = session.get('http://hote-inexistant.invalid/index.html', proxies={'http': serveur_local}, timeout=5)
+    assert reponse.status_code == 404
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.get('http://hote-inexistant.invalid/index.html', timeout=5)
+    session.close()
+
+
+def test_droits_des_fichiers_ecrits(serveur_local, tmp_path):
+    """Les fichiers écrits par renommage atomique ont les droits d'un fichier ordinaire, jusque dans l'archive"""
+    import stat
+    import zipfile
+    from archives import creer_archive
+    from stockage_blobs import DROITS_FICHIERS
+
+    dossier = tmp_path / "site"
+    extraire_site_web(serveur_local, str(dossier), dossier_blobs=str(tmp_path / ".blobs"),
+                      dossier_cache=str(tmp_path / ".cache"))
+    for chemin in ('css/style.css', 'js/app.js', 'images/logo.png', 'manifeste.json', 'index.html'):
+        assert stat.S_IMODE(os.stat(dossier / chemin).st_mode) == DROITS_FICHIERS
+    assert all(stat.S_IMODE(os.stat(chemin).st_mode) == DROITS_FICHIERS
+               for chemin in (tmp_path / ".cache").iterdir())
+
+    creer_archive(str(dossier), str(tmp_path / "site.zip"))
+    with zipfile.ZipFile(tmp_path / "site.zip") as archive:
+        assert all(stat.S_IMODE(infos.external_attr >> 16) == DROITS_FICHIERS for infos in archive.infolist())
+
+
+def test_stockage_blobs_deduplique(serveur_local, tmp_path):
+    """Deux captures du même site partagent les mêmes blobs"""
+    from stockage_blobs import nettoyer_blobs, statistiques_blobs
+
+    blobs = str(tmp_path / ".blobs")
+    premier = extraire_site_web(serveur_local, str(tmp_path / "a"), dossier_blobs=blobs)
+    extraire_site_web(serveur_local, str(tmp_path / "b"), dossier_blobs=blobs)
+
+    assert premier['erreurs'] == []
+    stats = statistiques_blobs(blobs)
+    assert stats['blobs'] == len(FICHIERS)
+    assert stats['references'] == 2 * len(FICHIERS)
+    assert os.listdir(tmp_path / ".blobs" / "tmp") == []
+
+    # Les blobs restent tant qu'une tâche les référence
+    import shutil
+    shutil.rmtree(tmp_path / "a")
+    assert nettoyer_blobs(blobs) == 0
+    shutil.rmtree(tmp_path / "b")
+    assert nettoyer_blobs(blobs) == len(FICHIERS)
+
+
+def test_cache_http_revalidation(serveur_local, tmp_path):
+    """Le second passage sert les ressources fraîches du cache et revalide les autres"""
+    cache = str(tmp_path / "cache")
+    premier = extraire_site_web(serveur_local, str(tmp_path / "a"), dossier_cache=cache)
+    second = extraire_site_web(serveur_local, str(tmp_path / "b"), dossier_cache=cache)
+
+    assert premier['cache'] == {'hits': 0, 'misses': 6, 'revalidations': 0}
+    assert second['cache'] == {'hits': 1, 'misses': 2, 'revalidations': 3}
+    assert second['erreurs'] == []
+    for chemin_a, chemin_b in zip(premier['url_vers_fichier'].values(), second['url_vers_fichier'].values()):
+        with open(chemin_a, 'rb') as a, open(chemin_b, 'rb') as b:
+            assert a.read() == b.read()
+
+
+def test_cache_http_vary(serveur_local, tmp_path):
+    """Une réponse avec Vary ne resservit qu'aux mêmes en-têtes de requête ; Vary: * n'est jamais gardé"""
+    from cache_http import AdaptateurCache
+
+    adaptateur = AdaptateurCache(str(tmp_path / "cache"))
+    session = requests.Session()
+    session.mount('http://', adaptateur)
+
+    def lire(chemin, langue):
+        return session.get(serveur_local + chemin, headers={'Accept-Language': langue}).text
+
+    assert [lire('langue.txt', langue) for langue in ('fr', 'fr', 'en', 'en', 'fr')] == ['fr', 'fr', 'en', 'en', 'fr']
+    assert GestionnaireSite.requetes['/langue.txt'] == 3
+    assert [lire('partout.txt', langue) for langue in ('fr', 'fr')] == ['fr', 'fr']
+    assert GestionnaireSite.requetes['/partout.txt'] == 2
+    assert adaptateur.statistiques == {'hits': 2, 'misses': 5, 'revalidations': 0}
+
+
+@pytest.fixture
+def client_flask(tmp_path):
+    """Client de test Flask dont les dossiers pointent vers un répertoire temporaire"""
+    import flask_app
+
+    dossier = str(tmp_path / "downloads")
+    os.makedirs(dossier)
+    anciens = dict(flask_app.app.config)
+    flask_app.app.config.update({
+        'UPLOAD_FOLDER': dossier,
+        'BLOBS_FOLDER': os.path.join(dossier, '.blobs'),
+        'CACHE_FOLDER': os.path.join(dossier, '.cache'),
+        'INDEX_DB': os.path.join(dossier, '.index.sqlite3'),
+        'PROFILS_FOLDER': os.path.join(dossier, '.profils'),
+    })
+    yield flask_app.app.test_client()
+    flask_app.app.config.update(anciens)
+
+
+def attendre_tache(client, job_id, delai=10):
+    """Interroge /jobs/<id> jusqu'à la fin de la tâche"""
+    import time
+
+    limite = time.time() + delai
+    while time.time() < limite:
+        etat = client.get(f"/jobs/{job_id}").get_json()
+        if etat['status'] in ('terminee', 'echouee'):
+            return etat
+        time.sleep(0.05)
+    raise AssertionError("La tâche ne s'est pas terminée à temps")
+
+
+def test_scrape_en_arriere_plan(serveur_local, client_flask):
+    """/scrape renvoie un identifiant de tâche immédiatement, le résultat arrive ensuite"""
+    reponse = client_flask.post('/scrape', json={'url': serveur_local})
+    assert reponse.status_code == 202
+    job_id = reponse.get_json()['job_id']
+
+    etat = attendre_tache(client_flask, job_id)
+    assert etat['status'] == 'terminee'
+    assert etat['progress']['ressources_terminees'] == etat['progress']['ressources_total'] == 5
+
+    resultat = client_flask.get(f"/jobs/{job_id}/result", headers={'Accept': 'application/json'}).get_json()
+    assert resultat['resultat']['css_count'] == 2
+    archive = client_flask.get(f"/download/{resultat['resultat']['zip_file']}")
+    assert archive.status_code == 200
+    assert archive.data[:4] == b'PK\x03\x04'
+    # L'archive est produite à la volée : aucun ZIP n'est écrit sur le disque
+    import flask_app
+    assert not [nom for nom in os.listdir(flask_app.app.config['UPLOAD_FOLDER']) if nom.endswith('.zip')]
+    assert client_flask.get(f"/jobs/{job_id}/result").status_code == 200
+
+
+def test_archives_a_la_volee_pool_partage(serveur_local, client_flask, monkeypatch):
+    """Les archives produites à la volée utilisent le pool de compression commun, avec peu de workers"""
+    import flask_app
+
+    soumis = []
+    executeur = flask_app.executeur_compression
+
+    class ExecuteurCompte:
+        def submit(self, *args):
+            soumis.append(args)
+            return executeur.submit(*args)
+
+    monkeypatch.setattr(flask_app, 'executeur_compression', ExecuteurCompte())
+    monkeypatch.setitem(flask_app.app.config, 'WORKERS_COMPRESSION', 1)
+    job_id = client_flask.post('/scrape', json={'url': serveur_local, 'force': True}).get_json()['job_id']
+    assert attendre_tache(client_flask, job_id)['status'] == 'terminee'
+    resultat = client_flask.get(f"/jobs/{job_id}/result", headers={'Accept': 'application/json'}).get_json()
+    archives = []
+    for _ in range(2):
+        with client_flask.get(f"/download/{resultat['resultat']['zip_file']}") as reponse:
+            archives.append(reponse.data)
+    assert archives[0][:4] == b'PK\x03\x04' and archives[0] == archives[1]
+    assert soumis and len(soumis) % 2 == 0
+    resultat = client_flask.get(f"/jobs/{job_id}/result", headers={'Accept': 'application/json'}).get_json()
+    assert resultat['resultat']['archive']['nb_workers'] == 1
+
+
+def test_scrape_file_pleine(client_flask, monkeypatch):
+    """Une file pleine renvoie 429 au lieu d'accepter la tâche"""
+    import flask_app
+    from file_taches import FileTaches
+
+    file_bloquee = FileTaches(lambda tache: None, nb_workers=0, taille_max=1)
+    monkeypatch.setattr(flask_app, 'file_taches', file_bloquee)
+
+    assert client_flask.post('/scrape', json={'url': 'http://127.0.0.1:9/'}).status_code == 202
+    assert client_flask.post('/scrape', json={'url': 'http://127.0.0.1:9/'}).status_code == 429
+
+
+def test_file_taches_prise_aussitot_soumise():
+    """Une tâche prise par un worker dès sa mise en file est bien exécutée ; une tâche refusée est oubliée"""
+    import queue
+    from file_taches import FilePleine, FileTaches, TERMINEE
+
+    class FileLente(queue.Queue):
+        def put_nowait(self, element):
+            super().put_nowait(element)
+            time.sleep(0.05)  # le worker prend la tâche avant la fin de soumettre
+
+    executees = []
+    file = FileTaches(lambda tache: executees.append(tache['id']), nb_workers=1)
+    file.file = FileLente(maxsize=1)
+    tache = file.soumettre(url='http://exemple.test/')
+    file.file.join()
+    assert executees == [tache['id']] and file.obtenir(tache['id'])['statut'] == TERMINEE
+
+    bloquee = FileTaches(lambda tache: None, nb_workers=0, taille_max=1)
+    bloquee.soumettre(url='http://exemple.test/')
+    with pytest.raises(FilePleine):
+        bloquee.soumettre(url='http://exemple.test/')
+    assert len(bloquee.taches) == 1
+
+
+def test_cache_des_resultats(serveur_local, client_flask):
+    """Une URL déjà demandée réutilise la tâche en cours puis la capture terminée"""
+    import flask_app
+
+    flask_app.statistiques_cache.clear()
+    premiere = client_flask.post('/scrape', json={'url': serveur_local}).get_json()
+    seconde = client_flask.post('/scrape', json={'url': serveur_local + '#ancre'}).get_json()
+    assert premiere['cache'] == 'absent'
+    assert seconde['job_id'] == premiere['job_id']
+    assert seconde['cache'] in ('en_cours', 'frais')
+    attendre_tache(client_flask, premiere['job_id'])
+
+    reponse = client_flask.post('/scrape', json={'url': serveur_local})
+    assert reponse.status_code == 200
+    assert reponse.get_json()['cache'] == 'frais'
+    assert reponse.get_json()['job_id'] == premiere['job_id']
+    forcee = client_flask.post('/scrape', json={'url': serveur_local, 'force': True}).get_json()
+    assert forcee['cache'] == 'absent' and forcee['job_id'] != premiere['job_id']
+    attendre_tache(client_flask, forcee['job_id'])
+
+    stats = client_flask.get('/cache/stats').get_json()
+    assert (stats['demandes'], stats['absent']) == (4, 2)
+    assert stats['taux_reutilisation'] == 0.5
+
+
+def test_mesures_et_metrics(serveur_local, client_flask):
+    """Chaque tâche relève ses phases et ses compteurs, agrégés sur /metrics"""
+    reponse = client_flask.post('/scrape', json={'url': serveur_local, 'force': True})
+    job_id = reponse.get_json()['job_id']
+    assert attendre_tache(client_flask, job_id)['status'] == 'terminee'
+
+    resultat = client_flask.get(f"/jobs/{job_id}/result", headers={'Accept': 'application/json'}).get_json()
+    mesures = resultat['resultat']['mesures']
+    assert {'page', 'analyse', 'ressources', 'liens', 'ecriture', 'manifeste'} <= set(mesures['phases'])
+    assert mesures['ressources'] == {'css': 2, 'js': 1, 'images': 1}
+    assert mesures['erreurs'] == {'http': 1}
+    assert mesures['telechargements']['nombre'] == 5
+    assert mesures['octets'] > 256
+
+    texte = client_flask.get('/metrics').get_data(as_text=True)
+    assert '# TYPE scraper_phase_duree_secondes histogram' in texte
+    assert 'scraper_phase_duree_secondes_bucket{phase="ressources",le="+Inf"}' in texte
+    assert 'scraper_erreurs_total{genre="http"}' in texte
+    assert 'scraper_tache_duree_secondes_count ' in texte
+
+
+def test_profilage_a_la_demande(serveur_local, client_flask, tmp_path):
+    """Une tâche demandée avec profile=1 produit un profil et son résumé"""
+    import pstats
+
+    reponse = client_flask.post('/scrape', json={'url': serveur_local, 'profile': True})
+    job_id = reponse.get_json()['job_id']
+    assert attendre_tache(client_flask, job_id)['status'] == 'terminee'
+
+    resultat = client_flask.get(f"/jobs/{job_id}/result", headers={'Accept': 'application/json'}).get_json()
+    profil = resultat['resultat']['profil']
+    assert profil['threads'] > 1
+    assert any('extraire_site_web' in ligne['fonction'] for ligne in profil['fonctions'])
+    assert any('telecharger_fichier' in ligne['fonction'] for ligne in profil['fonctions'])
+    assert profil['allocations'] and profil['pic_memoire_octets'] > 0
+    assert 'Profil de la tâche' in client_flask.get(f"/jobs/{job_id}/result").get_data(as_text=True)
+
+    stats = client_flask.get(f"/jobs/{job_id}/profile")
+    assert stats.status_code == 200
+    (tmp_path / "job.pstats").write_bytes(stats.data)
+    assert pstats.Stats(str(tmp_path / "job.pstats")).total_calls > 0
+
+    # Les tâches ordinaires ne sont pas profilées
+    autre = client_flask.post('/scrape', json={'url': serveur_local, 'force': True}).get_json()['job_id']
+    attendre_tache(client_flask, autre)
+    assert client_flask.get(f"/jobs/{autre}/profile").status_code == 404
+
+
+def test_profilage_avec_pool_de_threads(tmp_path):
+    """Les threads d'un pool sont échantillonnés ; deux profilages simultanés passent l'un après l'autre"""
+    import pstats
+    from concurrent.futures import ThreadPoolExecutor
+    from profilage import Profilage
+
+    def calculer(n):
+        return sum(i * i for i in range(n))
+
+    def tache(nom):
+        with Profilage(str(tmp_path), nom) as profil:
+            with ThreadPoolExecutor(max_workers=4) as executeur:
+                assert len(list(executeur.map(calculer, [50000] * 8))) == 8
+        return profil.resume
+
+    with ThreadPoolExecutor(max_workers=2) as taches:
+        resumes = list(taches.map(tache, ['a', 'b']))
+
+    for nom, resume in zip('ab', resumes):
+        assert resume['threads'] > 1
+        stats = pstats.Stats(str(tmp_path / f"{nom}.pstats"))
+        assert any(fonction == 'calculer' for _, _, fonction in stats.stats)
+
+
+def test_pool_processus_renvoie_manifeste(serveur_local, tmp_path):
+    """En mode processus, la tâche complète s'exécute ailleurs et renvoie un manifeste léger"""
+    from pool_processus import PoolProcessus
+
+    pool = PoolProcessus(nb_processus=1, taches_par_processus=1)
+    try:
+        progression = pool.progression_partagee()
+        dossier = str(tmp_path / "site")
+        futurs = [pool.soumettre(serveur_local, f"{dossier}_{i}", f"{dossier}_{i}.zip", progression)
+                  for i in range(2)]
+        manifestes = [futur.result(timeout=60) for futur in futurs]
+    finally:
+        pool.arreter()
+
+    for i, manifeste in enumerate(manifestes):
+        assert manifeste['erreurs'] == []
+        assert 'html_original' not in manifeste
+        assert manifeste['html_size'] > 0
+        assert os.path.exists(f"{dossier}_{i}.zip")
+
+
+def test_exploration_liens_internes(serveur_local, tmp_path):
+    """L'exploration suit les liens internes, partage les ressources et réécrit les liens"""
+    from crawler import crawler_site
+
+    dossier = str(tmp_path / "site")
+    resultats = crawler_site(serveur_local, dossier, profondeur_max=1)
+
+    assert [p['profondeur'] for p in resultats['pages']] == [0, 1]
+    assert len(resultats['fichiers_css']) == 2
+    with open(f"{dossier}/index_local.html", encoding='utf-8') as f:
+        accueil = f.read()
+    page_2 = os.path.relpath(resultats['pages'][1]['fichier_local'], dossier)
+    assert f'href="{page_2}#haut"' in accueil
+    assert 'href="css/style.css"' in accueil
+    with open(resultats['pages'][1]['fichier_local'], encoding='utf-8') as f:
+        html_page_2 = f.read()
+    assert 'href="../index_local.html"' in html_page_2
+    assert 'href="../css/style.css"' in html_page_2
+    assert 'href="/page3.html"' in html_page_2
+
+    complet = crawler_site(serveur_local, str(tmp_path / "complet"), profondeur_max=2, pages_max=10)
+    assert len(complet['pages']) == 3
+    assert len(complet['images']) == 1
+
+
+def test_exploration_ecarte_documents_et_pages_trop_grandes(serveur_local, tmp_path, monkeypatch):
+    """Un lien vers un document n'est pas lu au-delà de ses en-têtes ; une page trop grande est refusée"""
+    import crawler
+
+    lues = []
+    lire = crawler.lire_page_html
+
+    def lire_page_html(response, *args):
+        lues.append(response.url)
+        return lire(response, *args)
+
+    monkeypatch.setattr(crawler, 'lire_page_html', lire_page_html)
+    resultats = crawler.crawler_site(serveur_local + "documents.html", str(tmp_path / "site"), profondeur_max=1,
+                                     tailles_max={'pages': len(GRANDE_PAGE) - 1})
+
+    assert [page['url'] for page in resultats['pages']] == [serveur_local + "documents.html",
+                                                            serveur_local + "page3.html"]
+    assert serveur_local + "gros.bin" not in lues
+    assert [erreur for erreur in resultats['erreurs'] if 'grande.html' in erreur]
+    assert len(resultats['images']) == 1
+
+
+def test_robots_lus_en_parallele_avant_echeance(serveur_local, tmp_path):
+    """Les robots.txt de plusieurs hôtes muets ne retardent pas la tâche au-delà de son échéance"""
+    import time
+    from app import TableUrls, creer_resultats, telecharger_ressources
+    from politesse import Ordonnanceur
+
+    class SessionRobotsMuets(requests.Session):
+        def get(self, url, **kwargs):
+            if url.endswith('/robots.txt'):
+                time.sleep(kwargs['timeout'])
+                raise requests.exceptions.Timeout(url)
+            return super().get(url, **kwargs)
+
+    hotes = ['http://127.0.0.1', 'http://localhost', 'http://127.0.0.2']
+    port = serveur_local.rsplit(':', 1)[1].rstrip('/')
+    ressources = [(f"{hote}:{port}/img/logo.png", 'images') for hote in hotes]
+    table = TableUrls(4, Ordonnanceur(robots=True), time.monotonic() + 1)
+    debut = time.monotonic()
+    telecharger_ressources(SessionRobotsMuets(), ressources, str(tmp_path), creer_resultats(),
+                           max_telechargements=4, table=table)
+    # Lus l'un après l'autre avec TIMEOUT_ROBOTS, ils auraient pris 3 × 10 s
+    assert time.monotonic() - debut < 2
+
+
+def test_ensemble_urls_compact():
+    """L'ensemble des URLs vues reste exact au-delà du tampon"""
+    from crawler import EnsembleUrls
+
+    vues = EnsembleUrls()
+    urls = [f"https://example.com/page/{i}" for i in range(10000)]
+    assert all(vues.ajouter(url) for url in urls)
+    assert not any(vues.ajouter(url) for url in urls[::7])
+    assert len(vues) == 10000
+    assert "https://example.com/page/10000" not in vues
+
+
+def test_ensemble_urls_ajouts_lineaires(monkeypatch):
+    """Le nombre d'empreintes recopiées par les fusions reste proportionnel au nombre d'ajouts"""
+    import crawler
+
+    recopiees = 0
+
+    def merge_compte(*suites):
+        nonlocal recopiees
+        for empreinte in crawler_merge(*suites):
+            recopiees += 1
+            yield empreinte
+
+    crawler_merge = crawler.merge
+    monkeypatch.setattr(crawler, 'merge', merge_compte)
+    monkeypatch.setattr(crawler.EnsembleUrls, 'TAILLE_TAMPON', 64)
+
+    vues = crawler.EnsembleUrls()
+    nombre = 50000
+    for i in range(nombre):
+        vues.ajouter(f"https://example.com/page/{i}")
+    assert len(vues) == nombre
+    # Avec un tampon de taille fixe, ce serait ~nombre² / (2 × 64), soit 390 × nombre
+    assert recopiees <= 20 * nombre
+
+
+def test_table_urls_regroupe_les_demandes():
+    """Une URL déjà en cours de téléchargement est attendue au lieu d'être relancée"""
+    from app import TableUrls
+
+    table = TableUrls()
+    assert table.reserver("https://example.com/a.js")
+    assert not table.reserver("https://example.com/a.js")
+
+    resultats = []
+    attente = threading.Thread(target=lambda: resultats.append(table.attendre("https://example.com/a.js")))
+    attente.start()
+    table.terminer("https://example.com/a.js", "site/js/a.js")
+    attente.join(timeout=5)
+    assert resultats == ["site/js/a.js"]
+
+
+def test_allocateur_noms_sans_ecraser(tmp_path):
+    """L'allocateur évite les fichiers existants et les noms déjà attribués"""
+    from app import AllocateurNoms
+
+    (tmp_path / "js").mkdir()
+    (tmp_path / "js" / "app.js").write_text("")
+    allocateur = AllocateurNoms()
+    assert allocateur.reserver(f"{tmp_path}/js/app.js") == f"{tmp_path}/js/app_1.js"
+    assert allocateur.reserver(f"{tmp_path}/js/app.js") == f"{tmp_path}/js/app_2.js"
+    assert allocateur.reserver(f"{tmp_path}/js/autre.js") == f"{tmp_path}/js/autre.js"
+
+
+def test_zip_genere_a_la_volee(serveur_local, tmp_path):
+    """L'archive produite par morceaux est un ZIP valide contenant tout le dossier"""
+    import io
+    import zipfile
+    from archives import generer_zip
+
+    dossier = str(tmp_path / "site")
+    extraire_site_web(serveur_local, dossier)
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(generer_zip(dossier))))
+
+    assert archive.testzip() is None
+    noms = sorted(archive.namelist())
+    attendus = sorted(os.path.relpath(os.path.join(racine, nom), dossier)
+                      for racine, _, fichiers in os.walk(dossier) for nom in fichiers)
+    assert noms == attendus
+    assert archive.read('css/style_1.css') == FICHIERS['/autre/style.css'][0]
+
+
+def test_archive_adaptative(serveur_local, tmp_path):
+    """Les images sont stockées sans compression, le texte est compressé ; tar.zst contient les mêmes fichiers"""
+    import io
+    import tarfile
+    import zipfile
+    zstandard = pytest.importorskip("zstandard")
+    from archives import creer_archive
+
+    dossier = str(tmp_path / "site")
+    extraire_site_web(serveur_local, dossier)
+
+    statistiques = creer_archive(dossier, str(tmp_path / "site.zip"), nb_workers=2)
+    archive = zipfile.ZipFile(tmp_path / "site.zip")
+    assert archive.testzip() is None
+    assert archive.getinfo('images/logo.png').compress_type == zipfile.ZIP_STORED
+    assert archive.getinfo('index.html').compress_type == zipfile.ZIP_DEFLATED
+    assert statistiques['membres'] == len(archive.namelist())
+    assert statistiques['membres_stockes'] >= 1
+    assert 0 < statistiques['ratio'] < 1 and statistiques['duree_s'] >= 0
+
+    statistiques = creer_archive(dossier, str(tmp_path / "site.tar.zst"))
+    assert statistiques['format'] == 'tar.zst'
+    with open(tmp_path / "site.tar.zst", 'rb') as f:
+        contenu = zstandard.ZstdDecompressor().stream_reader(f).read()
+    tar = tarfile.open(fileobj=io.BytesIO(contenu))
+    assert sorted(tar.getnames()) == sorted(archive.namelist())
+    assert tar.extractfile('css/style_1.css').read() == FICHIERS['/autre/style.css'][0]
+
+
+def test_zip_avec_et_sans_ecriture_brute(serveur_local, tmp_path, monkeypatch):
+    """Les membres compressés par les workers et ceux de ZipFile.open donnent la même archive ;
+    le Python des tests utilise bien les premiers"""
+    import io
+    import zipfile
+    import archives
+
+    # Le Python des tests doit compresser en parallèle (sinon zipfile a changé : adapter ecrire_membre_compresse)
+    assert archives.ECRITURE_BRUTE and archives.verifier_ecriture_brute()
+    monkeypatch.setattr(archives, 'ecrire_membre_compresse', lambda *args: None)
+    assert not archives.verifier_ecriture_brute()
+    monkeypatch.undo()
+
+    dossier = str(tmp_path / "site")
+    extraire_site_web(serveur_local, dossier)
+
+    contenus = []
+    for ecriture_brute in (True, False):
+        monkeypatch.setattr(archives, 'ECRITURE_BRUTE', ecriture_brute)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(archives.generer_zip(dossier, nb_workers=2))))
+        assert archive.testzip() is None
+        assert archive.getinfo('images/logo.png').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('index.html').compress_type == zipfile.ZIP_DEFLATED
+        contenus.append({nom: archive.read(nom) for nom in archive.namelist()})
+    assert contenus[0] == contenus[1]
+
+
+def test_manifeste_et_nettoyage(serveur_local, client_flask):
+    """Le manifeste décrit les fichiers de la tâche, l'index les sert ; le nettoyage supprime la tâche et ses blobs"""
+    import hashlib
+    import flask_app
+    from manifeste import lire_manifeste
+
+    job_id = client_flask.post('/scrape', json={'url': serveur_local}).get_json()['job_id']
+    assert attendre_tache(client_flask, job_id)['status'] == 'terminee'
+    resultat = flask_app.tasks[job_id]['resultat']
+    dossier = os.path.join(flask_app.app.config['UPLOAD_FOLDER'], resultat['folder'])
+
+    manifeste = lire_manifeste(dossier)
+    fichiers = {fichier['chemin']: fichier for fichier in manifeste['fichiers']}
+    logo = fichiers['images/logo.png']
+    contenu = FICHIERS['/img/logo.png'][0]
+    assert logo['taille'] == len(contenu)
+    assert logo['sha256'] == hashlib.sha256(contenu).hexdigest()
+    assert logo['type_mime'] == 'image/png'
+    assert logo['url'] == serveur_local + 'img/logo.png'
+    assert sorted(f['path'] for f in resultat['files']) == sorted(fichiers)
+
+    # La tâche et ses fichiers sont retrouvés dans l'index
+    assert client_flask.get(f"/preview/{resultat['folder']}/images/logo.png").mimetype == 'image/png'
+    assert client_flask.get(f"/preview/{resultat['folder']}/../../secret").status_code == 404
+    historique = client_flask.get('/jobs?q=127.0.0.1').get_json()['jobs']
+    assert [tache['job_id'] for tache in historique] == [job_id]
+    assets = client_flask.get(f"/assets?sha256={logo['sha256']}").get_json()['assets']
+    assert assets[0]['job_id'] == job_id and assets[0]['chemin'] == 'images/logo.png'
+
+    # Une tâche terminée peut être nettoyée dès qu'elle dépasse l'âge maximum
+    flask_app.cleanup_old_files(age_max=-1)
+    assert not os.path.exists(dossier)
+    assert client_flask.get('/jobs').get_json()['jobs'] == []
+    assert not os.path.exists(os.path.join(flask_app.app.config['BLOBS_FOLDER'], logo['sha256'][:2], logo['sha256']))
+
+
+def test_eviction_lru_avec_quota(tmp_path):
+    """Au-delà du quota, les tâches les moins récemment consultées partent en premier ;
+    les tâches en cours et en cours d'envoi sont conservées"""
+    import time
+    from concierge import DossiersEnService, liberer_place
+    from index_taches import IndexTaches
+
+    index = IndexTaches(str(tmp_path / "index.sqlite3"))
+    for numero, statut in enumerate(['terminee', 'terminee', 'terminee', 'en_cours', 'terminee']):
+        index.enregistrer_tache({
+            'id': f"tache{numero}", 'parametres': {'url': f"http://site{numero}/"}, 'dossier': f"dossier{numero}",
+            'statut': statut, 'erreur': None, 'resultat': None,
+            'cree_le': 1000 + numero, 'debut': 1000 + numero, 'fin': 1000 + numero,
+        })
+        index.enregistrer_fichiers(f"tache{numero}", {'fichiers': [
+            {'chemin': 'index.html', 'taille': 100, 'sha256': f"{numero:064x}", 'type_mime': 'text/html', 'url': None}]})
+    index.toucher('dossier0')  # la plus ancienne vient d'être téléchargée
+    en_service = DossiersEnService()
+
+    supprimes = []
+    with en_service.utiliser('dossier1'):
+        bilan = liberer_place(index, lambda entree: supprimes.append(entree['dossier']),
+                              quota_octets=250, delai_grace=0, en_service=en_service)
+    assert supprimes == ['dossier2', 'dossier4', 'dossier0']
+    assert bilan['evincees'] == 3 and bilan['octets_liberes'] == 300
+    assert index.octets_total() == 200
+    assert index.par_dossier('dossier1') and index.par_dossier('dossier3')
+
+    # Le délai de grâce protège une tâche consultée récemment
+    index.toucher('dossier1')
+    assert liberer_place(index, supprimes.append, quota_octets=0, delai_grace=60)['evincees'] == 0
+    time.sleep(0.01)
+    assert liberer_place(index, supprimes.append, quota_octets=0, delai_grace=0)['evincees'] == 1
+
+
+def ajouter_tache_index(index, numero, statut='terminee', taille=100, sha256=True):
+    """Enregistre une tâche d'une page dans l'index"""
+    index.enregistrer_tache({
+        'id': f"tache{numero}", 'parametres': {'url': f"http://site{numero}/", 'cle': f"cle{numero}"},
+        'dossier': f"dossier{numero}", 'statut': statut, 'erreur': None, 'resultat': None,
+        'cree_le': 1000 + numero, 'debut': 1000 + numero, 'fin': 1000 + numero,
+    })
+    index.enregistrer_fichiers(f"tache{numero}", {'fichiers': [
+        {'chemin': 'index.html', 'taille': taille, 'sha256': f"{numero:064x}" if sha256 else None,
+         'type_mime': 'text/html', 'url': None}]})
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_index_migration_vers_v3(tmp_path, version):
+    """Une base créée par une version antérieure est migrée en place, sans perdre ses tâches"""
+    import sqlite3
+    from index_taches import IndexTaches, MIGRATIONS, VERSION_SCHEMA
+
+    chemin = str(tmp_path / "index.sqlite3")
+    connexion = sqlite3.connect(chemin)
+    for numero in range(1, version + 1):
+        connexion.executescript(MIGRATIONS[numero])
+    connexion.execute("INSERT INTO taches (id, url, dossier, statut, cree_le, fin) "
+                      "VALUES ('ancienne', 'http://ancien/', 'dossier_ancien', 'terminee', 1000, 1000)")
+    connexion.execute("INSERT INTO fichiers (tache_id, chemin, taille, sha256) VALUES ('ancienne', 'index.html', 42, NULL)")
+    connexion.execute(f'PRAGMA user_version={version}')
+    connexion.commit()
+    connexion.close()
+
+    index = IndexTaches(chemin)
+    assert index._connexion().execute('PRAGMA user_version').fetchone()[0] == VERSION_SCHEMA
+    assert index.par_dossier('dossier_ancien')['parametres'] == {'url': 'http://ancien/'}
+    assert index.fichiers('ancienne')[0]['taille'] == 42
+    # Colonnes des versions 2 (taille, dernier accès) et 3 (clé de cache) utilisables
+    if version == 1:
+        assert index.octets_total() == 42
+    index.toucher('dossier_ancien')
+    ajouter_tache_index(index, 1)
+    assert index.tache_recente('cle1', 0, 0)['id'] == 'tache1'
+    # Rouvrir une base à jour ne rejoue aucune migration
+    assert IndexTaches(chemin).octets_total() == index.octets_total()
+
+
+def test_index_ecrivains_concurrents_wal(tmp_path):
+    """Plusieurs index ouverts sur la même base (comme plusieurs processus) écrivent en même temps"""
+    from index_taches import IndexTaches
+
+    chemin = str(tmp_path / "index.sqlite3")
+    index = [IndexTaches(chemin) for _ in range(2)]
+    assert index[0]._connexion().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    erreurs = []
+    lectures = []
+
+    def ecrire(numero_ecrivain):
+        try:
+            for numero in range(numero_ecrivain * 100, numero_ecrivain * 100 + 50):
+                ajouter_tache_index(index[numero_ecrivain % 2], numero)
+                lectures.append(len(index[(numero_ecrivain + 1) % 2].historique(limite=500)))
+        except Exception as e:
+            erreurs.append(e)
+
+    threads = [threading.Thread(target=ecrire, args=(numero,)) for numero in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert erreurs == []
+    assert len(index[1].historique(limite=500)) == 200
+    assert index[0].octets_total() == index[1].octets_total() == 200 * 100
+    # Les lecteurs voient des tâches entières pendant les écritures, jamais de fichiers orphelins
+    assert lectures and max(lectures) <= 200
+    assert index[0]._connexion().execute(
+        'SELECT COUNT(*) FROM fichiers WHERE tache_id NOT IN (SELECT id FROM taches)').fetchone()[0] == 0
+
+
+def test_requetes_du_nettoyage(tmp_path):
+    """Expiration, candidats à l'éviction et retrait, avec les index SQL attendus"""
+    from index_taches import IndexTaches
+
+    index = IndexTaches(str(tmp_path / "index.sqlite3"))
+    for numero, statut in enumerate(['terminee', 'echouee', 'en_attente', 'en_cours', 'terminee']):
+        ajouter_tache_index(index, numero, statut, sha256=numero != 4)
+    index.toucher('dossier0')
+
+    requetes = []
+    index._connexion().set_trace_callback(requetes.append)
+    candidats = index.candidats_eviction(2000, exclure={'dossier1'})
+    assert [candidat['id'] for candidat in candidats] == ['tache4']
+    assert [candidat['id'] for candidat in index.candidats_eviction(2000, limite=1)] == ['tache1']
+    index._connexion().set_trace_callback(None)
+    assert len(requetes) == 2
+    for requete in requetes:
+        plan = ' '.join(ligne[3] for ligne in index._connexion().execute('EXPLAIN QUERY PLAN ' + requete))
+        assert 'USING INDEX taches_utilisation' in plan, plan
+
+    # Les tâches actives ne sont ni retirées ni expirées
+    assert index.retirer('tache3') is None
+    entree = index.retirer('tache4')
+    assert entree == {'dossier': 'dossier4', 'octets': 100, 'empreintes': [], 'empreintes_completes': False}
+    assert index.fichiers('tache4') == []
+    expirees = index.expirer(0, exclure={'dossier0'})
+    assert [entree['dossier'] for entree in expirees] == ['dossier1']
+    assert expirees[0]['empreintes'] == [f"{1:064x}"] and expirees[0]['empreintes_completes']
+    assert [tache['id'] for tache in index.historique()] == ['tache3', 'tache2', 'tache0']
+
+
+def test_bench_site_synthetique(tmp_path):
+    """Le benchmark mesure un petit scénario et signale une régression par rapport à une référence"""
+    from bench_scraper import executer_job, mesurer_scenario, comparer
+
+    # Une tâche dont la page est injoignable compte comme un échec
+    assert executer_job('http://127.0.0.1:9/', str(tmp_path / "injoignable"), 'zip')[1:] == (None, False)
+
+    parametres = {'nb_css': 2, 'nb_js': 1, 'nb_images': 4, 'taille_image': 4096, 'taux_erreur': 0.5}
+    mesures = mesurer_scenario(parametres, nb_jobs=3, concurrence=2)
+    assert mesures['echecs'] == 0
+    assert mesures['latence_p50_s'] <= mesures['latence_p99_s']
+    assert mesures['archive_p50_s'] is not None and mesures['pic_rss_mo'] > 0
+
+    reference = {'scenarios': {'petit': mesures}}
+    resultats = {'scenarios': {'petit': dict(mesures, latence_p99_s=mesures['latence_p99_s'] + 1)}}
+    lignes, ignores = comparer(resultats, reference, 0.15)
+    assert not ignores
+    assert [ligne[1] for ligne in lignes if ligne[-1]] == ['latence_p99_s']
+    reference['scenarios']['petit']['jobs'] = 10
+    assert comparer(resultats, reference, 0.15) == ([], ['petit'])
+
+
+def test_politesse_retry_after_et_autres_hotes(serveur_local, tmp_path):
+    """Un hôte en pause (429 + Retry-After) ne bloque pas les autres, puis est redemandé"""
+    import time
+    import requests
+    from app import TableUrls, creer_resultats, creer_session, telecharger_ressources
+    from politesse import Ordonnanceur
+
+    ordonnanceur = Ordonnanceur(max_par_hote=1)
+    session, _ = creer_session(2, ordonnanceur=ordonnanceur)
+    autre_hote = serveur_local.replace('127.0.0.1', 'localhost')
+    ressources = [(serveur_local + 'limite.png', 'images'), (serveur_local + 'css/style.css', 'css')]
+    ressources += [(autre_hote + 'js/app.js', 'js'), (autre_hote + 'autre/style.css', 'css'),
+                   (autre_hote + 'img/logo.png', 'images')]
+    resultats = creer_resultats()
+    fins = {}
+    original = session.get
+
+    def get_horodate(url, **kwargs):
+        reponse = original(url, **kwargs)
+        fins[url] = time.monotonic()
+        return reponse
+    session.get = get_horodate
+
+    debut = time.monotonic()
+    telecharger_ressources(session, ressources, str(tmp_path), resultats, 2,
+                           table=TableUrls(ordonnanceur=ordonnanceur))
+    assert time.monotonic() - debut >= 1
+    assert GestionnaireSite.requetes['/limite.png'] == 2
+    assert (len(resultats['images']), len(resultats['fichiers_css']), len(resultats['fichiers_js'])) == (2, 2, 1)
+    # L'autre hôte a été servi pendant la pause
+    assert max(fins[url] for url, _ in ressources[2:]) - debut < 0.9
+
+
+def test_scanner_css_par_morceaux():
+    """Le découpage ne dépend pas de la taille des morceaux et restitue exactement la feuille"""
+    from feuilles_css import Reference, ScannerCss
+
+    feuille = THEME['/theme/theme.css'][0].decode() + ' .m { x: myurl(x.png) } .v { background: url() }'
+    attendu = None
+    for taille in (1, 2, 3, 7, 64, len(feuille)):
+        scanner = ScannerCss()
+        segments = []
+        for i in range(0, len(feuille), taille):
+            segments += scanner.alimenter(feuille[i:i + taille])
+        segments += scanner.terminer()
+        assert ''.join(s.brut if isinstance(s, Reference) else s for s in segments) == feuille
+        references = [(s.genre, s.valeur) for s in segments if isinstance(s, Reference)]
+        attendu = attendu or references
+        assert references == attendu
+    assert attendu == [('import', 'base.css'), ('url', '../polices/titre.woff2?v=2#x'), ('url', '/img/logo.png')]
+
+
+def test_feuilles_css_importees_et_reecrites(serveur_local, tmp_path):
+    """@import et url() sont téléchargés via la même table, puis la feuille pointe vers les fichiers locaux"""
+    from app import TableUrls, creer_resultats, creer_session, telecharger_ressources, traiter_feuilles_css
+
+    session, _ = creer_session(4)
+    dossier = str(tmp_path)
+    resultats = creer_resultats()
+    table = TableUrls()
+    ressources = [(serveur_local + 'theme/theme.css', 'css'), (serveur_local + 'img/logo.png', 'images')]
+    telecharger_ressources(session, ressources, dossier, resultats, table=table)
+    traiter_feuilles_css(session, dossier, resultats, table=table)
+
+    assert [os.path.basename(f['fichier_local']) for f in resultats['fichiers_css']] == ['theme.css', 'base.css']
+    assert [os.path.basename(f['fichier_local']) for f in resultats['polices']] == ['titre.woff2']
+    assert GestionnaireSite.requetes['/img/logo.png'] == 1
+    with open(f"{dossier}/css/theme.css", encoding='utf-8') as f:
+        theme = f.read()
+    assert '@import url("base.css")' in theme
+    assert 'url("../polices/titre.woff2#x")' in theme
+    assert 'url("../images/logo.png")' in theme
+    assert 'url(commentaire.png)' in theme and '"url(chaine.png)"' in theme and 'url(data:' in theme
+    with open(f"{dossier}/css/base.css", encoding='utf-8') as f:
+        assert f.read() == 'body { background: url("../images/fond.png") }'
+    import hashlib
+    entree = resultats['fichiers_css'][0]
+    assert entree['taille'] == len(theme.encode())
+    assert entree['sha256'] == hashlib.sha256(theme.encode()).hexdigest()
+
+
+def test_echeance_capture_partielle(serveur_local, tmp_path):
+    """À l'échéance, les ressources restantes sont listées et gardent leur URL d'origine"""
+    from app import analyser_page
+    from bs4 import BeautifulSoup
+
+    ressources, _ = analyser_page(BeautifulSoup(PAGE_BUDGET_HTML, 'html.parser'), serveur_local)
+    assert [url for url, _ in ressources] == [serveur_local + 'css/style.css', serveur_local + 'lent.png',
+                                             serveur_local + 'img/logo.png']
+
+    dossier = str(tmp_path / 'partiel')
+    debut = time.monotonic()
+    resultats = extraire_site_web(serveur_local + 'budget.html', dossier, max_telechargements=1, delai_max=0.5)
+    assert time.monotonic() - debut < 1.5
+    assert resultats['erreurs'] == []
+    assert [f['url_original'] for f in resultats['fichiers_css']] == [serveur_local + 'css/style.css']
+    assert resultats['ignorees'] == [{'url': serveur_local + 'lent.png', 'type': 'images'},
+                                     {'url': serveur_local + 'img/logo.png', 'type': 'images'}]
+    assert not os.path.exists(f"{dossier}/images") or os.listdir(f"{dossier}/images") == []
+    with open(f"{dossier}/index_local.html", encoding='utf-8') as f:
+        html_local = f.read()
+    assert f'src="{serveur_local}lent.png"' in html_local
+    assert f'src="{serveur_local}img/logo.png"' in html_local
+    assert f'href="{dossier}/css/style.css"' in html_local
+    from manifeste import lire_manifeste
+    assert lire_manifeste(dossier)['ignorees'] == resultats['ignorees']
+
+
+def test_memoire_reduite_grande_page(serveur_local, tmp_path):
+    """En mémoire réduite, mêmes ressources qu'avec BeautifulSoup, page recopiée à l'octet près hors liens"""
+    import tracemalloc
+
+    url = serveur_local + 'grande.html'
+    normal = extraire_site_web(url, str(tmp_path / 'normal'))
+    dossier = str(tmp_path / 'flux')
+    tracemalloc.start()
+    try:
+        reduit = extraire_site_web(url, dossier, memoire_reduite=True)
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    taille = len(GRANDE_PAGE_HTML.encode('utf-8'))
+    assert taille > 3 * 1024 * 1024
+    assert pic < taille / 2
+    assert reduit['erreurs'] == []
+    assert reduit['html_original'] == '' and reduit['html_taille'] == taille
+    for cle in ('fichiers_css', 'fichiers_js', 'images'):
+        assert [f['url_original'] for f in reduit[cle]] == [f['url_original'] for f in normal[cle]]
+
+    with open(f"{dossier}/index.html", 'rb') as f:
+        assert f.read() == GRANDE_PAGE_HTML.encode('utf-8')
+    with open(f"{dossier}/index_local.html", encoding='utf-8') as f:
+        html_local = f.read()
+    assert f'SRC="{dossier}/images/logo.png"' in html_local
+    for chemin, valeur in ((f'"{dossier}/images/logo.png"', '/img/logo.png'),
+                           (f"'{dossier}/js/app.js'", "'/js/app.js'"),
+                           (f'"{dossier}/css/style.css"', '"/css/style.css"')):
+        html_local = html_local.replace(chemin, valeur)
+    assert html_local == GRANDE_PAGE_HTML
+
+
+def test_politesse_debit_et_crawl_delay():
+    """Le seau à jetons espace les requêtes ; le Crawl-delay du robots.txt abaisse le débit"""
+    import time
+    from politesse import Ordonnanceur, duree_retry_after
+
+    ordonnanceur = Ordonnanceur(requetes_par_seconde=20, rafale=1)
+    debut = time.monotonic()
+    for _ in range(5):
+        with ordonnanceur.creneau('http://exemple.test/page'):
+            pass
+    assert time.monotonic() - debut >= 0.18
+
+    class SessionRobots:
+        def get(self, url, timeout=None):
+            assert url == 'http://lent.test/robots.txt'
+            return type('Reponse', (), {'status_code': 200, 'text': 'User-agent: *\nCrawl-delay: 3\n'})()
+
+    poli = Ordonnanceur(robots=True)
+    poli.preparer(SessionRobots(), 'http://lent.test/a.html')
+    assert poli.reserver('http://lent.test') == 0
+    poli.liberer('http://lent.test')
+    assert 2.5 < poli.reserver('http://lent.test') <= 3
+
+    # Une lecture de robots.txt ne dépasse pas l'échéance de la tâche, et n'est pas retenue si elle l'atteint
+    class SessionMuette:
+        delais = []
+
+        def get(self, url, timeout=None):
+            SessionMuette.delais.append(timeout)
+            time.sleep(timeout)
+            raise requests.exceptions.Timeout(url)
+
+    poli.preparer(SessionMuette(), 'http://muet.test/a.html', time.monotonic() + 0.2)
+    assert SessionMuette.delais[0] <= 0.2
+    poli.preparer(SessionMuette(), 'http://muet.test/a.html', time.monotonic() - 1)
+    assert len(SessionMuette.delais) == 1
+    assert poli._hotes['http://muet.test'].robots_lu_le is None
+    assert duree_retry_after('120') == 120
+    assert duree_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+
+def test_ordonnanceur_oublie_les_hotes_inactifs(monkeypatch):
+    """Un ordonnanceur partagé ne garde pas indéfiniment l'état des hôtes inactifs"""
+    import politesse
+    from politesse import Ordonnanceur
+
+    ordonnanceur = Ordonnanceur(requetes_par_seconde=1000, rafale=1000)
+    for i in range(100):
+        with ordonnanceur.creneau(f'http://hote{i}.test/page'):
+            pass
+    assert ordonnanceur.reserver('http://occupe.test') == 0
+    assert len(ordonnanceur._hotes) == 101
+
+    # Le prochain accès oublie les hôtes inutilisés, mais pas celui qui a une requête en cours
+    monkeypatch.setattr(politesse, 'DUREE_INACTIVITE', 0)
+    with ordonnanceur.creneau('http://nouveau.test/page'):
+        pass
+    assert set(ordonnanceur._hotes) == {'http://occupe.test', 'http://nouveau.test'}
+    ordonnanceur.liberer('http://occupe.test')
+    assert ordonnanceur._hotes['http://occupe.test'].actives == 0
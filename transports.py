@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Transports HTTP des tâches
+
+Un transport est un adaptateur requests (send et close) monté sur la
+session de la tâche, comme le cache HTTP : la page principale, les pages
+explorées, les ressources (telecharger_fichier) et les robots.txt passent
+tous par lui, sans que le reste du code ne change.
+
+Transports disponibles :
+    'requests'        urllib3, HTTP/1.1 (défaut)
+    'http2'           httpx, HTTP/2 : les petites ressources d'un même hôte
+                      partagent une connexion multiplexée (nécessite le
+                      paquet httpx[http2])
+    'enregistrement'  comme 'requests', en gardant chaque réponse dans un
+                      dossier de capture
+    'rejeu'           sert les réponses d'une capture, sans réseau : pour des
+                      mesures de performance reproductibles
+
+Le cache HTTP (dossier_cache) s'applique aux transports 'requests' et
+'http2' ; une capture enregistre ou rejoue toujours le réseau lui-même.
+"""
+
+import os
+import re
+import ssl
+import threading
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, get_encoding_from_headers, select_proxy
+
+from cache_http import AdaptateurCache, CacheDisque, FluxEnregistre, filtrer_en_tetes
+
+try:
+    import httpx
+except ImportError:  # transport http2 indisponible
+    httpx = None
+
+TRANSPORTS = ('requests', 'http2', 'enregistrement', 'rejeu')
+TRANSPORT_DEFAUT = 'requests'
+
+# En-têtes propres à une connexion HTTP/1.1, interdits en HTTP/2
+EN_TETES_CONNEXION = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+PLAGE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+class FluxHttpx:
+    """
+    Corps d'une réponse httpx lu comme le flux brut d'une réponse requests
+
+    Les erreurs de lecture sont converties en exceptions requests, pour être
+    traitées comme celles du transport par défaut.
+    """
+
+    def __init__(self, reponse):
+        self._reponse = reponse
+        self._morceaux = reponse.iter_bytes()
+        self._reste = b''
+
+    def read(self, amt=None, decode_content=True, **kwargs):
+        try:
+            if amt is None:
+                donnees, self._reste = self._reste + b''.join(self._morceaux), b''
+                return donnees
+            while len(self._reste) < amt:
+                morceau = next(self._morceaux, None)
+                if morceau is None:
+                    break
+                self._reste += morceau
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e)
+        donnees, self._reste = self._reste[:amt], self._reste[amt:]
+        return donnees
+
+    def close(self):
+        self._reponse.close()
+
+    def release_conn(self):
+        self._reponse.close()
+
+    @property
+    def closed(self):
+        return self._reponse.is_closed
+
+
+def contexte_ssl(verify=True, cert=None):
+    """
+    Paramètre verify d'un client httpx équivalent aux paramètres verify et cert de requests
+
+    Args:
+        verify (bool | str): Vérifier les certificats, ou fichier / dossier des autorités
+        cert (str | tuple): Certificat client (fichier, ou couple certificat et clé)
+
+    Returns:
+        True (vérification par défaut) ou un ssl.SSLContext
+    """
+    if verify is True and cert is None:
+        return True
+    if verify is False:
+        contexte = ssl.create_default_context()
+        contexte.check_hostname = False
+        contexte.verify_mode = ssl.CERT_NONE
+    elif verify is True:
+        contexte = ssl.create_default_context(cafile=DEFAULT_CA_BUNDLE_PATH)
+    elif os.path.isdir(verify):
+        contexte = ssl.create_default_context(capath=verify)
+    else:
+        contexte = ssl.create_default_context(cafile=verify)
+    if isinstance(cert, tuple):
+        contexte.load_cert_chain(*cert)
+    elif cert:
+        contexte.load_cert_chain(cert)
+    return contexte
+
+
+class AdaptateurHttp2(HTTPAdapter):
+    """
+    Adaptateur requests qui envoie les requêtes avec un client httpx en HTTP/2
+
+    Les serveurs sans HTTP/2 sont joints en HTTP/1.1. Les redirections et les
+    cookies restent gérés par la session requests, comme les proxys et la
+    vérification TLS (verify, cert, proxies de la requête) : un client httpx
+    est créé pour chaque combinaison rencontrée.
+    """
+
+    def __init__(self, pool_maxsize=10, **kwargs):
+        if httpx is None:
+            raise RuntimeError("Le transport http2 nécessite le paquet httpx (pip install 'httpx[http2]')")
+        super().__init__(pool_maxsize=pool_maxsize, **kwargs)
+        self._taille_pool = pool_maxsize
+        self._clients = {}
+        self._verrou_clients = threading.Lock()
+        # Vérifie dès maintenant la présence du paquet h2
+        self._client(True, None, None)
+
+    def _client(self, verify, cert, proxy):
+        cle = (verify, tuple(cert) if isinstance(cert, (list, tuple)) else cert, proxy)
+        with self._verrou_clients:
+            client = self._clients.get(cle)
+            if client is None:
+                try:
+                    # Les proxys de l'environnement sont déjà résolus par la session requests
+                    client = httpx.Client(http2=True, follow_redirects=False, trust_env=False,
+                                          verify=contexte_ssl(verify, cle[1]), proxy=proxy,
+                                          limits=httpx.Limits(max_connections=self._taille_pool,
+                                                              max_keepalive_connections=self._taille_pool))
+                except ImportError:  # paquet h2 absent
+                    raise RuntimeError("Le transport http2 nécessite le paquet httpx (pip install 'httpx[http2]')")
+                self._clients[cle] = client
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        client = self._client(verify, cert, select_proxy(request.url, proxies))
+        en_tetes = {nom: valeur for nom, valeur in request.headers.items() if nom.lower() not in EN_TETES_CONNEXION}
+        requete = client.build_request(request.method, request.url, headers=en_tetes,
+                                       content=request.body, timeout=timeout)
+        try:
+            reponse = client.send(requete, stream=True)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        resultat = Response()
+        resultat.status_code = reponse.status_code
+        resultat.reason = reponse.reason_phrase
+        resultat.headers = CaseInsensitiveDict(reponse.headers.items())
+        resultat.encoding = get_encoding_from_headers(resultat.headers)
+        resultat.raw = FluxHttpx(reponse)
+        resultat.url = request.url
+        resultat.request = request
+        resultat.connection = self
+        return resultat
+
+    def close(self):
+        with self._verrou_clients:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+        super().close()
+
+
+class AdaptateurHttp2Cache(AdaptateurCache, AdaptateurHttp2):
+    """Cache HTTP persistant devant le transport HTTP/2"""
+
+
+class AdaptateurEnregistrement(HTTPAdapter):
+    """
+    Adaptateur requests qui garde chaque réponse reçue dans un dossier de capture
+
+    Les réponses sont rangées par URL (voir CacheDisque), quel que soit leur
+    statut ; le corps n'est gardé que s'il a été lu jusqu'au bout. Les
+    requêtes Range ne sont pas enregistrées : le rejeu les sert à partir
+    de la réponse entière.
+    """
+
+    def __init__(self, dossier, **kwargs):
+        super().__init__(**kwargs)
+        self.capture = CacheDisque(dossier)
+
+    def send(self, request, **kwargs):
+        reponse = super().send(request, **kwargs)
+        if request.method != 'GET' or 'Range' in request.headers:
+            return reponse
+        meta = {
+            'url': request.url,
+            'statut': reponse.status_code,
+            'raison': reponse.reason,
+            'en_tetes': filtrer_en_tetes(reponse.headers),
+        }
+        reponse.raw = FluxEnregistre(reponse.raw, self.capture, self.capture.cle(request.url), meta)
+        return reponse
+
+
+class FluxPlage:
+    """Lecture limitée à taille octets d'un fichier déjà positionné"""
+
+    def __init__(self, fichier, taille):
+        self._fichier = fichier
+        self._reste = taille
+
+    def read(self, amt=None, **kwargs):
+        amt = self._reste if amt is None else min(amt, self._reste)
+        donnees = self._fichier.read(amt)
+        self._reste -= len(donnees)
+        return donnees
+
+    def close(self):
+        self._fichier.close()
+
+    @property
+    def closed(self):
+        return self._fichier.closed
+
+
+class AdaptateurRejeu(BaseAdapter):
+    """
+    Adaptateur requests qui sert les réponses d'une capture, sans réseau
+
+    Une URL absente de la capture échoue comme une erreur réseau. Les
+    requêtes Range sont servies à partir de la réponse entière, tant que le
+    validateur If-Range correspond. Aucune connexion n'étant ouverte, les
+    paramètres verify, cert et proxies sont sans objet.
+    """
+
+    def __init__(self, dossier):
+        super().__init__()
+        self.capture = CacheDisque(dossier)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        entree = self.capture.lire(self.capture.cle(request.url)) if request.method == 'GET' else None
+        if entree is None:
+            raise requests.exceptions.ConnectionError(f"absent de la capture: {request.url}", request=request)
+        meta, corps = entree
+
+        reponse = Response()
+        reponse.status_code = meta['statut']
+        reponse.reason = meta['raison']
+        reponse.headers = CaseInsensitiveDict(meta['en_tetes'])
+        reponse.headers['Content-Length'] = str(meta['taille'])
+        reponse.raw = corps
+
+        plage = PLAGE.fullmatch(request.headers.get('Range', ''))
+        validateur = request.headers.get('If-Range')
+        if (plage and meta['statut'] == 200
+                and validateur in (None, reponse.headers.get('ETag'), reponse.headers.get('Last-Modified'))):
+            debut = int(plage.group(1))
+            fin = min(int(plage.group(2)) + 1 if plage.group(2) else meta['taille'], meta['taille'])
+            if debut >= fin:
+                reponse.status_code, reponse.reason = 416, 'Range Not Satisfiable'
+                reponse.headers['Content-Range'] = f"bytes */{meta['taille']}"
+                fin = debut = 0
+            else:
+                reponse.status_code, reponse.reason = 206, 'Partial Content'
+                reponse.headers['Content-Range'] = f"bytes {debut}-{fin - 1}/{meta['taille']}"
+            corps.seek(debut)
+            reponse.raw = FluxPlage(corps, fin - debut)
+            reponse.headers['Content-Length'] = str(fin - debut)
+
+        reponse.encoding = get_encoding_from_headers(reponse.headers)
+        reponse.url = request.url
+        reponse.request = request
+        reponse.connection = self
+        return reponse
+
+    def close(self):
+        pass
+
+
+def creer_adaptateur(transport=TRANSPORT_DEFAUT, pool_maxsize=10, dossier_cache=None, dossier_capture=None):
+    """
+    Crée l'adaptateur d'un transport
+
+    Args:
+        transport (str): Un des TRANSPORTS
+        pool_maxsize (int): Connexions gardées ouvertes par hôte
+        dossier_cache (str): Cache HTTP persistant ('requests' et 'http2')
+        dossier_capture (str): Dossier de capture ('enregistrement' et 'rejeu')
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Transport inconnu: {transport} (disponibles : {', '.join(TRANSPORTS)})")
+    if transport in ('enregistrement', 'rejeu') and not dossier_capture:
+        raise ValueError(f"Le transport {transport} nécessite un dossier de capture")
+
+    if transport == 'rejeu':
+        return AdaptateurRejeu(dossier_capture)
+    if transport == 'enregistrement':
+        return AdaptateurEnregistrement(dossier_capture, pool_maxsize=pool_maxsize)
+    if transport == 'http2':
+        if dossier_cache:
+            return AdaptateurHttp2Cache(dossier_cache, pool_maxsize=pool_maxsize)
+        return AdaptateurHttp2(pool_maxsize=pool_maxsize)
+    if dossier_cache:
+        return AdaptateurCache(dossier_cache, pool_maxsize=pool_maxsize)
+    return HTTPAdapter(pool_maxsize=pool_maxsize)